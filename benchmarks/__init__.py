@@ -0,0 +1,3 @@
+#
+# Benchmark suite. Run with `python -m benchmarks --help`.
+#
@@ -0,0 +1,6 @@
+from __future__ import absolute_import
+from .run import main
+import sys
+
+
+sys.exit(main())
@@ -0,0 +1,89 @@
+#
+# Benchmark cases: one per command line utility and option of interest,
+# every csvconvert reader/writer pair, and the library functions.
+#
+
+from __future__ import absolute_import
+import collections
+import os
+import sys
+
+
+Case = collections.namedtuple('Case', 'name dataset args')
+
+# Readers and the dataset each reads.
+READERS = (
+    ('csv', 'narrow_text'),
+    ('json', 'narrow_json'),
+    ('columnar', 'narrow_columnar'),
+    ('xlsx_basic', 'sparse_xlsx'))
+WRITERS = ('csv', 'columnar', 'html', 'json', 'table', 'xlsx_basic')
+
+
+def cli(util, *args):
+    """
+    Build the arguments of a command line benchmark. Utilities are run
+    through the current interpreter so console scripts need not be on PATH.
+    The input path is substituted for `{path}`.
+    :param util:        Name of a function in csvutils.cli
+    :param args:        Command line arguments
+    :return function:   Input path to argv
+    """
+    code = 'from csvutils.cli import {0}; {0}()'.format(util)
+
+    return lambda path: [sys.executable, '-c', code] + \
+        [x.format(path=path) for x in args]
+
+def library(name):
+    """
+    Build the arguments of a library benchmark, see benchmarks.library.
+    :param name:        Name in benchmarks.library.FUNCTIONS
+    :return function:   Input path to argv
+    """
+    return lambda path: [sys.executable, '-m', 'benchmarks.library', name,
+        path]
+
+def _cases():
+    yield Case('csvsum.wide', 'wide_numeric', cli('csvsum', '{path}'))
+    yield Case('csvsum.wide.float', 'wide_numeric',
+        cli('csvsum', '{path}', '--numeric-mode', 'float'))
+    yield Case('csvsum.wide.batch', 'wide_numeric',
+        cli('csvsum', '{path}', '--numeric-mode', 'float',
+            '--batch-size', '1000'))
+    yield Case('csvsum.quoted', 'quoted_multiline',
+        cli('csvsum', '{path}', '-c', 'amount'))
+    yield Case('csvavg.wide', 'wide_numeric', cli('csvavg', '{path}'))
+    yield Case('csvavg.headerless', 'headerless',
+        cli('csvavg', '{path}', '--infile-no-header'))
+    yield Case('csvstats.wide', 'wide_numeric', cli('csvstats', '{path}'))
+    yield Case('csvdrop.narrow', 'narrow_text',
+        cli('csvdrop', '{path}', '-c', 'comment'))
+    yield Case('csvdrop.quoted', 'quoted_multiline',
+        cli('csvdrop', '{path}', '-c', 'notes'))
+    yield Case('csvkeep.wide', 'wide_numeric',
+        cli('csvkeep', '{path}', '-c', 'c0', 'c1'))
+    yield Case('csvkeep.headerless', 'headerless',
+        cli('csvkeep', '{path}', '--infile-no-header', '-c', 'col0'))
+    yield Case('csvtab.narrow', 'narrow_text', cli('csvtab', '{path}'))
+    yield Case('csvtab.narrow.sample', 'narrow_text',
+        cli('csvtab', '{path}', '-s', '1000'))
+    yield Case('csvtab.quoted', 'quoted_multiline', cli('csvtab', '{path}'))
+
+    for reader, dataset in READERS:
+        for writer in WRITERS:
+            yield Case('csvconvert.{}.{}'.format(reader, writer), dataset,
+                cli('csvconvert', '{path}', '-f', reader, '-t', writer,
+                    '-o', os.devnull))
+
+    for name, dataset in (
+      ('aggregate', 'wide_numeric'),
+      ('fmap_sum', 'wide_numeric'),
+      ('fmap_generic', 'wide_numeric'),
+      ('drop', 'wide_numeric'),
+      ('keep', 'wide_numeric'),
+      ('tabulate', 'narrow_text'),
+      ('convert', 'narrow_text')):
+        yield Case('library.' + name, dataset, library(name))
+
+
+CASES = list(_cases())
@@ -0,0 +1,259 @@
+#
+# Deterministic synthetic inputs
+#
+
+from __future__ import absolute_import, division
+import csv
+import io
+import json
+import os
+import random
+import zipfile
+
+
+SEED = 0
+
+WORDS = ('alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf',
+    'hotel', 'india', 'juliet', 'kilo', 'lima', 'mike', 'november')
+CITIES = ('Burlington', 'Montpelier', 'Rutland', 'Barre', 'Winooski',
+    'Newport', 'Vergennes', 'St. Albans')
+
+NS_MAIN = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+NS_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+NS_PKG_RELS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+NS_TYPES = 'http://schemas.openxmlformats.org/package/2006/content-types'
+CT_MAIN = 'application/vnd.openxmlformats-officedocument.spreadsheetml.'
+XML_DECL = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+
+def _column(n):
+    """
+    Convert a zero based column number to spreadsheet letters.
+    :param n:           Column number
+    :return str:        Column letters
+    """
+    letters = ''
+    n += 1
+    while n:
+        n, r = divmod(n - 1, 26)
+        letters = chr(65 + r) + letters
+
+    return letters
+
+def _write_csv(path, header, rows):
+    """
+    Write rows to a csv file.
+    :param path:        Output path
+    :param header:      Header row, or None for no header
+    :param rows:        Iterable of rows
+    """
+    with io.open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        if header is not None:
+            writer.writerow(header)
+        writer.writerows(rows)
+
+def _wide_rows(rng, rows, cols):
+    """
+    Yield rows of signed four place decimals.
+    """
+    for _ in range(rows):
+        yield ['{:.4f}'.format(rng.uniform(-1000, 1000)) for _ in range(cols)]
+
+def _narrow_rows(rng, rows):
+    """
+    Yield id, name, city, age and free text comment rows.
+    """
+    for i in range(rows):
+        yield [str(i),
+            rng.choice(WORDS).title() + ' ' + rng.choice(WORDS).title(),
+            rng.choice(CITIES),
+            str(rng.randint(18, 90)),
+            ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 6)))]
+
+def wide_numeric(path, rows, cols=50, seed=SEED):
+    """
+    Many columns of signed decimals; the aggregation hot path.
+    """
+    rng = random.Random(seed)
+    header = ['c{}'.format(x) for x in range(cols)]
+    _write_csv(path, header, _wide_rows(rng, rows, cols))
+
+def narrow_text(path, rows, seed=SEED):
+    """
+    A few short text and integer columns.
+    """
+    rng = random.Random(seed)
+    header = ['id', 'name', 'city', 'age', 'comment']
+    _write_csv(path, header, _narrow_rows(rng, rows))
+
+def narrow_json(path, rows, seed=SEED):
+    """
+    The narrow_text table as a JSON array of objects.
+    """
+    rng = random.Random(seed)
+    header = ['id', 'name', 'city', 'age', 'comment']
+
+    with io.open(path, 'w') as f:
+        f.write('[')
+        for i, row in enumerate(_narrow_rows(rng, rows)):
+            f.write(', ' if i else '')
+            f.write(json.dumps(dict(zip(header, row))))
+        f.write(']')
+
+def narrow_columnar(path, rows, seed=SEED):
+    """
+    The narrow_text table in the columnar format, written by its parser.
+    """
+    from csvutils.parsers.builtins.columnar import ColumnarParser
+
+    rng = random.Random(seed)
+    parser = ColumnarParser()
+    parser.header = ['id', 'name', 'city', 'age', 'comment']
+    parser.rows = _narrow_rows(rng, rows)
+
+    with io.open(path, 'wb') as f:
+        parser.write(f)
+
+def quoted_multiline(path, rows, seed=SEED):
+    """
+    Text fields with embedded delimiters, doubled quotes and newlines,
+    so every field is quoted and records span several lines.
+    """
+    rng = random.Random(seed)
+    header = ['id', 'quote', 'notes', 'amount']
+
+    def generate():
+        for i in range(rows):
+            words = [rng.choice(WORDS) for _ in range(rng.randint(2, 8))]
+            yield [str(i),
+                '"{}", said {}'.format(' '.join(words), rng.choice(CITIES)),
+                '\n'.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))),
+                '{:.2f}'.format(rng.uniform(0, 500))]
+
+    _write_csv(path, header, generate())
+
+def headerless(path, rows, cols=10, seed=SEED):
+    """
+    Integer columns without a header row.
+    """
+    rng = random.Random(seed)
+    body = ([str(rng.randint(-10 ** 6, 10 ** 6)) for _ in range(cols)]
+        for _ in range(rows))
+    _write_csv(path, None, body)
+
+def sparse_xlsx(path, rows, cols=26, density=0.1, seed=SEED):
+    """
+    A worksheet where most cells are missing. Present cells alternate
+    between numbers and shared strings.
+    """
+    rng = random.Random(seed)
+    strings = list(WORDS)
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', XML_DECL +
+            '<Types xmlns="{0}">'
+            '<Default Extension="rels" ContentType="application/'
+            'vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" '
+            'ContentType="{1}sheet.main+xml"/>'
+            '<Override PartName="/xl/worksheets/sheet1.xml" '
+            'ContentType="{1}worksheet+xml"/>'
+            '<Override PartName="/xl/styles.xml" '
+            'ContentType="{1}styles+xml"/>'
+            '<Override PartName="/xl/sharedStrings.xml" '
+            'ContentType="{1}sharedStrings+xml"/>'
+            '</Types>'.format(NS_TYPES, CT_MAIN))
+        archive.writestr('_rels/.rels', XML_DECL +
+            '<Relationships xmlns="{}"><Relationship Id="rId1" '
+            'Type="{}/officeDocument" Target="xl/workbook.xml"/>'
+            '</Relationships>'.format(NS_PKG_RELS, NS_REL))
+        archive.writestr('xl/_rels/workbook.xml.rels', XML_DECL +
+            '<Relationships xmlns="{0}">'
+            '<Relationship Id="rId1" Type="{1}/worksheet" '
+            'Target="worksheets/sheet1.xml"/>'
+            '<Relationship Id="rId2" Type="{1}/styles" Target="styles.xml"/>'
+            '<Relationship Id="rId3" Type="{1}/sharedStrings" '
+            'Target="sharedStrings.xml"/>'
+            '</Relationships>'.format(NS_PKG_RELS, NS_REL))
+        archive.writestr('xl/workbook.xml', XML_DECL +
+            '<workbook xmlns="{}" xmlns:r="{}"><sheets>'
+            '<sheet name="Sheet1" sheetId="1" r:id="rId1"/>'
+            '</sheets></workbook>'.format(NS_MAIN, NS_REL))
+        archive.writestr('xl/styles.xml', XML_DECL +
+            '<styleSheet xmlns="{}"><cellXfs count="1"><xf numFmtId="0"/>'
+            '</cellXfs></styleSheet>'.format(NS_MAIN))
+        archive.writestr('xl/sharedStrings.xml', XML_DECL +
+            '<sst xmlns="{}" count="{}" uniqueCount="{}">{}</sst>'.format(
+                NS_MAIN, len(strings), len(strings),
+                ''.join('<si><t>{}</t></si>'.format(x) for x in strings)))
+
+        letters = [_column(x) for x in range(cols)]
+
+        with archive.open('xl/worksheets/sheet1.xml', 'w',
+          force_zip64=True) as raw:
+            sheet = io.TextIOWrapper(raw, encoding='utf-8')
+            sheet.write(XML_DECL)
+            sheet.write('<worksheet xmlns="{}"><dimension ref="A1:{}{}"/>'
+                '<sheetData>'.format(NS_MAIN, letters[-1], rows + 1))
+
+            # A full header row so every column is named.
+            sheet.write('<row r="1">')
+            for i, letter in enumerate(letters):
+                sheet.write('<c r="{}1" t="inlineStr"><is><t>h{}</t></is>'
+                    '</c>'.format(letter, i))
+            sheet.write('</row>')
+
+            for r in range(2, rows + 2):
+                cells = [i for i in range(cols) if rng.random() < density]
+                if not cells:
+                    continue
+
+                sheet.write('<row r="{}">'.format(r))
+                for i in cells:
+                    if i % 2:
+                        sheet.write('<c r="{}{}" t="s"><v>{}</v></c>'.format(
+                            letters[i], r, rng.randrange(len(strings))))
+                    else:
+                        sheet.write('<c r="{}{}"><v>{:.3f}</v></c>'.format(
+                            letters[i], r, rng.uniform(0, 100)))
+                sheet.write('</row>')
+
+            sheet.write('</sheetData></worksheet>')
+            sheet.flush()
+            sheet.detach()
+
+
+GENERATORS = {
+    'wide_numeric': (wide_numeric, 'csv'),
+    'narrow_text': (narrow_text, 'csv'),
+    'narrow_json': (narrow_json, 'json'),
+    'narrow_columnar': (narrow_columnar, 'col'),
+    'quoted_multiline': (quoted_multiline, 'csv'),
+    'headerless': (headerless, 'csv'),
+    'sparse_xlsx': (sparse_xlsx, 'xlsx')}
+
+
+def generate(name, directory, rows, seed=SEED):
+    """
+    Generate a dataset unless an identical one already exists. The file
+    name records every input, so cached files are always reproducible.
+    :param name:        One of GENERATORS
+    :param directory:   Directory to write to
+    :param rows:        Number of data rows
+    :option seed:       Random seed
+    :return str:        Path of the dataset
+    """
+    func, ext = GENERATORS[name]
+    path = os.path.join(directory, '{}-{}-{}.{}'.format(name, rows, seed, ext))
+
+    if not os.path.exists(path):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        partial = path + '.partial'
+        func(partial, rows, seed=seed)
+        os.rename(partial, path)
+
+    return path
@@ -0,0 +1,75 @@
+#
+# Library benchmarks. Each one runs in its own process, started by the
+# runner as `python -m benchmarks.library <name> <path>`, so its peak RSS
+# can be measured on its own.
+#
+
+from __future__ import absolute_import
+import csvutils
+import io
+import sys
+
+
+def _consume(rows):
+    """
+    Exhaust lazy rows.
+    :param rows:        Iterable of rows
+    :return int:        Number of rows
+    """
+    count = 0
+    for _ in rows:
+        count += 1
+
+    return count
+
+def aggregate(f):
+    return csvutils.aggregate(f, [(None, 'sum'), (None, 'avg'),
+        (None, 'var')])
+
+def fmap_sum(f):
+    return list(csvutils.fmap(f, sum))
+
+def fmap_generic(f):
+    # A function the single pass engine does not know about.
+    return list(csvutils.fmap(f, lambda values: len(list(values)),
+        columns=['c0', 'c1']))
+
+def drop(f):
+    _, rows = csvutils.drop(f, columns=['c0', 'c1'])
+    return _consume(rows)
+
+def keep(f):
+    _, rows = csvutils.keep(f, columns=['c0', 'c1'])
+    return _consume(rows)
+
+def tabulate(f):
+    return _consume(csvutils.tabulate(f))
+
+def convert(f):
+    out = csvutils.convert(f, csvutils.parsers.csv(), csvutils.parsers.json())
+    out.write(io.StringIO())
+
+
+FUNCTIONS = {
+    'aggregate': aggregate,
+    'fmap_sum': fmap_sum,
+    'fmap_generic': fmap_generic,
+    'drop': drop,
+    'keep': keep,
+    'tabulate': tabulate,
+    'convert': convert}
+
+
+def main(argv=None):
+    """
+    Run one library benchmark.
+    :option argv:       name and path. Default sys.argv[1:]
+    """
+    name, path = argv if argv is not None else sys.argv[1:]
+
+    with io.open(path, 'r', newline='') as f:
+        FUNCTIONS[name](f)
+
+
+if __name__ == '__main__':
+    main()
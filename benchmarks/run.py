@@ -0,0 +1,229 @@
+#
+# Run benchmarks, record wall time, throughput and peak RSS, and compare
+# against a saved baseline.
+#
+
+from __future__ import absolute_import, division, print_function
+from . import cases, generators
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+
+SIZES = {
+    'small': 10000,
+    'medium': 100000,
+    'large': 1000000}
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(argv):
+    """
+    Run a command to completion in a child process.
+    :param argv:        Command and arguments
+    :return tuple:      Wall time in seconds, peak RSS in KiB or None where
+                        the platform can not report it
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT] + [x for x in [env.get('PYTHONPATH')] if x])
+
+    with tempfile.TemporaryFile() as err, open(os.devnull, 'wb') as out:
+        start = time.perf_counter()
+        proc = subprocess.Popen(argv, stdout=out, stderr=err, env=env)
+
+        if hasattr(os, 'wait4'):
+            _, status, usage = os.wait4(proc.pid, 0)
+            wall = time.perf_counter() - start
+            proc.returncode = os.WEXITSTATUS(status) \
+                if os.WIFEXITED(status) else -os.WTERMSIG(status)
+            # ru_maxrss is in bytes on macOS and KiB elsewhere.
+            rss = usage.ru_maxrss // (1024 if sys.platform == 'darwin' else 1)
+        else:
+            proc.wait()
+            wall = time.perf_counter() - start
+            rss = None
+
+        if proc.returncode != 0:
+            err.seek(0)
+            raise BenchmarkError(argv, err.read().decode('utf-8', 'replace'))
+
+    return wall, rss
+
+def run(selected, directory, rows, repeat=3, report=print):
+    """
+    Run benchmark cases, generating their datasets on first use.
+    :param selected:    Cases to run
+    :param directory:   Dataset directory
+    :param rows:        Rows per dataset
+    :option repeat:     Runs per case; the fastest is kept
+    :option report:     Called with a result line as each case finishes
+    :return dict:       Case name to result dict
+    """
+    results = {}
+
+    for case in selected:
+        path = generators.generate(case.dataset, directory, rows)
+        size = os.path.getsize(path)
+        walls, rsss = [], []
+
+        for _ in range(repeat):
+            wall, rss = measure(case.args(path))
+            walls.append(wall)
+            rsss.append(rss)
+
+        wall = min(walls)
+        result = {
+            'dataset': case.dataset,
+            'rows': rows,
+            'bytes': size,
+            'wall': wall,
+            'rows_per_sec': rows / wall,
+            'mb_per_sec': size / wall / 1e6,
+            'rss_kb': max(rsss) if None not in rsss else None}
+
+        results[case.name] = result
+        report(_format(case.name, result))
+
+    return results
+
+def compare(results, baseline, threshold=0.10):
+    """
+    Compare results with a baseline run. A case regresses when its wall
+    time or peak RSS grew by more than threshold.
+    :param results:     Case name to result dict
+    :param baseline:    Case name to result dict of the baseline
+    :option threshold:  Allowed relative growth
+    :return tuple:      Report lines, names of regressed cases
+    """
+    lines = ['{:<32} {:>9} {:>9} {:>7} {:>9}'.format('case', 'base s',
+        'new s', 'wall', 'rss')]
+    regressed = []
+
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+
+        new, old = results[name], baseline[name]
+        wall = new['wall'] / old['wall'] - 1
+        rss = new['rss_kb'] / old['rss_kb'] - 1 \
+            if new['rss_kb'] and old['rss_kb'] else 0
+        flag = ''
+
+        if wall > threshold or rss > threshold:
+            regressed.append(name)
+            flag = '  REGRESSION'
+
+        lines.append('{:<32} {:>9.3f} {:>9.3f} {:>+6.0%} {:>+8.0%}{}'.format(
+            name, old['wall'], new['wall'], wall, rss, flag))
+
+    return lines, regressed
+
+def _format(name, result):
+    """
+    Format one result as a report line.
+    """
+    rss = '{:.1f} MiB'.format(result['rss_kb'] / 1024) \
+        if result['rss_kb'] is not None else '-'
+
+    return '{:<32} {:>8.3f} s {:>10.0f} rows/s {:>7.1f} MB/s {:>11}'.format(
+        name, result['wall'], result['rows_per_sec'], result['mb_per_sec'],
+        rss)
+
+def main(argv=None):
+    """
+    Command line entry point, `python -m benchmarks`.
+    :option argv:       Arguments. Default sys.argv[1:]
+    :return int:        Exit status; 1 if a case regressed
+    """
+    parser = argparse.ArgumentParser(prog='python -m benchmarks',
+        description='Benchmark the csvutils command line utilities and ' \
+            'library functions on deterministic synthetic data.')
+    parser.add_argument('-s', '--size',
+        choices=sorted(SIZES, key=SIZES.get),
+        default='small',
+        help='Dataset size. Default small.')
+    parser.add_argument('-r', '--rows',
+        type=int,
+        help='Rows per dataset. Overrides --size.')
+    parser.add_argument('-k', '--filter',
+        dest='patterns',
+        nargs='*',
+        default=[],
+        help='Only run cases whose name contains one of these strings.')
+    parser.add_argument('-n', '--repeat',
+        type=int,
+        default=3,
+        help='Runs per case; the fastest is reported. Default 3.')
+    parser.add_argument('-d', '--data-dir',
+        default=os.path.join(tempfile.gettempdir(), 'csvutils-benchmarks'),
+        help='Where generated datasets are cached.')
+    parser.add_argument('--save',
+        help='Write the results to this JSON file, e.g. a new baseline.')
+    parser.add_argument('--compare',
+        help='Compare against results saved with --save.')
+    parser.add_argument('--threshold',
+        type=float,
+        default=0.10,
+        help='Relative slowdown or memory growth counted as a regression ' \
+            'by --compare. Default 0.10.')
+    parser.add_argument('-l', '--list',
+        action='store_true',
+        help='List the cases and exit.')
+    args = parser.parse_args(argv)
+
+    selected = [x for x in cases.CASES
+        if not args.patterns or any(p in x.name for p in args.patterns)]
+
+    if args.list is True:
+        for case in selected:
+            print('{:<32} {}'.format(case.name, case.dataset))
+        return 0
+
+    rows = args.rows if args.rows is not None else SIZES[args.size]
+    results = run(selected, args.data_dir, rows, args.repeat)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'rows': rows,
+                'results': results}, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+        if baseline.get('rows') != rows:
+            print('warning: baseline used {} rows, this run {}'.format(
+                baseline.get('rows'), rows), file=sys.stderr)
+
+        lines, regressed = compare(results, baseline['results'],
+            args.threshold)
+        print()
+        print('\n'.join(lines))
+
+        if regressed:
+            print('\n{} case(s) regressed by more than {:.0%}'.format(
+                len(regressed), args.threshold))
+            return 1
+
+    return 0
+
+
+class BenchmarkError(Exception):
+    MESSAGE = "Benchmark command failed: {}\n{}"
+
+    def __init__(self, argv, stderr):
+        self.argv = argv
+        self.stderr = stderr
+
+    def __str__(self):
+        return self.MESSAGE.format(' '.join(self.argv), self.stderr)
@@ -1,7 +1,15 @@
 from __future__ import absolute_import
+
+__version__ = '0.5.8'
+
 from .csvutils import *
 from .cli import *
-from .parsers import *
+from . import parsers
 
 
-__version__ = '0.5.8'
+def __getattr__(name):
+    """
+    Parsers were once imported into the package namespace; resolve them
+    lazily from the parser registry instead.
+    """
+    return getattr(parsers, name)
@@ -0,0 +1,472 @@
+#
+# Single pass column aggregation
+#
+
+from __future__ import absolute_import, division
+from . import helpers, schema
+import decimal
+import itertools
+import sys
+
+
+AGGREGATES = ('sum', 'avg', 'min', 'max', 'count', 'nulls', 'var')
+
+# Functions fmap can hand to the single pass engine instead of applying
+# them column by column.
+FUNCTIONS = {
+    sum: 'sum',
+    helpers.avg: 'avg',
+    min: 'min',
+    max: 'max'}
+
+INFINITY = float('inf')
+
+
+class ColumnState(object):
+    """
+    Running aggregate state for one column. Every cell is converted with
+    a helpers.numeric converter, so empty or non-numeric cells count as
+    zero, and empty cells are also tallied as nulls. States can be merged, so a
+    column may be aggregated in pieces and combined afterwards.
+
+    Variance is tracked as the running mean and the sum of squared
+    deviations from it (m2), updated with Welford's method and combined
+    with Chan's formula, so it does not cancel out on large values.
+    """
+    __slots__ = ('count', 'nulls', 'total', 'mean', 'm2', 'minimum',
+        'maximum', 'variance', 'convert')
+
+    def __init__(self, variance=False, convert=helpers.tofloat):
+        """
+        :option variance [bool]: Track the mean and m2 needed for `var`
+        :option convert [function]: Cell to number converter
+        """
+        self.count = 0
+        self.nulls = 0
+        self.total = 0
+        self.mean = 0
+        self.m2 = 0
+        self.minimum = None
+        self.maximum = None
+        self.variance = variance
+        self.convert = convert
+
+    def add(self, cell):
+        """
+        Add one cell to the running state.
+        :param cell [str]: Raw cell value
+        """
+        if cell is None or cell == '':
+            self.nulls += 1
+
+        value = self.convert(cell)
+
+        self.count += 1
+        self.total += value
+
+        if self.variance is True:
+            try:
+                delta = value - self.mean
+            except TypeError:
+                self._widen()
+                delta = value - self.mean
+            self.mean += delta / self.count
+            self.m2 += delta * (value - self.mean)
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+
+    def extend(self, values, nulls=0):
+        """
+        Add a batch of converted values to the running state.
+        :param values [list]: Converted values, or a NumPy array
+        :option nulls [int]: Number of null cells in the batch
+        """
+        if len(values) == 0:
+            return
+
+        count = len(values)
+
+        # Arrays only exist once a batch has imported NumPy.
+        numpy = sys.modules.get('numpy')
+
+        if numpy is not None and isinstance(values, numpy.ndarray):
+            total = values.sum().item()
+            if self.variance is True:
+                # Shift by a value of the batch so the mean keeps its
+                # precision when the values are large.
+                shift = values[0].item()
+                mean = shift + (values - shift).sum().item() / count
+                deltas = values - mean
+                m2 = numpy.dot(deltas, deltas).item()
+            minimum = values.min().item()
+            maximum = values.max().item()
+        else:
+            total = sum(values)
+            if self.variance is True:
+                shift = values[0]
+                mean = shift + sum(x - shift for x in values) / count
+                m2 = sum((x - mean) * (x - mean) for x in values)
+            minimum = min(values)
+            maximum = max(values)
+
+        if self.variance is True:
+            self._combine(count, mean, m2)
+
+        self.count += count
+        self.nulls += nulls
+        self.total += total
+
+        if self.minimum is None or minimum < self.minimum:
+            self.minimum = minimum
+        if self.maximum is None or maximum > self.maximum:
+            self.maximum = maximum
+
+    def _combine(self, count, mean, m2):
+        """
+        Fold the mean and m2 of other values into this state's with Chan's
+        formula. Called before count is updated.
+        :param count [int]: Number of other values
+        :param mean [mixed]: Their mean
+        :param m2 [mixed]: Their sum of squared deviations from the mean
+        """
+        if not count:
+            return
+        if not self.count:
+            self.mean, self.m2 = mean, m2
+            return
+
+        if isinstance(mean, decimal.Decimal) != \
+          isinstance(self.mean, decimal.Decimal):
+            mean, m2 = decimal.Decimal(mean), decimal.Decimal(m2)
+            self._widen()
+
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+
+    def _widen(self):
+        """
+        Carry on in Decimal once a widening converter (see
+        helpers.WIDENING_MODES) hands over a Decimal; whole numbers keep
+        their mean as a float until then.
+        """
+        self.mean = decimal.Decimal(self.mean)
+        self.m2 = decimal.Decimal(self.m2)
+
+    def merge(self, other):
+        """
+        Fold another state for the same column into this one.
+        :param other [ColumnState]: State to merge
+        :return [ColumnState]: self
+        """
+        self._combine(other.count, other.mean, other.m2)
+
+        self.count += other.count
+        self.nulls += other.nulls
+        self.total += other.total
+        self.variance = self.variance or other.variance
+
+        if other.minimum is not None and \
+          (self.minimum is None or other.minimum < self.minimum):
+            self.minimum = other.minimum
+        if other.maximum is not None and \
+          (self.maximum is None or other.maximum > self.maximum):
+            self.maximum = other.maximum
+
+        return self
+
+    def result(self, aggregate):
+        """
+        Return the value of an aggregate. `avg` and `var` are None for an
+        empty column; `var` is the population variance.
+        :param aggregate [str]: One of AGGREGATES
+        :return [mixed]: Aggregate value
+        """
+        if aggregate == 'sum':
+            value = self.total
+        elif aggregate == 'avg':
+            value = self.total / self.count if self.count else None
+        elif aggregate == 'min':
+            value = self.minimum
+        elif aggregate == 'max':
+            value = self.maximum
+        elif aggregate == 'count':
+            value = self.count
+        elif aggregate == 'nulls':
+            value = self.nulls
+        elif aggregate == 'var':
+            value = self.m2 / self.count if self.count else None
+        else:
+            raise UnknownAggregateError(aggregate)
+
+        return value
+
+
+def _tocolumn(cells, cast, convert, vectorize=False):
+    """
+    Convert one column of a batch. The whole column is first cast in one
+    go, with NumPy when vectorize is set, falling back to convert cell by
+    cell when any cell is empty or not a finite number.
+    :param cells [tuple]: Raw cells
+    :param cast [type]: Numeric type, see helpers.numeric_type
+    :param convert [function]: Cell to number converter
+    :option vectorize [bool]: Parse with NumPy
+    :return [tuple]: List or NumPy array of values, number of null cells
+    """
+    try:
+        if vectorize is True:
+            numpy = _numpy()
+            values = numpy.array(cells, dtype=float)
+            finite = numpy.isfinite(values).all()
+        else:
+            values = list(map(cast, cells))
+            total = sum(values)
+            finite = total == total and abs(total) != INFINITY
+    except (ValueError, TypeError, decimal.InvalidOperation):
+        finite = False
+
+    if finite:
+        return values, 0
+
+    return list(map(convert, cells)), cells.count('') + cells.count(None)
+
+def _numpy():
+    """
+    Import NumPy for float batches. It is imported on first use rather than
+    with this module, so commands that never vectorise do not pay for it.
+    :return [module]: numpy, or None when it is not installed
+    """
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+
+    return numpy
+
+def plan(header, pairs):
+    """
+    Validate the requested aggregates and work out which columns to track.
+    :param header [list]: Header columns
+    :param pairs [list]: (column, aggregate) tuples. A column of None
+        applies the aggregate to every column.
+    :return [tuple]: Expanded pairs, tracked columns, and a matching list
+        of flags marking the columns that need variance
+    """
+    pairs = [(x, agg) for col, agg in pairs
+        for x in (header if col is None else [col])]
+
+    for _, agg in pairs:
+        if agg not in AGGREGATES:
+            raise UnknownAggregateError(agg)
+
+    columns = []
+    for col, _ in pairs:
+        if col not in columns:
+            columns.append(col)
+
+    variance = set(col for col, agg in pairs if agg == 'var')
+
+    return pairs, columns, [col in variance for col in columns]
+
+def accumulate(rows, index, variance, numeric_mode='decimal', batch_size=None):
+    """
+    Build the running state of each tracked column in a single pass.
+    :param rows [iter]: Table rows
+    :param index [list]: Row index of each tracked column
+    :param variance [list]: Variance flag of each tracked column
+    :option numeric_mode [mixed]: One of helpers.NUMERIC_MODES, or a list
+        with one mode per tracked column
+    :option batch_size [int]: Aggregate column by column over batches of
+        this many rows rather than cell by cell. Float batches are parsed
+        and reduced with NumPy when it is installed.
+    :return [list]: ColumnState of each tracked column
+    """
+    if not isinstance(numeric_mode, list):
+        numeric_mode = [numeric_mode] * len(variance)
+
+    converts = dict((x, helpers.numeric(x)) for x in set(numeric_mode))
+    states = [ColumnState(variance=x, convert=converts[m])
+        for x, m in zip(variance, numeric_mode)]
+    tracked = list(zip(index, states))
+
+    if batch_size:
+        vectorize = 'float' in numeric_mode and _numpy() is not None
+        casts = [(helpers.numeric_type(m), converts[m],
+            vectorize and m == 'float') for m in numeric_mode]
+        rows = iter(rows)
+        batch = list(itertools.islice(rows, batch_size))
+
+        while batch:
+            flat = list(zip(*batch))
+
+            for (i, state), (cast, convert, vectorize) in zip(tracked, casts):
+                values, nulls = _tocolumn(flat[i], cast, convert, vectorize)
+                state.extend(values, nulls)
+
+            batch = list(itertools.islice(rows, batch_size))
+    else:
+        for row in rows:
+            for i, state in tracked:
+                state.add(row[i])
+
+    return states
+
+def accumulate_blocks(blocks, index, variance, numeric_mode='decimal'):
+    """
+    Build the running state of each tracked column from column blocks,
+    such as those of the columnar parser, a block at a time.
+    :param blocks [iter]: (rows, blocks) tuples, where each block is a
+        (kind, values, scale) tuple. Kind text holds raw cells; int, scaled
+        and float hold numbers that are exactly the cells they were read
+        from, a scaled value v standing for v * 10**-scale
+    :param index [list]: Block index of each tracked column
+    :param variance [list]: Variance flag of each tracked column
+    :option numeric_mode [mixed]: One of helpers.NUMERIC_MODES, or a list
+        with one mode per tracked column
+    :return [list]: ColumnState of each tracked column
+    """
+    if not isinstance(numeric_mode, list):
+        numeric_mode = [numeric_mode] * len(variance)
+
+    converts = dict((x, helpers.numeric(x)) for x in set(numeric_mode))
+    states = [ColumnState(variance=x, convert=converts[m])
+        for x, m in zip(variance, numeric_mode)]
+    tracked = list(zip(index, states, numeric_mode))
+
+    for _, columns in blocks:
+        for i, state, mode in tracked:
+            kind, values, scale = columns[i]
+            state.merge(_block(kind, values, scale, mode, state.variance,
+                state.convert))
+
+    return states
+
+def _block(kind, values, scale, mode, variance, convert):
+    """
+    Aggregate one column block, converting its values as the numeric mode
+    would have converted the cells they were read from.
+    :return [ColumnState]: State of the block
+    """
+    state = ColumnState(variance=variance, convert=convert)
+
+    if len(values) == 0:
+        return state
+
+    if mode in helpers.WIDENING_MODES and kind in ('scaled', 'float'):
+        # None of these values are cast by the first mode.
+        mode = helpers.WIDENING_MODES[mode][1]
+
+    if kind == 'text':
+        values, nulls = _tocolumn(values, helpers.numeric_type(mode), convert)
+        state.extend(values, nulls)
+    elif mode == 'int' and kind != 'int':
+        # int() rejects every cell with a decimal point or exponent.
+        state.extend([0] * len(values))
+    elif mode == 'float':
+        if kind == 'scaled':
+            values = [x / 10 ** scale for x in values]
+        elif kind == 'int':
+            values = [float(x) for x in values]
+        state.extend(values)
+    elif kind == 'float':
+        state.extend([decimal.Decimal(repr(x)) for x in values])
+    elif mode == 'decimal':
+        # Integer arithmetic is exact; scale the results once.
+        count = len(values)
+        total = sum(values)
+        state.count = count
+        state.total = decimal.Decimal(total).scaleb(-scale)
+        state.minimum = decimal.Decimal(min(values)).scaleb(-scale)
+        state.maximum = decimal.Decimal(max(values)).scaleb(-scale)
+        if variance is True:
+            sumsq = sum(x * x for x in values)
+            state.mean = state.total / count
+            state.m2 = (decimal.Decimal(count * sumsq - total * total) /
+                count).scaleb(-2 * scale)
+    else:
+        state.extend(values)
+
+    return state
+
+def results(pairs, columns, states):
+    """
+    Read the requested aggregates out of the column states.
+    :param pairs [list]: Expanded (column, aggregate) tuples
+    :param columns [list]: Tracked columns
+    :param states [list]: ColumnState of each tracked column
+    :return [list]: (column, aggregate), result tuples
+    """
+    lookup = dict(zip(columns, states))
+
+    return [((col, agg), lookup[col].result(agg)) for col, agg in pairs]
+
+def modes(columns, numeric_mode, types=None):
+    """
+    Resolve the numeric mode of each tracked column. The `auto` mode picks
+    the exact mode for each column's inferred type and decimal for the
+    rest. Integer columns widen to decimal for cells past the inferred
+    rows that are not whole numbers, see helpers.WIDENING_MODES.
+    :param columns [list]: Tracked columns
+    :param numeric_mode [str]: One of helpers.NUMERIC_MODES, or auto
+    :option types [dict]: Column name to type, see schema.infer
+    :return [mixed]: The numeric mode, or a list of one per column
+    """
+    if numeric_mode != 'auto':
+        return numeric_mode
+
+    types = types if types is not None else {}
+
+    return [schema.NUMERIC_MODES.get(types.get(x), 'decimal') for x in columns]
+
+def aggregate(header, rows, pairs, numeric_mode='decimal', batch_size=None,
+  types=None):
+    """
+    Compute every requested aggregate in a single pass over rows.
+    :param header [list]: Header columns
+    :param rows [iter]: Table rows
+    :param pairs [list]: (column, aggregate) tuples. A column of None
+        applies the aggregate to every column.
+    :option numeric_mode [str]: One of helpers.NUMERIC_MODES, or auto
+    :option batch_size [int]: See accumulate
+    :option types [dict]: Column types for the auto numeric mode
+    :return [list]: (column, aggregate), result tuples
+    """
+    pairs, columns, variance = plan(header, pairs)
+    index = helpers.indexes(header, columns)
+    numeric_mode = modes(columns, numeric_mode, types)
+    states = accumulate(rows, index, variance, numeric_mode, batch_size)
+
+    return results(pairs, columns, states)
+
+def aggregate_blocks(header, blocks, pairs, numeric_mode='decimal',
+  types=None):
+    """
+    Compute every requested aggregate in a single pass over column blocks.
+    :param header [list]: Header columns
+    :param blocks [iter]: (rows, blocks) tuples, see accumulate_blocks
+    :param pairs [list]: (column, aggregate) tuples. A column of None
+        applies the aggregate to every column.
+    :option numeric_mode [str]: One of helpers.NUMERIC_MODES, or auto
+    :option types [dict]: Column types for the auto numeric mode
+    :return [list]: (column, aggregate), result tuples
+    """
+    pairs, columns, variance = plan(header, pairs)
+    index = helpers.indexes(header, columns)
+    numeric_mode = modes(columns, numeric_mode, types)
+    states = accumulate_blocks(blocks, index, variance, numeric_mode)
+
+    return results(pairs, columns, states)
+
+
+class UnknownAggregateError(Exception):
+    MESSAGE = "Aggregate '{}' is not supported. Please select one of the " \
+        "following: {}"
+
+    def __init__(self, aggregate):
+        self.aggregate = aggregate
+
+    def __str__(self):
+        return self.MESSAGE.format(self.aggregate, ', '.join(AGGREGATES))
@@ -0,0 +1,308 @@
+#
+# Persistent aggregate cache
+#
+
+from __future__ import absolute_import
+from . import aggregates, helpers, parallel
+import hashlib
+import json
+import os
+import zlib
+
+
+VERSION = 2
+MAX_BYTES = 64 << 20
+CRC_WINDOW = 4096
+READ_SIZE = 1 << 20
+
+# State fields stored as numbers of the column's numeric mode, and the
+# variance fields, which are floats in int mode.
+NUMBERS = ('total', 'minimum', 'maximum')
+MOMENTS = ('mean', 'm2')
+
+
+def default_directory():
+    """
+    Return the default cache directory, under XDG_CACHE_HOME.
+    :return [str]: Directory path
+    """
+    base = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+
+    return os.path.join(base, 'csvutils')
+
+
+class Cache(object):
+    """
+    On-disk cache of partial column aggregates of csv files. An entry holds
+    the count, nulls, sum, mean, m2, min and max of each column it
+    has seen, so any aggregate can be derived from it, and is keyed by the
+    file's real path, numeric mode and how it is parsed. An entry is only
+    used while the file's size and mtime (and optionally a hash of its
+    contents) match; when the file has only been appended to, just the new
+    rows are read. The least recently used entries are evicted once the
+    cache grows past max_bytes.
+    """
+
+    def __init__(self, directory=None, max_bytes=MAX_BYTES,
+      content_hash=False):
+        """
+        :option directory [str]: Cache directory. Default default_directory()
+        :option max_bytes [int]: Size limit of the cache directory
+        :option content_hash [bool]: Also check a SHA-256 of the file
+        """
+        self.directory = directory or default_directory()
+        self.max_bytes = max_bytes
+        self.content_hash = content_hash
+
+    @staticmethod
+    def usable(fileobj, parser):
+        """
+        Check whether the aggregates of a file can be cached. Entries cover
+        whole csv files on disk, so a read limited to a row range is not
+        answered from the cache nor stored in it.
+        :param fileobj [File]: Open file object
+        :param parser [Parser]: File parser
+        :return [bool]: True if Cache.aggregate can be used
+        """
+        return parallel.splittable(fileobj, parser) and \
+            parser.start_row is None and parser.end_row is None
+
+    def _entry_path(self, path, parser, numeric_mode):
+        """
+        Return the file holding the entry of a csv file.
+        """
+        key = json.dumps([os.path.realpath(path), numeric_mode,
+            parser.delimiter, parser.hasheader is True])
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+        return os.path.join(self.directory, name + '.json')
+
+    def _load(self, entry_path):
+        """
+        Read an entry, marking it as recently used.
+        :return [dict]: Entry, or None if missing or unreadable
+        """
+        try:
+            with open(entry_path) as f:
+                entry = json.load(f)
+            os.utime(entry_path, None)
+        except (IOError, OSError, ValueError):
+            return None
+
+        return entry if entry.get('version') == VERSION else None
+
+    def _save(self, entry_path, entry):
+        """
+        Write an entry and evict old ones. Failures only cost the cache.
+        """
+        partial = entry_path + '.partial'
+
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            with open(partial, 'w') as f:
+                json.dump(entry, f)
+            os.rename(partial, entry_path)
+        except (IOError, OSError):
+            return
+
+        self.evict(keep=entry_path)
+
+    def evict(self, keep=None):
+        """
+        Delete the least recently used entries until the cache fits in
+        max_bytes.
+        :option keep [str]: Entry path never to evict
+        """
+        entries = []
+
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            full = os.path.join(self.directory, name)
+            try:
+                info = os.stat(full)
+            except OSError:
+                continue
+            entries.append((info.st_mtime, info.st_size, full))
+
+        total = sum(x[1] for x in entries)
+
+        for _, size, full in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if full == keep:
+                continue
+            try:
+                os.remove(full)
+                total -= size
+            except OSError:
+                pass
+
+    def aggregate(self, fileobj, pairs, parser, numeric_mode='decimal',
+      batch_size=None, jobs=None):
+        """
+        Compute aggregates over a csv file on disk, reading as little of
+        the file as the cache allows. The file must be usable, see
+        Cache.usable.
+        :param fileobj [File]: Open csv file
+        :param pairs [list]: (column, aggregate) tuples
+        :param parser [CSVParser]: File parser
+        :option numeric_mode [str]: One of helpers.NUMERIC_MODES
+        :option batch_size [int]: See aggregates.accumulate
+        :option jobs [int]: Processes to scan with, see parallel.accumulate
+        :return [list]: (column, aggregate), result tuples
+        """
+        path = fileobj.name
+        info = os.stat(path)
+        head, start = parallel.header(fileobj, parser)
+        pairs, columns, _ = aggregates.plan(head, pairs)
+
+        entry_path = self._entry_path(path, parser, numeric_mode)
+        entry = self._load(entry_path)
+        digest = _digest(path, info.st_size) if self.content_hash else None
+
+        cached = None
+        scan_from = start
+
+        if entry is not None and entry['header'] == head:
+            if entry['size'] == info.st_size and \
+              entry['mtime'] == info.st_mtime_ns and \
+              (digest is None or entry['hash'] == digest):
+                cached = entry['states']
+                scan_from = None
+            elif entry['appendable'] and entry['size'] < info.st_size and \
+              _crc(path, entry['size']) == entry['crc'] and \
+              (digest is None or _digest(path, entry['size']) == entry['hash']):
+                cached = entry['states']
+                scan_from = entry['size']
+
+        cast = helpers.NUMERIC_MODES[numeric_mode]
+        states = dict((x, _decode(y, cast)) for x, y in (cached or {}).items())
+        missing = [x for x in columns if x not in states]
+
+        if cached is None:
+            tracked = columns
+        elif scan_from is None:
+            # Columns the entry has never seen need the whole file.
+            tracked = missing
+            scan_from = start if missing else None
+        elif missing:
+            tracked = sorted(set(columns) | set(states), key=head.index)
+            states = {}
+            scan_from = start
+        else:
+            tracked = list(states)
+
+        if scan_from is not None:
+            index = list(helpers.indexes(head, tracked))
+            scanned = parallel.accumulate(fileobj, parser, scan_from,
+                info.st_size, index, [True] * len(tracked), numeric_mode,
+                batch_size, jobs)
+
+            for col, state in zip(tracked, scanned):
+                if col in states:
+                    states[col].merge(state)
+                else:
+                    states[col] = state
+
+            if parser.stats is not None and scanned:
+                parser.stats.rows_read += scanned[0].count
+
+            self._save(entry_path, {
+                'version': VERSION,
+                'path': os.path.realpath(path),
+                'size': info.st_size,
+                'mtime': info.st_mtime_ns,
+                'hash': digest,
+                'crc': _crc(path, info.st_size),
+                'appendable': _ends_with_newline(path, info.st_size),
+                'header': head,
+                'states': dict((x, _encode(y)) for x, y in states.items())})
+
+        if parser.stats is not None:
+            parser.stats.track(fileobj)
+
+        return aggregates.results(pairs, columns, [states[x] for x in columns])
+
+
+def _encode(state):
+    """
+    Serialise a ColumnState. Numbers are stored as text so decimals keep
+    their precision.
+    :param state [ColumnState]: State to store
+    :return [dict]: JSON serialisable state
+    """
+    data = {'count': state.count, 'nulls': state.nulls}
+    for name in NUMBERS + MOMENTS:
+        value = getattr(state, name)
+        data[name] = str(value) if value is not None else None
+
+    return data
+
+def _decode(data, cast):
+    """
+    Rebuild a ColumnState stored by _encode.
+    :param data [dict]: Stored state
+    :param cast [type]: Numeric type of the entry's numeric mode
+    :return [ColumnState]: State, tracking variance
+    """
+    state = aggregates.ColumnState(variance=True, convert=None)
+    state.count = data['count']
+    state.nulls = data['nulls']
+    for name in NUMBERS:
+        value = data[name]
+        setattr(state, name, cast(value) if value is not None else None)
+    for name in MOMENTS:
+        setattr(state, name, (float if cast is int else cast)(data[name]))
+
+    return state
+
+def _crc(path, end):
+    """
+    Checksum the bytes just before an offset of a file.
+    :param path [str]: File path
+    :param end [int]: Offset
+    :return [int]: crc32
+    """
+    start = max(end - CRC_WINDOW, 0)
+
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return zlib.crc32(f.read(end - start)) & 0xffffffff
+
+def _digest(path, end):
+    """
+    SHA-256 of the first `end` bytes of a file.
+    :param path [str]: File path
+    :param end [int]: Number of bytes to hash
+    :return [str]: Hex digest
+    """
+    digest = hashlib.sha256()
+
+    with open(path, 'rb') as f:
+        remaining = end
+        while remaining > 0:
+            block = f.read(min(READ_SIZE, remaining))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block)
+
+    return digest.hexdigest()
+
+def _ends_with_newline(path, size):
+    """
+    Check whether a file ends on a record boundary, so rows appended later
+    start a new record.
+    :param path [str]: File path
+    :param size [int]: File size
+    :return [bool]: True if the last byte is a newline
+    """
+    if size == 0:
+        return True
+
+    with open(path, 'rb') as f:
+        f.seek(size - 1)
+        return f.read(1) == parallel.NEWLINE
@@ -3,10 +3,9 @@
 #
 
 from __future__ import absolute_import
-from . import csvutils, helpers, parsers
+from . import __version__, csvutils, helpers, parsers
 import argparse
-import csv
-import pkg_resources
+import os
 import sys
 
 
@@ -27,8 +26,20 @@ def _default_arguments():
         help='Input file type. Default CSV.')
     parser.add_argument('-v', '--version',
         action='version',
-        version=pkg_resources.get_distribution(__package__).version,
+        version=__version__,
         help='Print version number and exit.')
+    parser.add_argument('--profile',
+        nargs='?',
+        const='text',
+        choices=['text', 'json'],
+        help='Print rows read and written, bytes processed, time spent ' \
+            'parsing, transforming and writing, rows/sec and peak memory ' \
+            'to stderr when done. Optionally as json.')
+    parser.add_argument('--progress',
+        type=int,
+        metavar='ROWS',
+        help='Print the number of rows read so far to stderr every ROWS ' \
+            'rows.')
     # XXX Allow global no-header? (sets both infile and outfile)
     # parser.add_argument('-N', '--no-header',
     #    action='store_false',
@@ -36,21 +47,109 @@ def _default_arguments():
 
     return parser
 
-def csvavg():
+def _transform_arguments():
     """
-    Command line utility to average a csv file
+    Returns ArgumentParser with args used in all row transforming utils
+    :return ArgumentParser:     ArgumentParser object
     """
+    from . import pipeline
+
+    parser = _default_arguments()
+    parser.add_argument('--pipeline',
+        action='store_true',
+        help='A flag to indicate rows should be read, transformed and ' \
+            'written in separate threads that pass batches of rows through ' \
+            'bounded queues, so slow or compressed input and output overlap.')
+    parser.add_argument('--pipeline-batch-size',
+        type=int,
+        default=pipeline.BATCH_SIZE,
+        metavar='ROWS',
+        help='Rows per batch with --pipeline. Default {}.'.format(
+            pipeline.BATCH_SIZE))
+
+    return parser
+
+def _aggregate_arguments(prog, verb):
+    """
+    Returns ArgumentParser with args used in all aggregating utils
+    :param prog:                Name of the command line utility
+    :param verb:                What is generated for each column
+    :return ArgumentParser:     ArgumentParser object
+    """
+    # Only the aggregating utils load these.
+    from . import cache, multifile, tail
+
     parser = _default_arguments()
     parser.add_argument('-c', '--cols', nargs='*',
-        help='A list of columns. Each column will have an average generated.')
+        help='A list of columns. Each column will have {} generated.'.format(verb))
     parser.add_argument('-a', '--alphabetize',
         action='store_true',
         help='A flag to indicate the output should be displayed in ' \
             'alphabetical order. This argument is only valid if the output ' \
-            'is transposed. Equivalent to `csvavg ... -T | sort`.')
+            'is transposed. Equivalent to `{} ... -T | sort`.'.format(prog))
     parser.add_argument('-p', '--precision',
         type=int,
         help='The number of decimal places to show.')
+    parser.add_argument('--numeric-mode',
+        default='decimal',
+        choices=sorted(helpers.NUMERIC_MODES) + ['auto'],
+        help='How cells are converted to numbers. decimal is exact but ' \
+            'slowest; float is fastest but accumulates rounding error; ' \
+            'int is exact and fast but counts non-integers as 0; ' \
+            'auto picks a mode per column from the types inferred from ' \
+            'the first rows, so int columns take the fast path. ' \
+            'Default decimal.')
+    parser.add_argument('--batch-size',
+        type=int,
+        help='Aggregate column by column over batches of this many rows. ' \
+            'With --numeric-mode float, batches are vectorised with NumPy ' \
+            'when it is installed.')
+    parser.add_argument('-j', '--jobs',
+        type=int,
+        help='The number of processes to aggregate with. Only csv files ' \
+            'on disk are split; other input is read by a single process. ' \
+            'With several input files, the number of files read at once ' \
+            'instead. Default {} files.'.format(multifile.THREADS))
+    parser.add_argument('--cache',
+        action='store_true',
+        help='A flag to indicate partial aggregates of csv files on disk ' \
+            'should be cached, so repeated runs over an unchanged file do ' \
+            'not read it and runs over an appended file only read the new ' \
+            'rows.')
+    parser.add_argument('--cache-dir',
+        metavar='DIR',
+        help='Directory to keep the --cache entries in. Default ' \
+            '{}.'.format(cache.default_directory()))
+    parser.add_argument('--cache-size',
+        type=int,
+        default=cache.MAX_BYTES >> 20,
+        metavar='MB',
+        help='Evict the least recently used cache entries beyond this ' \
+            'size. Default {} MB.'.format(cache.MAX_BYTES >> 20))
+    parser.add_argument('--cache-hash',
+        action='store_true',
+        help='A flag to indicate cache entries should also be checked ' \
+            'against a SHA-256 of the file, not just its size and mtime.')
+    parser.add_argument('--per-file',
+        action='store_true',
+        help='A flag to indicate the results of each input file should ' \
+            'be output as well as the total, with a leading file column.')
+    parser.add_argument('--follow',
+        action='store_true',
+        help='A flag to indicate the file should be followed as it grows, ' \
+            'like tail -f, writing updated results as rows are appended. ' \
+            'Only new rows are read. Stop with Ctrl-C.')
+    parser.add_argument('--interval',
+        type=float,
+        default=tail.INTERVAL,
+        metavar='SECONDS',
+        help='How often --follow checks for new rows. ' \
+            'Default {} second.'.format(tail.INTERVAL))
+    parser.add_argument('--every',
+        type=int,
+        metavar='ROWS',
+        help='Write results after every ROWS new rows with --follow, ' \
+            'rather than after each check that found new rows.')
     parser.add_argument('-t', '--to',
         dest='outformat',
         nargs='?',
@@ -59,40 +158,264 @@ def csvavg():
     parser.add_argument('-T', '--transpose',
         action='store_true',
         help='A flag to indicate the output should be transposed so that ' \
-            'there are two columns and N rows, where N equals the number ' \
-            'of columns indicated to average.')
+            'there is one row per column, where each row holds the column ' \
+            'name followed by its results.')
 
-    args, remainder = parser.parse_known_args()
+    return parser
 
-    informat = getattr(parsers, args.informat)(designation='inparser')
-    outformat = getattr(parsers, args.outformat)(designation='outparser')
+def _aggregate(args, remainder, aggs, labels=True):
+    """
+    Compute aggregates in a single pass and write them out. Shared by all
+    aggregating utils.
+    :param args:        Parsed arguments from _aggregate_arguments
+    :param remainder:   Arguments left for the file parsers
+    :param aggs:        List of aggregate names
+    :option labels:     Label results with the aggregate names
+    """
+    stats = _stats(args)
+    informat = getattr(parsers, args.informat)(designation='inparser',
+        stats=stats)
+    outformat = getattr(parsers, args.outformat)(designation='outparser',
+        stats=stats)
 
     informat.parse_args(remainder)
     outformat.parse_args(remainder)
 
-    cols, avgs = zip(*csvutils.fmap(informat.file, helpers.avg,
-        parser=informat,
-        columns=args.cols))
+    from . import multifile
+
+    pairs = [(col, agg) for col in (args.cols or [None]) for agg in aggs]
+
+    if args.follow is True:
+        _follow(args, informat, outformat, pairs, aggs, labels)
+        return
+
+    if len(informat.files) > 1:
+        try:
+            parts = csvutils.aggregate_files(informat.files, pairs,
+                parser=informat,
+                numeric_mode=args.numeric_mode,
+                batch_size=args.batch_size,
+                threads=args.jobs,
+                per_file=True)
+        except multifile.IncompatibleHeaderError as e:
+            sys.exit(str(e))
+    else:
+        results = csvutils.aggregate(informat.file, pairs,
+            parser=informat,
+            numeric_mode=args.numeric_mode,
+            batch_size=args.batch_size,
+            jobs=args.jobs,
+            cache=_cache(args))
+        parts = [(informat.files[0] if informat.files else '-', results),
+            (None, results)]
+
+    if args.per_file is True:
+        _table_files(args, outformat, parts, aggs, labels)
+    else:
+        _table(args, outformat, parts[-1][1], aggs, labels)
 
-    if args.precision:
-        avgs = ['{:.{}f}'.format(x, args.precision) for x in avgs]
+    _write(outformat)
+
+def _follow(args, informat, outformat, pairs, aggs, labels=True):
+    """
+    Write updated aggregates each time rows are appended to the input,
+    until interrupted.
+    :param args:        Parsed arguments from _aggregate_arguments
+    :param informat:    Parser object for importing file
+    :param outformat:   Parser object for exporting file
+    :param pairs:       List of (column, aggregate) tuples
+    :param aggs:        List of aggregate names
+    :option labels:     Label results with the aggregate names
+    """
+    from . import tail
+
+    stats = outformat.stats
+
+    if len(informat.files) > 1:
+        sys.exit('--follow takes a single file.')
+    if getattr(informat, 'start_row', None) is not None or \
+      getattr(informat, 'end_row', None) is not None:
+        sys.exit('--follow reads whole files; it does not take a row range.')
+
+    try:
+        updates = csvutils.follow(informat.file, pairs,
+            parser=informat,
+            numeric_mode=args.numeric_mode,
+            interval=args.interval,
+            every=args.every)
+
+        for results in updates:
+            _table(args, outformat, results, aggs, labels)
+            outformat.write(outformat.file)
+
+            # The reader went away; there is no one left to update.
+            if outformat.file.closed:
+                break
+            outformat.file.flush()
+    except tail.UnfollowableFileError as e:
+        sys.exit(str(e))
+    except KeyboardInterrupt:
+        pass
+
+    if stats is not None and stats.fmt is not None:
+        stats.report()
+
+def _table(args, outformat, results, aggs, labels=True):
+    """
+    Lay out aggregate results as the output table.
+    :param args:        Parsed arguments from _aggregate_arguments
+    :param outformat:   Parser object for exporting file
+    :param results:     List of (column, aggregate): result tuples
+    :param aggs:        List of aggregate names
+    :option labels:     Label results with the aggregate names
+    """
+    cols = []
+    values = {}
+
+    for (col, agg), val in results:
+        # Counts are left alone; they have no decimal places to show.
+        if args.precision and val is not None and not isinstance(val, int):
+            val = '{:.{}f}'.format(val, args.precision)
+        if col not in values:
+            cols.append(col)
+            values[col] = {}
+        values[col][agg] = val
 
     if args.transpose is True:
+        rows = [[col] + [values[col][agg] for agg in aggs] for col in cols]
+
         if args.alphabetize is True:
-            outformat.rows = sorted(zip(cols, avgs), key=lambda x: x[0])
-        else:
-            outformat.rows = zip(cols, avgs)
+            rows = sorted(rows, key=lambda x: x[0])
+        if labels is True:
+            outformat.header = ['column'] + list(aggs)
+
+        outformat.rows = rows
     else:
-        outformat.header = cols
-        outformat.rows = [avgs]
+        label = lambda x: [x] if labels is True else []
+
+        outformat.header = label('aggregate') + cols
+        outformat.rows = [label(agg) + [values[col][agg] for col in cols]
+            for agg in aggs]
+
+def _table_files(args, outformat, parts, aggs, labels=True):
+    """
+    Lay out the results of each file and their total as one table, with
+    a leading file column.
+    :param args:        Parsed arguments from _aggregate_arguments
+    :param outformat:   Parser object for exporting file
+    :param parts:       List of (path, results) tuples; a path of None
+                        marks the total
+    :param aggs:        List of aggregate names
+    :option labels:     Label results with the aggregate names
+    """
+    rows = []
+
+    for path, results in parts:
+        _table(args, outformat, results, aggs, labels)
+        name = path if path is not None else 'total'
+        rows.extend([name] + list(x) for x in outformat.rows)
+
+    if outformat.header is not None:
+        outformat.header = ['file'] + outformat.header
+    outformat.rows = rows
+
+def _pipeline(args):
+    """
+    Create the pipelined executor requested by --pipeline.
+    :param args:        Parsed arguments from _transform_arguments
+    :return Pipeline:   pipeline.Pipeline, or None when not requested
+    """
+    from . import pipeline
+
+    if args.pipeline is not True:
+        return None
+
+    return pipeline.Pipeline(batch_size=args.pipeline_batch_size)
+
+def _stats(args):
+    """
+    Create the instrumentation requested by --profile and --progress.
+    :param args:        Parsed arguments from _default_arguments
+    :return Stats:      instrument.Stats, or None when not requested
+    """
+    from . import instrument
+
+    if args.profile is None and args.progress is None:
+        return None
+
+    progress = lambda stats: sys.stderr.write(
+        'rows read: {}\n'.format(stats.rows_read))
+
+    return instrument.Stats(progress=progress, every=args.progress,
+        fmt=args.profile)
+
+def _cache(args):
+    """
+    Create the aggregate cache requested by --cache.
+    :param args:        Parsed arguments from _aggregate_arguments
+    :return Cache:      cache.Cache, or None when not requested
+    """
+    from . import cache
+
+    if args.cache is not True:
+        return None
+
+    return cache.Cache(args.cache_dir, max_bytes=args.cache_size << 20,
+        content_hash=args.cache_hash)
+
+def _input(informat):
+    """
+    Return what to read: the open input file, or the paths of the input
+    files when there are several.
+    :param informat:    Parser object for importing file
+    :return mixed:      File object or list of paths
+    """
+    return informat.files if len(informat.files) > 1 else informat.file
 
-    outformat.write(outformat.file)
+def _write(outformat):
+    """
+    Write a parser's table to its output file and flush it, so output sent
+    to an -o file is not lost when the interpreter shuts down.
+    :param outformat:   Parser object for exporting file
+    """
+    from . import multifile
+
+    stats = outformat.stats
+
+    try:
+        if stats is not None:
+            stats.write(outformat, outformat.file)
+        else:
+            outformat.write(outformat.file)
+    except multifile.IncompatibleHeaderError as e:
+        # Files after the first are only read as rows are written.
+        sys.exit(str(e))
+
+    if stats is not None:
+        # --progress alone does not ask for the report.
+        if stats.fmt is not None:
+            stats.report()
+        return
+
+    # Writers close the file themselves when the reader goes away.
+    if not outformat.file.closed:
+        outformat.file.flush()
+
+def csvavg():
+    """
+    Command line utility to average a csv file
+    """
+    parser = _aggregate_arguments('csvavg', 'an average')
+
+    args, remainder = parser.parse_known_args()
+
+    _aggregate(args, remainder, ['avg'], labels=False)
 
 def csvconvert():
     """
     Command line utility to convert one tabular format to another
     """
-    parser = _default_arguments()
+    parser = _transform_arguments()
     parser.add_argument('-t', '--to',
         dest='outformat',
         nargs='?',
@@ -101,122 +424,193 @@ def csvconvert():
 
     args, remainder = parser.parse_known_args()
 
-    informat = getattr(parsers, args.informat)(designation='inparser')
-    outformat = getattr(parsers, args.outformat)(designation='outparser')
+    stats = _stats(args)
+    informat = getattr(parsers, args.informat)(designation='inparser',
+        stats=stats)
+    outformat = getattr(parsers, args.outformat)(designation='outparser',
+        stats=stats)
 
     informat.parse_args(remainder)
     outformat.parse_args(remainder)
 
-    csvutils.convert(informat.file, informat, outformat).write(outformat.file)
+    _write(csvutils.convert(_input(informat), informat, outformat,
+        pipeline=_pipeline(args)))
 
 def csvdrop():
     """
     Command line utility to drop columns from a csv file
     """
-    parser = _default_arguments()
+    parser = _transform_arguments()
     parser.add_argument('-c', '--cols', nargs='*',
         help='A list of columns. Each column listed will be dropped.')
 
     args, remainder = parser.parse_known_args()
 
-    informat = getattr(parsers, args.informat)(designation='inparser')
+    informat = getattr(parsers, args.informat)(designation='inparser',
+        stats=_stats(args))
     informat.parse_args(remainder)
 
-    header, rows = csvutils.drop(informat.file,
+    header, rows = csvutils.drop(_input(informat),
         parser=informat,
-        columns=args.cols)
+        columns=args.cols,
+        pipeline=_pipeline(args))
 
     informat.header = header
     informat.rows = rows
     informat.designation = 'outparser'
     informat.parse_args(remainder)
-    informat.write(informat.file)
+    _write(informat)
+
+def csvindex():
+    """
+    Command line utility to write a sidecar row index next to a csv file
+    """
+    from . import sidecar
+
+    parser = _default_arguments()
+    parser.add_argument('-k', '--every',
+        type=int,
+        default=sidecar.EVERY,
+        help='Record the byte offset of every Nth row. Smaller values make ' \
+            'seeks faster and the index larger. Default {}.'.format(
+                sidecar.EVERY))
+    parser.add_argument('--rebuild',
+        action='store_true',
+        help='A flag to indicate the index should be rebuilt even if the ' \
+            'file has only been appended to.')
+
+    args, remainder = parser.parse_known_args()
+
+    informat = parsers.csv(designation='inparser')
+    informat.parse_args(remainder)
+
+    path = getattr(informat.file, 'name', None)
+    if not isinstance(path, str) or not os.path.isfile(path):
+        parser.error('csvindex can only index a file on disk.')
+    if len(informat.delimiter) != 1 or ord(informat.delimiter) > 127:
+        parser.error('csvindex needs a single ASCII delimiter.')
+
+    sidecar.update(path, every=args.every, force=args.rebuild,
+        delimiter=informat.delimiter)
 
 def csvkeep():
     """
     Command line utiltiy to keep columns in a csv file. The inverse of csvdrop
     """
-    parser = _default_arguments()
+    parser = _transform_arguments()
     parser.add_argument('-c', '--cols', nargs='*',
         help='A list of columns. Each column listed will be kept.')
 
     args, remainder = parser.parse_known_args()
 
-    informat = getattr(parsers, args.informat)(designation='inparser')
+    informat = getattr(parsers, args.informat)(designation='inparser',
+        stats=_stats(args))
     informat.parse_args(remainder)
 
-    header, rows = csvutils.keep(informat.file,
+    header, rows = csvutils.keep(_input(informat),
         parser=informat,
-        columns=args.cols)
+        columns=args.cols,
+        pipeline=_pipeline(args))
 
     informat.header = header
     informat.rows = rows
     informat.designation = 'outparser'
     informat.parse_args(remainder)
-    informat.write(informat.file)
+    _write(informat)
 
-def csvsum():
+def csvslice():
     """
-    Command line utility to sum a csv file
+    Command line utility to read a range of rows from a csv file, seeking
+    with its csvindex sidecar when there is one
     """
     parser = _default_arguments()
-    parser.add_argument('-c', '--cols', nargs='*',
-        help='A list of columns. Each column will have a sum generated.')
-    parser.add_argument('-a', '--alphabetize',
-        action='store_true',
-        help='A flag to indicate the output should be displayed in ' \
-            'alphabetical order. This argument is only valid if the output ' \
-            'is transposed. Equivalent to `csvsum ... -T | sort`.')
-    parser.add_argument('-p', '--precision',
+    parser.add_argument('-s', '--start',
         type=int,
-        help='The number of decimal places to show.')
+        help='First row to output, zero based. Negative values count back ' \
+            'from the end of the file.')
+    parser.add_argument('-e', '--end',
+        type=int,
+        help='Last row to output, inclusive.')
+    parser.add_argument('-n', '--tail',
+        type=int,
+        help='Output the last N rows. Equivalent to --start -N.')
     parser.add_argument('-t', '--to',
         dest='outformat',
         nargs='?',
         default='csv',
         help='Output file type. Default CSV.')
-    parser.add_argument('-T', '--transpose',
-        action='store_true',
-        help='A flag to indicate the output should be transposed so that ' \
-            'there are two columns and N rows, where N equals the number ' \
-            'of columns indicated to sum.')
 
     args, remainder = parser.parse_known_args()
 
-    informat = getattr(parsers, args.informat)(designation='inparser')
-    outformat = getattr(parsers, args.outformat)(designation='outparser')
+    stats = _stats(args)
+    informat = parsers.csv(designation='inparser', stats=stats)
+    outformat = getattr(parsers, args.outformat)(designation='outparser',
+        stats=stats)
 
     informat.parse_args(remainder)
     outformat.parse_args(remainder)
 
-    cols, sums = zip(*csvutils.fmap(informat.file, sum,
-        parser=informat,
-        columns=args.cols))
+    if args.tail is not None:
+        informat.start_row = -args.tail
+    elif args.start is not None:
+        informat.start_row = args.start
+    if args.end is not None:
+        informat.end_row = args.end
 
-    if args.precision:
-        sums = ['{:.{}f}'.format(x, args.precision) for x in sums]
+    _write(csvutils.convert(informat.file, informat, outformat))
 
-    if args.transpose is True:
-        if args.alphabetize is True:
-            outformat.rows = sorted(zip(cols, sums), key=lambda x: x[0])
-        else:
-            outformat.rows = zip(cols, sums)
-    else:
-        outformat.header = cols
-        outformat.rows = [sums]
+def csvstats():
+    """
+    Command line utility to compute several aggregates of a csv file in
+    a single pass
+    """
+    from . import aggregates
+
+    parser = _aggregate_arguments('csvstats', 'each aggregate')
+    parser.add_argument('-s', '--stats', nargs='*',
+        default=list(aggregates.AGGREGATES),
+        choices=aggregates.AGGREGATES,
+        help='A list of aggregates to compute. Default all; var is the ' \
+            'population variance.')
+
+    args, remainder = parser.parse_known_args()
+
+    _aggregate(args, remainder, args.stats)
+
+def csvsum():
+    """
+    Command line utility to sum a csv file
+    """
+    parser = _aggregate_arguments('csvsum', 'a sum')
 
-    outformat.write(outformat.file)
+    args, remainder = parser.parse_known_args()
+
+    _aggregate(args, remainder, ['sum'], labels=False)
 
 def csvtab():
     """
     Command line utility to tabulate a csv file for easy viewing
     """
     parser = _default_arguments()
+    parser.add_argument('-s', '--sample',
+        type=int,
+        help='Infer column widths from the first N rows and start ' \
+            'printing straight away. Longer values further down overflow ' \
+            'their column.')
+    parser.add_argument('--two-pass',
+        action='store_true',
+        dest='twopass',
+        help='A flag to indicate column widths should be measured in a ' \
+            'first pass over the file and the table printed in a second, ' \
+            'so the table is never held in memory. Only files can be read ' \
+            'twice; piped input is buffered instead.')
 
     args, remainder = parser.parse_known_args()
 
-    informat = getattr(parsers, args.informat)(designation='inparser')
-    outformat = parsers.table()
+    stats = _stats(args)
+    informat = getattr(parsers, args.informat)(designation='inparser',
+        stats=stats)
+    outformat = parsers.table(stats=stats)
 
     informat.parse_args(remainder)
     outformat.parse_args(remainder)
@@ -224,9 +618,11 @@ def csvtab():
     outformat.rows = csvutils.tabulate(informat.file,
         parser=informat,
         maxw=outformat.column_maxwidth,
-        pad=outformat.padding)
+        pad=outformat.padding,
+        sample=args.sample,
+        twopass=args.twopass)
 
-    outformat.write(outformat.file)
+    _write(outformat)
 
 
 class CSVUtilsHelpAction(argparse.Action):
@@ -0,0 +1,265 @@
+#
+# Transparently compressed files
+#
+
+from __future__ import absolute_import
+import argparse
+import atexit
+import importlib
+import io
+import os
+import sys
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+BLOCK_SIZE = 1 << 20
+QUEUE_SIZE = 8
+
+# Codec name to magic bytes, file extensions and module.
+CODECS = {
+    'gzip': (b'\x1f\x8b', ('.gz', '.gzip'), 'gzip'),
+    'bz2': (b'BZh', ('.bz2',), 'bz2'),
+    'xz': (b'\xfd7zXZ\x00', ('.xz', '.lzma'), 'lzma')}
+
+MAGIC_SIZE = max(len(x[0]) for x in CODECS.values())
+
+
+def sniff(head):
+    """
+    Identify a compressed stream from its first bytes.
+    :param head [bytes]: At least MAGIC_SIZE bytes from the start
+    :return [str]: Codec name, or None if the bytes are not compressed
+    """
+    for codec, (magic, _, _) in CODECS.items():
+        if head.startswith(magic):
+            return codec
+
+    return None
+
+def from_extension(path):
+    """
+    Identify the codec of a file from its extension.
+    :param path [str]: File path
+    :return [str]: Codec name, or None for an uncompressed file name
+    """
+    ext = os.path.splitext(path)[1].lower()
+
+    for codec, (_, exts, _) in CODECS.items():
+        if ext in exts:
+            return codec
+
+    return None
+
+def open(path, mode='r', encoding=None, errors=None):
+    """
+    Open a file, decompressing it if its first bytes are those of a
+    compressed stream, or compressing it if it is written to a name with
+    a compressed extension. Codec work runs in a background thread. '-'
+    is stdin or stdout.
+    :param path [str]: File path
+    :option mode [str]: r, rb, w or wb
+    :option encoding [str]: Text encoding. Default the locale's
+    :option errors [str]: Text encoding error handling
+    :return [File]: File object
+    """
+    binary = 'b' in mode
+
+    if 'r' in mode:
+        if path == '-':
+            raw = sys.stdin.buffer
+            codec = sniff(raw.peek(MAGIC_SIZE)[:MAGIC_SIZE])
+        else:
+            with io.open(path, 'rb') as f:
+                codec = sniff(f.read(MAGIC_SIZE))
+            raw = None
+
+        if codec is None:
+            if path == '-':
+                return raw if binary else sys.stdin
+            return io.open(path, mode, encoding=encoding, errors=errors)
+
+        stream = _module(codec).open(raw if raw is not None else path, 'rb')
+        stream = io.BufferedReader(_Reader(stream), BLOCK_SIZE)
+    else:
+        codec = from_extension(path) if path != '-' else None
+
+        if codec is None:
+            if path == '-':
+                return sys.stdout.buffer if binary else sys.stdout
+            return io.open(path, mode, encoding=encoding, errors=errors)
+
+        stream = _module(codec).open(path, 'wb')
+        stream = io.BufferedWriter(_Writer(stream), BLOCK_SIZE)
+
+        # Compressors only write their trailer when closed.
+        atexit.register(stream.close)
+
+    if binary:
+        return stream
+
+    return io.TextIOWrapper(stream, encoding=encoding, errors=errors)
+
+def _module(codec):
+    """
+    Import the module of a codec; lzma and bz2 are optional in Python
+    builds.
+    """
+    try:
+        return importlib.import_module(CODECS[codec][2])
+    except ImportError:
+        raise UnsupportedCompressionError(codec)
+
+
+class FileType(argparse.FileType):
+    """
+    argparse.FileType that opens files with compression.open.
+    """
+
+    def __call__(self, string):
+        try:
+            return open(string, self._mode, self._encoding, self._errors)
+        except (IOError, OSError, UnsupportedCompressionError) as e:
+            raise argparse.ArgumentTypeError(
+                "can't open '{}': {}".format(string, e))
+
+
+class _Reader(io.RawIOBase):
+    """
+    Read a decompressing stream ahead in a background thread, handing
+    blocks over through a bounded queue so decompression overlaps with
+    parsing. Closing stops and joins the thread before the stream is
+    closed; it also runs at exit, so an error or a closed pipe never
+    leaves the thread inside a read while the interpreter shuts down.
+    """
+
+    def __init__(self, stream, block_size=BLOCK_SIZE, queue_size=QUEUE_SIZE):
+        self._stream = stream
+        self._block_size = block_size
+        self._queue = queue.Queue(queue_size)
+        self._stop = threading.Event()
+        self._block = memoryview(b'')
+        self._eof = False
+        self._thread = threading.Thread(target=self._fill)
+        self._thread.daemon = True
+        self._thread.start()
+
+        atexit.register(self.close)
+
+    def _fill(self):
+        try:
+            while not self._stop.is_set():
+                block = self._stream.read(self._block_size)
+                if not self._put(block) or not block:
+                    return
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item):
+        """
+        Queue an item, giving up once the reader is closed.
+        :return [bool]: True if the item was queued
+        """
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        if not self._block:
+            if self._eof:
+                return 0
+
+            item = self._queue.get()
+            if isinstance(item, Exception):
+                self._eof = True
+                raise item
+            if not item:
+                self._eof = True
+                return 0
+
+            self._block = memoryview(item)
+
+        n = min(len(buf), len(self._block))
+        buf[:n] = self._block[:n]
+        self._block = self._block[n:]
+
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+            self._thread.join()
+            self._stream.close()
+            atexit.unregister(self.close)
+
+        super(_Reader, self).close()
+
+
+class _Writer(io.RawIOBase):
+    """
+    Hand written blocks to a compressing stream in a background thread
+    through a bounded queue, so compression overlaps with formatting.
+    """
+
+    def __init__(self, stream, queue_size=QUEUE_SIZE):
+        self._stream = stream
+        self._queue = queue.Queue(queue_size)
+        self._error = None
+        self._thread = threading.Thread(target=self._drain)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _drain(self):
+        while True:
+            block = self._queue.get()
+            if block is None:
+                return
+            if self._error is None:
+                try:
+                    self._stream.write(block)
+                except Exception as e:
+                    self._error = e
+
+    def writable(self):
+        return True
+
+    def write(self, buf):
+        if self._error is not None:
+            raise self._error
+
+        self._queue.put(bytes(buf))
+
+        return len(buf)
+
+    def close(self):
+        if not self.closed:
+            self._queue.put(None)
+            self._thread.join()
+            self._stream.close()
+
+        super(_Writer, self).close()
+
+        if self._error is not None:
+            raise self._error
+
+
+class UnsupportedCompressionError(Exception):
+    MESSAGE = "This Python was built without {} support."
+
+    def __init__(self, codec):
+        self.codec = codec
+
+    def __str__(self):
+        return self.MESSAGE.format(self.codec)
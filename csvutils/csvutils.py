@@ -4,108 +4,377 @@
 
 from __future__ import absolute_import
 from . import helpers, parsers
+import itertools
 
 
-def convert(fileobj, informat, outformat):
+def aggregate(fileobj, pairs, parser=None, numeric_mode='decimal',
+  batch_size=None, jobs=None, cache=None):
+    """
+    Compute several aggregates over several columns in one pass of a csv file
+    :param fileobj:     Open csv file handle
+    :param pairs:       List of (column, aggregate) tuples. See
+                        aggregates.AGGREGATES for the supported aggregates.
+                        A column of None means every column.
+    :option parser:     File parser, will default to standard CSV
+    :option numeric_mode: Cell conversion, see helpers.NUMERIC_MODES. `auto`
+                        picks a mode per column from the parser's schema
+    :option batch_size: Aggregate in columnar batches of this many rows
+    :option jobs:       Aggregate a csv file on disk with this many processes
+    :option cache:      cache.Cache to keep partial aggregates of csv files
+                        on disk in, so unchanged files are not read again.
+                        Row ranged reads bypass it
+    :return list:       List of (column, aggregate): result tuples
+    """
+    # Imported here; it loads the csv parser, which other formats skip.
+    from . import aggregates, parallel
+
+    parser = parser if parser is not None else parsers.csv()
+
+    if cache is not None and numeric_mode != 'auto' and \
+      cache.usable(fileobj, parser):
+        return cache.aggregate(fileobj, pairs, parser, numeric_mode,
+            batch_size, jobs)
+
+    if jobs is not None and jobs > 1 and parallel.splittable(fileobj, parser):
+        return parallel.aggregate(fileobj, pairs, parser, jobs,
+            numeric_mode, batch_size)
+
+    columns = [col for col, _ in pairs]
+    columns = columns if None not in columns else None
+
+    # Columnar parsers hand over whole typed columns.
+    if hasattr(parser, 'read_blocks'):
+        header, blocks = parser.read_blocks(fileobj, columns=columns)
+
+        if parser.stats is not None:
+            parser.stats.track(fileobj)
+            blocks = _tally(parser.stats, blocks)
+
+        return aggregates.aggregate_blocks(header, blocks, pairs,
+            numeric_mode, parser.schema)
+
+    header, rows = _read(parser, fileobj, columns=columns)
+    types = None
+
+    if numeric_mode == 'auto':
+        types, rows = parser.infer_schema(rows)
+
+    return aggregates.aggregate(header, rows, pairs, numeric_mode, batch_size,
+        types)
+
+def aggregate_files(paths, pairs, parser=None, numeric_mode='decimal',
+  batch_size=None, threads=None, per_file=False):
+    """
+    Compute aggregates over several csv files as if they were one, reading
+    several files at once and merging their partial results. Every file
+    must have the same header.
+    :param paths:       List of file paths
+    :param pairs:       List of (column, aggregate) tuples, as for aggregate
+    :option parser:     File parser, will default to standard CSV
+    :option numeric_mode: Cell conversion, see helpers.NUMERIC_MODES. `auto`
+                        picks a mode per column from the first file
+    :option batch_size: Aggregate in columnar batches of this many rows
+    :option threads:    Files read at once. Default multifile.THREADS
+    :option per_file:   Also return the results of each file
+    :return list:       List of (column, aggregate): result tuples. With
+                        per_file, a list of (path, results) tuples ending
+                        with (None, results) for all the files together
+    """
+    from . import multifile
+
+    parser = parser if parser is not None else parsers.csv()
+
+    total, parts = multifile.aggregate(paths, pairs, parser, numeric_mode,
+        batch_size, threads)
+
+    if per_file is True:
+        return parts + [(None, total)]
+
+    return total
+
+def follow(fileobj, pairs, parser=None, numeric_mode='decimal',
+  interval=None, every=None):
+    """
+    Aggregate a csv file that is still being written, like tail -f. Only
+    rows appended since the last update are parsed and merged into the
+    running aggregates.
+    :param fileobj:     Open csv file handle of a file on disk
+    :param pairs:       List of (column, aggregate) tuples, as for aggregate
+    :option parser:     File parser, will default to standard CSV
+    :option numeric_mode: Cell conversion, see helpers.NUMERIC_MODES. `auto`
+                        picks a mode per column from the first rows
+    :option interval:   Seconds to wait for new rows between polls.
+                        Default tail.INTERVAL
+    :option every:      Yield results after every this many rows rather
+                        than after each poll that found new rows
+    :return generator:  Lists of (column, aggregate): result tuples
+    """
+    from . import parallel, tail
+
+    parser = parser if parser is not None else parsers.csv()
+    interval = interval if interval is not None else tail.INTERVAL
+
+    if not parallel.splittable(fileobj, parser):
+        raise tail.UnfollowableFileError(
+            getattr(fileobj, 'name', 'compressed input'))
+
+    return tail.follow(fileobj, pairs, parser, numeric_mode, interval, every)
+
+def convert(fileobj, informat, outformat, pipeline=None):
     """
     Convert a file from one format to another.
-    :param fileobj:         Open tabular file handle
+    :param fileobj:         Open tabular file handle, or a list of paths
+                            of files with the same header
     :param informat:        Parser object for importing file
     :param outformat:       Parser object for exporting file
+    :option pipeline:       pipeline.Pipeline to read in a thread of its
+                            own while the rows are written
     """
-    header, rows = informat.read(fileobj)
+    header, rows = _read(informat, fileobj)
     outformat.header = header
-    outformat.rows = rows
+    outformat.rows = pipeline.run(rows) if pipeline is not None else rows
 
     return outformat
 
-def fmap(fileobj, func, parser=None, columns=None):
+def fmap(fileobj, func, parser=None, columns=None, numeric_mode='decimal',
+  batch_size=None, jobs=None, cache=None):
     """
     Apply a function across columns in a csv file
     :param file_obj:    Open csv file handle
     :param func:        Function to apply
     :option parser:     File parser, will default to standard CSV
     :option columns:    CSV header columns to average, default all
+    :option numeric_mode: Cell conversion, see helpers.NUMERIC_MODES, or auto
+    :option batch_size: Aggregate in columnar batches of this many rows.
+                        Only used for functions in aggregates.FUNCTIONS.
+    :option jobs:       Aggregate with this many processes. Only used for
+                        functions in aggregates.FUNCTIONS.
+    :option cache:      See aggregate. Only used for functions in
+                        aggregates.FUNCTIONS.
     :return list:       List of column: result tuples
     """
+    from . import aggregates
+
     columns = columns if columns is not None else []
     parser = parser if parser is not None else parsers.csv()
 
-    header, rows = parser.read(fileobj)
+    # Known aggregates are computed for every column in a single pass.
+    if func in aggregates.FUNCTIONS:
+        agg = aggregates.FUNCTIONS[func]
+        res = aggregate(fileobj, [(x, agg) for x in columns or [None]],
+            parser=parser,
+            numeric_mode=numeric_mode,
+            batch_size=batch_size,
+            jobs=jobs,
+            cache=cache)
+
+        return [(col, val) for (col, _), val in res]
+
+    header, rows = _read(parser, fileobj, columns=columns)
 
     to_app = helpers.indexes(header, columns)
+    names = helpers.ikeep(header, to_app)
+
+    if numeric_mode == 'auto':
+        types, rows = parser.infer_schema(rows)
+        modes = aggregates.modes(names, numeric_mode, types)
+    else:
+        modes = [numeric_mode] * len(names)
+
+    # Rows can only be consumed once, so collect just the applied columns.
     res = []
+    converts = [helpers.numeric(x) for x in modes]
+    cols = [[] for _ in to_app]
+    for row in rows:
+        for col, index in zip(cols, to_app):
+            col.append(row[index])
 
-    for index in to_app:
-        res.append(func(helpers.tofloat(x[index]) for x in rows))
+    for col, convert in zip(cols, converts):
+        res.append(func(convert(x) for x in col))
 
-    return zip(helpers.ikeep(header, to_app), res)
+    return zip(names, res)
 
-def drop(fileobj, parser=None, columns=None):
+def drop(fileobj, parser=None, columns=None, pipeline=None):
     """
     Transform a list of headers and rows to remove specific values
-    :param file_obj:    Open csv file handle
+    :param file_obj:    Open csv file handle, or a list of paths of files
+                        with the same header
     :option parser:     File parser, will default to standard CSV
     :option columns:    CSV header columns to drop, default all
-    :return tuple:      New header/rows
+    :option pipeline:   pipeline.Pipeline to read and drop in threads of
+                        their own while the rows are written
+    :return tuple:      New header and lazy rows
     """
     columns = columns if columns is not None else []
     parser = parser if parser is not None else parsers.csv()
 
-    header, rows = parser.read(fileobj)
+    header, rows = _read(parser, fileobj)
 
-    drops = helpers.indexes(header, columns)
+    drops = set(helpers.indexes(header, columns))
+    keeps = [i for i in range(len(header)) if i not in drops]
 
-    mod_h = helpers.imask(header, drops)
-    mod_r = [helpers.imask(x, drops) for x in rows]
+    mod_h = helpers.ikeep(header, keeps)
+    # Cells past the header's width are not dropped.
+    project = helpers.projection(keeps, rest=len(header))
 
-    return mod_h, mod_r
+    if pipeline is not None:
+        return mod_h, pipeline.run(rows, project)
 
-def keep(fileobj, parser=None, columns=None):
+    return mod_h, map(project, rows)
+
+def keep(fileobj, parser=None, columns=None, pipeline=None):
     """
     Transform a list of headers and rows to keep specific values
-    :param file_obj:    Open csv file handle
+    :param file_obj:    Open csv file handle, or a list of paths of files
+                        with the same header
     :option parser:     File parser, will default to standard CSV
     :option columns:    CSV header columns to keep, default all
-    :return tuple:      New header/rows
+    :option pipeline:   pipeline.Pipeline to read and keep in threads of
+                        their own while the rows are written
+    :return tuple:      New header and lazy rows
     """
     columns = columns if columns is not None else []
     parser = parser if parser is not None else parsers.csv()
 
-    header, rows = parser.read(fileobj)
+    header, rows = _read(parser, fileobj, columns=columns)
 
-    keeps = helpers.indexes(header, columns)
+    # Parsers that support projection have already dropped the other
+    # columns, in which case every remaining column is kept.
+    keeps = sorted(set(helpers.indexes(header, columns)))
 
     mod_h = helpers.ikeep(header, keeps)
-    mod_r = [helpers.ikeep(x, keeps) for x in rows]
+    transforms = [helpers.projection(keeps)] \
+        if len(keeps) != len(header) else []
+
+    if pipeline is not None:
+        return mod_h, pipeline.run(rows, *transforms)
+
+    mod_r = map(transforms[0], rows) if transforms else rows
 
     return mod_h, mod_r
 
-def tabulate(fileobj, parser=None, maxw=None, pad=0):
+def tabulate(fileobj, parser=None, maxw=None, pad=0, sample=None,
+  twopass=False):
     """
     Format the table
     :param file_obj:    Open csv file handle
     :param parser:      File parser, will default to standard CSV
     :option maxw:       Max cell width
     :option pad:        Cell padding
+    :option sample:     Infer column widths from the first N rows only and
+                        stream the rest; longer values overflow their column
+    :option twopass:    Measure column widths while streaming, then re-read
+                        the file to format it. Input that cannot be
+                        re-read is held in memory instead.
     :return list:       Formatted table in matrix like form.
     """
     parser = parser if parser is not None else parsers.csv('inparser')
-    header, rows = parser.read(fileobj)
+    from . import schema
+
+    header, rows = _read(parser, fileobj)
+
+    inference = schema.Inference(header)
+
+    if sample is not None:
+        head = list(itertools.islice(rows, sample))
+        widths = _measure(header, head, inference, maxw, pad)
+        rows = itertools.chain(head, rows)
+
+    elif twopass is True and _seekable(fileobj):
+        widths = _measure(header, rows, inference, maxw, pad)
+        fileobj.seek(0)
+        header, rows = _read(parser, fileobj)
+
+    else:
+        rows = list(rows)
+        widths = _measure(header, rows, inference, maxw, pad)
+
+    # Columns are right aligned when every value is numeric.
+    aligns = ['<' if x is not None and x not in schema.NUMERIC else '>'
+        for x in inference.types]
+    parser.schema = inference.schema
 
-    full = list(rows)
-    full.insert(0, header)
-    flat = zip(*full)
     fmt = lambda s, w, a='<': '{:{}{}}'.format(s, a, w)
     strnone = lambda x: str(x) if x is not None else None
-    fmtcol = []
+    trunc = lambda x: helpers.trunc(x, maxw) if maxw is not None else x or ''
+    fmtrow = lambda row: [fmt(trunc(strnone(x)), w, a)
+        for x, w, a in zip(row, widths, aligns)]
 
-    for head, vals in zip(header, flat):
-        vals = [strnone(x) for x in vals]
-        calign = helpers.align(vals[1:])
-        cells = [len(x) for x in vals if x is not None]
-        cmax = max(cells) + pad if cells else 0
-        cmax = maxw if maxw is not None and maxw < cmax else cmax
-        fmtcol.append([fmt(helpers.trunc(x, cmax), cmax, calign) for x in vals])
+    # The header takes the alignment of its column.
+    return itertools.chain([fmtrow(header)], (fmtrow(x) for x in rows))
 
-    return zip(*fmtcol)
+def _measure(header, rows, inference, maxw=None, pad=0):
+    """
+    Measure column widths in a single pass over rows, inferring the
+    column types on the way.
+    :param header:      Header columns
+    :param rows:        Iterable of rows
+    :param inference:   schema.Inference fed with every row
+    :option maxw:       Max cell width
+    :option pad:        Cell padding
+    :return list:       Column widths
+    """
+    cells = [len(str(x)) if x is not None else 0 for x in header]
+    columns = range(len(header))
+
+    for row in rows:
+        inference.add(row)
+
+        for i, x in zip(columns, row):
+            if x is None:
+                continue
+
+            x = str(x)
+            if len(x) > cells[i]:
+                cells[i] = len(x)
+
+    widths = [x + pad for x in cells]
+    widths = [maxw if maxw is not None and maxw < x else x for x in widths]
+
+    return widths
+
+def _read(parser, fileobj, **kwargs):
+    """
+    Read a file with a parser, tracking the rows when the parser has stats
+    attached (see instrument.Stats).
+    :param parser:      File parser
+    :param fileobj:     Open file handle, or a list of paths to read one
+                        after another (see multifile.read)
+    :param kwargs:      Keyword arguments for parser.read
+    :return tuple:      Header and rows
+    """
+    if isinstance(fileobj, list):
+        from . import multifile
+        header, rows = multifile.read(parser, fileobj, **kwargs)
+        tracked = None
+    else:
+        header, rows = parser.read(fileobj, **kwargs)
+        tracked = fileobj
+
+    if parser.stats is not None:
+        rows = parser.stats.reader(rows, tracked)
+        parser.rows = rows
+
+    return header, rows
+
+def _tally(stats, blocks):
+    """
+    Count the rows of column blocks read (see instrument.Stats).
+    :param stats:       instrument.Stats
+    :param blocks:      (rows, blocks) tuples from a parser's read_blocks
+    :return generator:  The same blocks
+    """
+    for block in blocks:
+        stats.rows_read += block[0]
+        yield block
+
+def _seekable(fileobj):
+    """
+    Check whether a file can be rewound and read again
+    :param fileobj:     Open file handle
+    :return bool:       True if the file is seekable
+    """
+    try:
+        return fileobj.seekable()
+    except (AttributeError, ValueError):
+        return False
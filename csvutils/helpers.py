@@ -8,11 +8,43 @@
 from __future__ import division
 import csv
 import decimal
+import operator
 
 
 KEY_VALUE_STR_FORMAT = '{:<{}}{:>{}}'
 TAB_WIDTH = 4
 
+# Numeric conversion modes. Precision trade-offs:
+#   decimal - Exact base 10 arithmetic (28 significant digits). Slowest.
+#   float   - Binary double precision. Several times faster, but values
+#             such as 0.1 are inexact and rounding error accumulates over
+#             long sums (about 15 significant digits are reliable).
+#   int     - Exact and fast, but only whole numbers parse; any other
+#             cell counts as 0.
+NUMERIC_MODES = {
+    'decimal': decimal.Decimal,
+    'float': float,
+    'int': int}
+
+# Modes picked by the auto numeric mode for columns it inferred from a
+# sample. Cells are cast with the first mode, and cells it rejects with
+# the second, so a value the sample did not show is widened rather than
+# counted as 0.
+WIDENING_MODES = {
+    'int+decimal': ('int', 'decimal')}
+
+# Characters a numeric cell may start with. Anything else is skipped
+# without paying for a failed conversion.
+NUMERIC_START = frozenset('0123456789+-. \t')
+
+# Where a scan of raw csv bytes stands, see record_ends: at the start of a
+# field, in an unquoted field, in a quoted field, or just after a quote
+# in a quoted field (a closing or doubled quote, depending on what
+# follows).
+FIELD, UNQUOTED, QUOTED, QUOTE_IN_QUOTED = range(4)
+QUOTE = b'"'
+NEWLINE = b'\n'
+
 
 def align(values):
     """
@@ -44,6 +76,7 @@ def ikeep(vals, indexes):
     :param indexes:     List of indexes to apply
     :return list:       Masked list
     """
+    indexes = set(indexes)
     return [x for i, x in enumerate(vals) if i in indexes]
 
 def imask(vals, indexes):
@@ -53,6 +86,7 @@ def imask(vals, indexes):
     :param indexes:     List of indexes to apply
     :return list:       Masked list
     """
+    indexes = set(indexes)
     return [x for i, x in enumerate(vals) if i not in indexes]
 
 def indexes(haystack, needles):
@@ -69,20 +103,151 @@ def indexes(haystack, needles):
 
     return indexes
 
-def tofloat(value):
+def numeric(mode='decimal'):
     """
-    Convert a value to a float.  Return 0 for any failures.
-    :param value:       Value to convert
-    :return float:      Converted value
+    Return a function converting a value to a number of the given mode.
+    Empty, missing and non-numeric values convert to 0.
+    :option mode:       One of NUMERIC_MODES or WIDENING_MODES, default
+                        decimal
+    :return function:   Converter
     """
-    value = 0 if value is None else value
+    cast = numeric_type(mode)
+    zero = cast(0)
+    errors = (ValueError, TypeError, decimal.InvalidOperation)
 
-    try:
-        number = decimal.Decimal(value)
-    except (decimal.InvalidOperation, TypeError):
-        number = decimal.Decimal(0)
+    if mode in WIDENING_MODES:
+        widen = NUMERIC_MODES[WIDENING_MODES[mode][1]]
+    else:
+        widen = None
+
+    def convert(value):
+        if not value:
+            return zero
+        if isinstance(value, str) and value[0] not in NUMERIC_START:
+            return zero
+
+        try:
+            return cast(value)
+        except errors:
+            if widen is None:
+                return zero
 
-    return number
+        try:
+            return widen(value)
+        except errors:
+            return zero
+
+    return convert
+
+def numeric_type(mode):
+    """
+    Return the type a numeric mode casts cells to first.
+    :param mode:        One of NUMERIC_MODES or WIDENING_MODES
+    :return type:       Numeric type
+    """
+    if mode in WIDENING_MODES:
+        mode = WIDENING_MODES[mode][0]
+
+    return NUMERIC_MODES[mode]
+
+def projection(indexes, rest=None):
+    """
+    Compile a function that extracts the values at a list of indexes.
+    Resolve the indexes once and apply the function to every row rather
+    than calling ikeep per row. Rows too short for every index keep the
+    values they have.
+    :param indexes:     List of indexes to keep, in output order
+    :option rest:       Also keep every value from this index on, e.g. the
+                        cells of a row past the header's width
+    :return function:   Function returning a tuple of the kept values
+    """
+    indexes = list(indexes)
+    last = max(indexes) if indexes else -1
+
+    if not indexes:
+        getter = lambda vals: ()
+    elif len(indexes) == 1:
+        index = indexes[0]
+        getter = lambda vals: (vals[index],)
+    else:
+        getter = operator.itemgetter(*indexes)
+
+    if rest is None:
+        def project(vals):
+            if len(vals) > last:
+                return getter(vals)
+            return tuple(vals[i] for i in indexes if i < len(vals))
+    else:
+        def project(vals):
+            if len(vals) > last:
+                kept = getter(vals)
+            else:
+                kept = tuple(vals[i] for i in indexes if i < len(vals))
+            return kept + tuple(vals[rest:]) if len(vals) > rest else kept
+
+    return project
+
+def record_ends(data, delimiter, state=FIELD, pos=0):
+    """
+    Find the newlines that end csv records in raw bytes, following the
+    csv module's rules: a quote only opens a quoted field at the start of
+    a field, and a newline only ends a record outside a quoted field.
+    :param data:        Bytes to scan
+    :param delimiter:   Column delimiter, a single byte
+    :option state:      Scan state at pos, default FIELD
+    :option pos:        Offset to start scanning from, default 0
+    :return tuple:      Offsets just past each record's newline, scan
+                        state at the end of data
+    """
+    ends = []
+    size = len(data)
+
+    while pos < size:
+        if state == QUOTED:
+            pos = data.find(QUOTE, pos)
+            if pos == -1:
+                break
+            pos += 1
+            state = QUOTE_IN_QUOTED
+            continue
+
+        if state == QUOTE_IN_QUOTED:
+            if data[pos:pos + 1] == QUOTE:
+                pos += 1
+                state = QUOTED
+                continue
+            # The field was closed; anything up to the delimiter is kept
+            # as is, quotes included.
+            state = UNQUOTED
+
+        newline = data.find(NEWLINE, pos)
+        stop = size if newline == -1 else newline
+        quote = data.find(QUOTE, pos, stop)
+
+        while quote != -1 and not (quote == pos and state == FIELD or
+          quote > pos and data[quote - 1:quote] == delimiter):
+            quote = data.find(QUOTE, quote + 1, stop)
+
+        if quote != -1:
+            pos = quote + 1
+            state = QUOTED
+        elif newline == -1:
+            state = FIELD if data[size - 1:] == delimiter else UNQUOTED
+            break
+        else:
+            pos = newline + 1
+            ends.append(pos)
+            state = FIELD
+
+    return ends, state
+
+def tofloat(value):
+    """
+    Convert a value to an exact Decimal.  Return 0 for any failures.
+    :param value:       Value to convert
+    :return Decimal:    Converted value
+    """
+    return _todecimal(value)
 
 def trunc(string, width, replace='...'):
     """
@@ -96,3 +261,6 @@ def trunc(string, width, replace='...'):
     string = '' if string is None else string
 
     return string[:width - len(replace)] + replace if len(string) > width else string
+
+
+_todecimal = numeric('decimal')
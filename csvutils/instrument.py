@@ -0,0 +1,231 @@
+#
+# Throughput and timing instrumentation
+#
+
+from __future__ import absolute_import, division
+import json
+import os
+import stat
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+STAGES = ('parse', 'transform', 'write')
+
+
+class Stats(object):
+    """
+    Collect rows read and written, bytes processed, time per stage and
+    peak memory for one run. Rows are lazy, so the stages interleave: time
+    spent pulling rows out of a parser is parse time, time inside a
+    writer that is not spent waiting for rows is write time, and the rest
+    is transform time.
+
+    Attach a Stats to parsers with the `stats` keyword; the csvutils
+    functions then track their reads. Write with Stats.write and finish
+    with Stats.report:
+
+        stats = Stats(progress=print, every=100000)
+        informat = parsers.csv(stats=stats)
+        outformat = csvutils.convert(f, informat, parsers.json(stats=stats))
+        stats.write(outformat, out)
+        stats.report()
+    """
+
+    def __init__(self, progress=None, every=None, fmt=None):
+        """
+        :option progress [function]: Called with this object every `every`
+            rows read
+        :option every [int]: Progress interval in rows
+        :option fmt [str]: Report format, text or json. Default text
+        """
+        self.rows_read = 0
+        self.rows_written = 0
+        self.bytes_read = None
+        self.bytes_written = None
+        self.parse = 0.0
+        self.upstream = 0.0
+        self.write_total = 0.0
+        self.progress = progress
+        self.every = every if progress is not None else None
+        self.fmt = fmt
+        self.start = time.perf_counter()
+        self.end = None
+        self._inputs = []
+
+    def reader(self, rows, fileobj=None):
+        """
+        Wrap the rows of a parser to time and count them.
+        :param rows [iter]: Rows returned by Parser.read
+        :option fileobj [File]: The file the rows are read from
+        :return [generator]: The same rows
+        """
+        if fileobj is not None:
+            self.track(fileobj)
+
+        return self._reader(iter(rows))
+
+    def track(self, fileobj):
+        """
+        Count an input file towards bytes read.
+        :param fileobj [File]: Input file
+        """
+        if fileobj not in self._inputs:
+            self._inputs.append(fileobj)
+
+    def _reader(self, rows):
+        """
+        Time and count rows as they are parsed.
+        """
+        clock = time.perf_counter
+        every = self.every
+
+        while True:
+            start = clock()
+            try:
+                row = next(rows)
+            except StopIteration:
+                self.parse += clock() - start
+                return
+            self.parse += clock() - start
+            self.rows_read += 1
+
+            if every and self.rows_read % every == 0:
+                self.progress(self)
+
+            yield row
+
+    def _writer(self, rows):
+        """
+        Wrap the rows a writer consumes, timing how long it waits for them.
+        """
+        clock = time.perf_counter
+        rows = iter(rows)
+
+        while True:
+            start = clock()
+            try:
+                row = next(rows)
+            except StopIteration:
+                self.upstream += clock() - start
+                return
+            self.upstream += clock() - start
+            self.rows_written += 1
+
+            yield row
+
+    def write(self, parser, fileobj):
+        """
+        Write a parser's rows to a file, timing the write.
+        :param parser [Parser]: Output parser with header and rows set
+        :param fileobj [File]: File to write to
+        """
+        parser.rows = self._writer(parser.rows)
+
+        start = time.perf_counter()
+        parser.write(fileobj)
+        self.write_total += time.perf_counter() - start
+
+        if not getattr(fileobj, 'closed', True):
+            fileobj.flush()
+        self.bytes_written = _size(fileobj)
+
+    def finish(self):
+        """
+        Stop the clock and measure the inputs. Called by report.
+        :return [Stats]: self
+        """
+        if self.end is None:
+            self.end = time.perf_counter()
+
+            sizes = [_size(x) for x in self._inputs]
+            if sizes and None not in sizes:
+                self.bytes_read = sum(sizes)
+
+        return self
+
+    def as_dict(self):
+        """
+        Return the statistics collected so far.
+        :return [dict]: Statistic name to value
+        """
+        end = self.end if self.end is not None else time.perf_counter()
+        wall = end - self.start
+        write = max(self.write_total - self.upstream, 0.0)
+        transform = max(wall - self.parse - write, 0.0)
+
+        return {
+            'rows_read': self.rows_read,
+            'rows_written': self.rows_written,
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'wall': wall,
+            'parse': self.parse,
+            'transform': transform,
+            'write': write,
+            'rows_per_sec': self.rows_read / wall if wall else None,
+            'peak_rss_kb': peak_rss()}
+
+    def report(self, fileobj=None, fmt=None):
+        """
+        Print the statistics.
+        :option fileobj [File]: Where to print. Default stderr
+        :option fmt [str]: text or json. Default self.fmt
+        """
+        fileobj = fileobj if fileobj is not None else sys.stderr
+        fmt = fmt or self.fmt or 'text'
+        stats = self.finish().as_dict()
+
+        if fmt == 'json':
+            fileobj.write(json.dumps(stats, sort_keys=True) + '\n')
+            return
+
+        line = '{:<14}{}\n'
+        show = lambda x, f='{}': f.format(x) if x is not None else '-'
+
+        fileobj.write(line.format('rows read', stats['rows_read']))
+        fileobj.write(line.format('rows written', stats['rows_written']))
+        fileobj.write(line.format('bytes read', show(stats['bytes_read'])))
+        fileobj.write(line.format('bytes written',
+            show(stats['bytes_written'])))
+        for stage in STAGES:
+            fileobj.write(line.format(stage, '{:.3f} s'.format(stats[stage])))
+        fileobj.write(line.format('wall', '{:.3f} s'.format(stats['wall'])))
+        fileobj.write(line.format('rows/sec',
+            show(stats['rows_per_sec'], '{:.0f}')))
+        fileobj.write(line.format('peak memory',
+            show(stats['peak_rss_kb'], '{} KiB')))
+
+
+def peak_rss():
+    """
+    Peak resident memory of this process.
+    :return [int]: KiB, or None where the platform can not report it
+    """
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is in bytes on macOS and KiB elsewhere.
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+def _size(fileobj):
+    """
+    Size of a regular file.
+    :param fileobj [File]: Open file object
+    :return [int]: Bytes, or None for pipes and terminals
+    """
+    try:
+        info = os.fstat(fileobj.fileno())
+        if stat.S_ISREG(info.st_mode):
+            return info.st_size
+    except (AttributeError, OSError, ValueError):
+        pass
+
+    return None
@@ -0,0 +1,236 @@
+#
+# Read and aggregate several files as one table
+#
+
+from __future__ import absolute_import
+from . import compression, helpers
+import copy
+import glob
+
+
+THREADS = 4
+
+
+def expand(names):
+    """
+    Expand glob patterns in a list of file names. Patterns are sorted and
+    must match at least one file; other names are kept as given.
+    :param names [list]: File names and patterns
+    :return [list]: File paths
+    """
+    paths = []
+
+    for name in names:
+        if glob.has_magic(name):
+            matches = sorted(glob.glob(name))
+            if not matches:
+                raise NoMatchingFilesError(name)
+            paths.extend(matches)
+        else:
+            paths.append(name)
+
+    return paths
+
+def read(parser, paths, columns=None):
+    """
+    Read files one after another as a single table. Each file is opened
+    when the rows before it have been consumed, and must have the same
+    header as the first.
+    :param parser [Parser]: File parser, shared by every file
+    :param paths [list]: File paths
+    :option columns [list]: Only read these columns. Default all
+    :return [tuple]: Header of the first file, rows of every file
+    """
+    first = _first(parser, paths[0])
+    header, rows = parser.read(first, columns=columns)
+    expected = _header(parser, paths[0]) if columns else header
+
+    def generate():
+        for row in rows:
+            yield row
+        first.close()
+
+        for path in paths[1:]:
+            other = _copy(parser)
+            fileobj = _open(other, path)
+            try:
+                _, more = _verify(other, fileobj, path, expected, columns)
+                for row in more:
+                    yield row
+            finally:
+                fileobj.close()
+
+    parser.rows = generate()
+
+    return header, parser.rows
+
+def aggregate(paths, pairs, parser, numeric_mode='decimal', batch_size=None,
+  threads=None):
+    """
+    Compute aggregates over several files, reading up to `threads` files at
+    once and merging their partial column states. Every file must have
+    the same header as the first.
+    :param paths [list]: File paths
+    :param pairs [list]: (column, aggregate) tuples
+    :param parser [Parser]: File parser, copied for each file
+    :option numeric_mode [str]: One of helpers.NUMERIC_MODES, or auto to
+        pick the modes from the first rows of the first file
+    :option batch_size [int]: See aggregates.accumulate
+    :option threads [int]: Files read at once. Default THREADS
+    :return [tuple]: (column, aggregate), result tuples of all the files
+        together, and a list of (path, results) tuples of each file
+    """
+    from . import aggregates
+
+    columns = [col for col, _ in pairs]
+    columns = columns if None not in columns else None
+
+    # The first file fixes the header, and the modes for auto.
+    sample = _copy(parser)
+    fileobj = _first(sample, paths[0])
+    try:
+        header, rows = _read(sample, fileobj, paths[0], columns)
+        expected = _header(sample, paths[0]) if columns else header
+        pairs, tracked, variance = aggregates.plan(header, pairs)
+        if numeric_mode == 'auto':
+            types, _ = sample.infer_schema(rows)
+            numeric_mode = aggregates.modes(tracked, 'auto', types)
+    finally:
+        fileobj.close()
+
+    index = list(helpers.indexes(header, tracked))
+
+    def partial(path):
+        other = _copy(parser)
+        fileobj = _open(other, path)
+        try:
+            _, rows = _verify(other, fileobj, path, expected, columns)
+            return aggregates.accumulate(rows, index, variance, numeric_mode,
+                batch_size)
+        finally:
+            fileobj.close()
+
+    threads = min(threads or THREADS, len(paths))
+
+    if threads > 1:
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            parts = list(pool.map(partial, paths))
+    else:
+        parts = [partial(x) for x in paths]
+
+    totals = [aggregates.ColumnState(variance=x, convert=None)
+        for x in variance]
+    for states in parts:
+        for total, state in zip(totals, states):
+            total.merge(state)
+
+    if parser.stats is not None and totals:
+        parser.stats.rows_read += totals[0].count
+
+    return aggregates.results(pairs, tracked, totals), \
+        [(path, aggregates.results(pairs, tracked, states))
+            for path, states in zip(paths, parts)]
+
+def _copy(parser):
+    """
+    Copy a parser so files can be read with it at the same time.
+    """
+    other = copy.copy(parser)
+    other.header = None
+    other.rows = None
+    other.schema = None
+    other.stats = None
+
+    return other
+
+def _read(parser, fileobj, path, columns=None):
+    """
+    Read a file, reporting requested columns it lacks as a header mismatch.
+    """
+    try:
+        return parser.read(fileobj, columns=columns)
+    except ValueError:
+        found = _header(parser, path) if columns else None
+        if found is not None and not set(columns) <= set(found):
+            raise IncompatibleHeaderError(path, columns, found)
+        raise
+
+def _header(parser, path):
+    """
+    Read just the header of a file.
+    """
+    other = _copy(parser)
+    fileobj = _open(other, path)
+    try:
+        return other.read(fileobj)[0]
+    finally:
+        fileobj.close()
+
+def _verify(parser, fileobj, path, expected, columns=None):
+    """
+    Read a file, making sure its whole header matches the first file's
+    even when only some columns are read.
+    :return [tuple]: Header, rows
+    """
+    if columns:
+        _check(expected, _header(parser, path), path)
+
+    head, rows = _read(parser, fileobj, path, columns)
+
+    if not columns:
+        _check(expected, head, path)
+
+    return head, rows
+
+def _check(expected, header, path):
+    """
+    Make sure a file has the header of the first file.
+    """
+    if header != expected:
+        raise IncompatibleHeaderError(path, expected, header)
+
+def _first(parser, path):
+    """
+    Open the first file, reusing the handle Parser._open_files opened for
+    it when the paths came from the command line, so it is closed here
+    with the others.
+    """
+    fileobj = getattr(parser, 'file', None)
+    files = getattr(parser, 'files', None)
+
+    if files and files[0] == path and fileobj is not None and \
+      not fileobj.closed:
+        return fileobj
+
+    return _open(parser, path)
+
+def _open(parser, path):
+    """
+    Open a file in the parser's read mode, decompressing it if need be.
+    """
+    return compression.open(path, parser.READ_MODE)
+
+
+class IncompatibleHeaderError(Exception):
+    MESSAGE = "Header of '{}' does not match the first file: expected " \
+        "{}, found {}."
+
+    def __init__(self, path, expected, found):
+        self.path = path
+        self.expected = expected
+        self.found = found
+
+    def __str__(self):
+        return self.MESSAGE.format(self.path, self.expected, self.found)
+
+
+class NoMatchingFilesError(Exception):
+    MESSAGE = "No files match '{}'."
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+    def __str__(self):
+        return self.MESSAGE.format(self.pattern)
@@ -0,0 +1,277 @@
+#
+# Multi-process chunked aggregation of csv files
+#
+
+from __future__ import absolute_import
+from . import aggregates, helpers
+from .parsers.builtins.csv import CSVParser
+import codecs
+import csv
+import io
+import os
+
+
+BLOCK_SIZE = 1 << 20
+CHUNKS_PER_JOB = 4
+NEWLINE = b'\n'
+STATES = (helpers.FIELD, helpers.UNQUOTED, helpers.QUOTED,
+    helpers.QUOTE_IN_QUOTED)
+
+
+def splittable(fileobj, parser):
+    """
+    Check whether a file can be split into byte ranges and aggregated in
+    parallel. Only csv files on disk qualify; pipes such as stdin do not,
+    and neither does a row range, which byte ranges know nothing of.
+    :param fileobj [File]: Open file object
+    :param parser [Parser]: File parser
+    :return [bool]: True if the file can be split
+    """
+    name = getattr(fileobj, 'name', None)
+
+    return isinstance(parser, CSVParser) \
+        and parser.start_row is None and parser.end_row is None \
+        and isinstance(name, str) \
+        and os.path.isfile(name)
+
+def _transitions(path, start, end, delimiter):
+    """
+    Scan a byte range of a file from each possible csv scan state, so the
+    ranges can be scanned in parallel and their states chained afterwards.
+    :param path [str]: File path
+    :param start [int]: First byte
+    :param end [int]: Byte after the last byte
+    :param delimiter [bytes]: Column delimiter
+    :return [tuple]: Scan state at end for each state at start
+    """
+    states = list(STATES)
+
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+
+        while remaining > 0:
+            block = f.read(min(BLOCK_SIZE, remaining))
+            if not block:
+                break
+            states = [helpers.record_ends(block, delimiter, x)[1]
+                if x >= helpers.QUOTED or helpers.QUOTE in block
+                else _last_state(block, delimiter) for x in states]
+            remaining -= len(block)
+
+    return tuple(states)
+
+def _last_state(block, delimiter):
+    """
+    Scan state at the end of a block without quotes, entered outside a
+    quoted field.
+    """
+    last = block[-1:]
+
+    if last == NEWLINE or last == delimiter:
+        return helpers.FIELD
+
+    return helpers.UNQUOTED
+
+def _record_end(f, offset, state, delimiter):
+    """
+    Find the first record boundary at or after an offset. A newline ends a
+    record only if it is not inside a quoted field, see
+    helpers.record_ends.
+    :param f [File]: File open in binary mode
+    :param offset [int]: Byte to start scanning from
+    :param state [int]: Scan state at offset
+    :param delimiter [bytes]: Column delimiter
+    :return [int]: Byte offset of the start of the next record
+    """
+    f.seek(offset)
+
+    while True:
+        block = f.read(BLOCK_SIZE)
+        if not block:
+            return offset
+
+        if state < helpers.QUOTED and helpers.QUOTE not in block:
+            newline = block.find(NEWLINE)
+            if newline != -1:
+                return offset + newline + 1
+            state = _last_state(block, delimiter)
+        else:
+            ends, state = helpers.record_ends(block, delimiter, state)
+            if ends:
+                return offset + ends[0]
+
+        offset += len(block)
+
+def _lines(path, start, end):
+    """
+    Yield the raw lines of a byte range that starts and ends on record
+    boundaries.
+    :param path [str]: File path
+    :param start [int]: First byte
+    :param end [int]: Byte after the last byte
+    :return [generator]: Lines as bytes
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+
+        for line in f:
+            yield line
+            start += len(line)
+            if start >= end:
+                break
+
+def _accumulate(task):
+    """
+    Pool worker. Aggregate the records in one byte range.
+    :param task [tuple]: path, encoding, start, end, delimiter, index,
+        variance, numeric_mode, batch_size
+    :return [list]: ColumnState of each tracked column
+    """
+    path, encoding, start, end, delimiter, index, variance, \
+        numeric_mode, batch_size = task
+
+    lines = codecs.iterdecode(_lines(path, start, end), encoding)
+    rows = csv.reader(lines, delimiter=delimiter)
+    states = aggregates.accumulate(rows, index, variance, numeric_mode,
+        batch_size)
+
+    # Converters are closures and cannot be sent back to the parent.
+    for state in states:
+        state.convert = None
+
+    return states
+
+def _transition(task):
+    """
+    Pool worker. Unpack a _transitions task.
+    """
+    return _transitions(*task)
+
+def header(fileobj, parser):
+    """
+    Read the header of a csv file on disk straight from its first record.
+    :param fileobj [File]: Open csv file
+    :param parser [CSVParser]: File parser
+    :return [tuple]: Header, byte offset of the first data record
+    """
+    encoding = getattr(fileobj, 'encoding', None) or 'utf-8'
+
+    with open(fileobj.name, 'rb') as f:
+        first = _record_end(f, 0, helpers.FIELD,
+            parser.delimiter.encode(encoding))
+        f.seek(0)
+        record = f.read(first).decode(encoding)
+
+    reader = csv.reader(io.StringIO(record), delimiter=parser.delimiter)
+    head = next(reader, [])
+
+    if parser.hasheader is True:
+        start = first
+    else:
+        head = parser._generic_header(len(head))
+        start = 0
+
+    parser.header = head
+
+    return head, start
+
+def accumulate(fileobj, parser, start, end, index, variance,
+  numeric_mode='decimal', batch_size=None, jobs=None):
+    """
+    Build the running state of each tracked column over a byte range of a
+    csv file on disk. The range must start on a record boundary; it is
+    split between `jobs` processes on record boundaries and the partial
+    states are merged.
+    :param fileobj [File]: Open csv file
+    :param parser [CSVParser]: File parser
+    :param start [int]: First byte
+    :param end [int]: Byte after the last byte
+    :param index [list]: Row index of each tracked column
+    :param variance [list]: Variance flag of each tracked column
+    :option numeric_mode [mixed]: See aggregates.accumulate
+    :option batch_size [int]: See aggregates.accumulate
+    :option jobs [int]: Number of worker processes. Default 1
+    :return [list]: ColumnState of each tracked column
+    """
+    path = fileobj.name
+    encoding = getattr(fileobj, 'encoding', None) or 'utf-8'
+    delimiter = parser.delimiter.encode(encoding)
+    task = lambda a, b: (path, encoding, a, b, parser.delimiter, index,
+        variance, numeric_mode, batch_size)
+
+    if jobs is None or jobs <= 1:
+        partials = [_accumulate(task(start, end))] if start < end else []
+    else:
+        chunks = max(jobs * CHUNKS_PER_JOB, 1)
+        step = max((end - start) // chunks, 1)
+        splits = list(range(start + step, end, step))[:chunks - 1]
+        edges = [start] + splits + [end]
+
+        # Imported here so single process runs do not pay for it at startup.
+        import multiprocessing
+
+        pool = multiprocessing.Pool(jobs)
+
+        try:
+            transitions = pool.map(_transition,
+                [(path, a, b, delimiter) for a, b in zip(edges, edges[1:])])
+
+            bounds = [start]
+            state = helpers.FIELD
+            with open(path, 'rb') as f:
+                for split, transition in zip(splits, transitions):
+                    state = transition[state]
+                    bound = _record_end(f, split, state, delimiter)
+                    bounds.append(min(max(bound, bounds[-1]), end))
+            bounds.append(end)
+
+            partials = pool.map(_accumulate,
+                [task(a, b) for a, b in zip(bounds, bounds[1:]) if a < b])
+        finally:
+            pool.close()
+            pool.join()
+
+    states = [aggregates.ColumnState(variance=x, convert=None)
+        for x in variance]
+    for partial in partials:
+        for state, other in zip(states, partial):
+            state.merge(other)
+
+    return states
+
+def aggregate(fileobj, pairs, parser, jobs, numeric_mode='decimal',
+  batch_size=None):
+    """
+    Compute aggregates over a csv file on disk using a pool of processes.
+    The file is split into byte ranges on record boundaries, each range is
+    aggregated separately and the partial states are merged.
+    :param fileobj [File]: Open csv file
+    :param pairs [list]: (column, aggregate) tuples
+    :param parser [CSVParser]: File parser
+    :param jobs [int]: Number of worker processes
+    :option numeric_mode [str]: One of helpers.NUMERIC_MODES, or auto
+    :option batch_size [int]: See aggregates.accumulate
+    :return [list]: (column, aggregate), result tuples
+    """
+    head, start = header(fileobj, parser)
+
+    pairs, columns, variance = aggregates.plan(head, pairs)
+    index = list(helpers.indexes(head, columns))
+
+    if numeric_mode == 'auto':
+        _, rows = parser.read(fileobj)
+        types, _ = parser.infer_schema(rows)
+        numeric_mode = aggregates.modes(columns, numeric_mode, types)
+        parser.header = head
+
+    states = accumulate(fileobj, parser, start, os.path.getsize(fileobj.name),
+        index, variance, numeric_mode, batch_size, jobs)
+
+    # Workers parse as they aggregate, so only the row count is reported;
+    # parse time is counted as transform time.
+    if parser.stats is not None:
+        parser.stats.track(fileobj)
+        parser.stats.rows_read += states[0].count if states else 0
+
+    return aggregates.results(pairs, columns, states)
@@ -1,19 +1,93 @@
 #
-# Dynamically load parsers from entry points. Ignore modules if
-# they have already been imported, or if they raise an exception.
-#
-# TODO: Determine which exceptions occur.
-# TODO: Raise warning on repeat import.
+# Lazily load parsers. Attribute access such as `parsers.csv` imports the
+# parser module on first use. Builtin parsers are resolved without reading
+# package metadata; any other name is looked up in the `csvutils.parsers`
+# entry point group.
 #
 
-import sys
-import pkg_resources
+from __future__ import absolute_import
+import importlib
+
+
+GROUP = 'csvutils.parsers'
+
+BUILTINS = {
+    'columnar': 'csvutils.parsers.builtins.columnar:ColumnarParser',
+    'csv': 'csvutils.parsers.builtins.csv:CSVParser',
+    'html': 'csvutils.parsers.builtins.html:HTMLParser',
+    'json': 'csvutils.parsers.builtins.json:JSONParser',
+    'table': 'csvutils.parsers.builtins.table:TableParser',
+    'xlsx_basic': 'csvutils.parsers.builtins.xlsx_basic:XLSXParser'}
+
+_loaded = {}
+_plugins = None
+
+
+def _entry_points():
+    """
+    Read the parser entry points of every installed distribution. This is
+    only done once, and only for names that are not builtin.
+    :return [dict]: Parser name to `module:attr` reference
+    """
+    global _plugins
+
+    if _plugins is None:
+        try:
+            from importlib import metadata
+        except ImportError:
+            import pkg_resources
+            eps = pkg_resources.iter_entry_points(GROUP)
+            _plugins = dict((x.name, '{}:{}'.format(x.module_name,
+                x.attrs[0])) for x in eps)
+        else:
+            eps = metadata.entry_points()
+            eps = eps.select(group=GROUP) if hasattr(eps, 'select') \
+                else eps.get(GROUP, [])
+            _plugins = dict((x.name, x.value) for x in eps)
+
+    return _plugins
+
+def available():
+    """
+    List the names of every parser, builtin or installed.
+    :return [list]: Sorted parser names
+    """
+    return sorted(set(BUILTINS) | set(_entry_points()))
+
+def load(name):
+    """
+    Import a parser class by name.
+    :param name [str]: Parser name, as given to -f/-t
+    :return [type]: Parser class
+    """
+    if name not in _loaded:
+        ref = BUILTINS.get(name) or _entry_points().get(name)
+        if ref is None:
+            raise UnknownParserError(name)
+
+        module, attr = ref.split(':')
+        _loaded[name] = getattr(importlib.import_module(module), attr)
+
+    return _loaded[name]
+
+def __getattr__(name):
+    """
+    Resolve `parsers.<name>` on first access.
+    """
+    if name.startswith('__'):
+        raise AttributeError(name)
+
+    try:
+        return load(name)
+    except UnknownParserError as e:
+        raise AttributeError(str(e))
+
 
+class UnknownParserError(LookupError):
+    MESSAGE = "Parser '{}' is not installed."
 
-for _ep in pkg_resources.iter_entry_points('csvutils.parsers'):
-    _mod = __import__(_ep.module_name, fromlist=_ep.attrs)
-    setattr(sys.modules[__name__], _ep.name, getattr(_mod, _ep.attrs[0]))
+    def __init__(self, name):
+        self.name = name
 
-# FIXME Better way to clean these up?
-del _ep
-del _mod
+    def __str__(self):
+        return self.MESSAGE.format(self.name)
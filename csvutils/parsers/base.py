@@ -2,8 +2,10 @@
 # base.py
 #
 
+from __future__ import absolute_import
+from .. import compression, multifile
 import argparse
-import sys
+import os
 
 
 class Parser(object):
@@ -16,8 +18,12 @@ class Parser(object):
     def __init__(self, *args, **kwargs):
         self.header = None
         self.rows = None
+        self.schema = None
+        # Default schema.SAMPLE, resolved when a schema is inferred.
+        self.schema_sample = kwargs.get('schema_sample')
         self.designation = kwargs.get('designation')
-        self._set_argparser_options()
+        self.stats = kwargs.get('stats')
+        self._argparsers = None
 
     def _generic_header(self, columns, prefix='col'):
         """
@@ -29,23 +35,70 @@ class Parser(object):
         """
         return ['{}{}'.format(prefix, x) for x in range(columns)]
 
+    def infer_schema(self, rows=None):
+        """
+        Infer the type of each column from the first schema_sample rows and
+        cache it on the parser, so readers, transforms and writers share
+        one guess. The sampled rows are put back in front of the rows.
+        :option rows [iter]: Rows to sample. Default self.rows
+        :return [tuple]: Schema dict of column name to type, rows
+        """
+        from .. import schema
+
+        rows = rows if rows is not None else self.rows
+
+        if self.schema is None:
+            sample = self.schema_sample if self.schema_sample is not None \
+                else schema.SAMPLE
+            self.schema, rows = schema.peek(self.header or [], rows, sample)
+
+        return self.schema, rows
+
+    @property
+    def _inparser(self):
+        """
+        ArgumentParser for input options, built on first use.
+        """
+        return self._get_argparser('inparser')
+
+    @property
+    def _outparser(self):
+        """
+        ArgumentParser for output options, built on first use.
+        """
+        return self._get_argparser('outparser')
+
+    def _get_argparser(self, designation):
+        """
+        Build the argument parsers the first time either is needed. Parsers
+        used only from Python never pay for building their options.
+        :param designation [str]: inparser or outparser
+        :return [ArgumentParser]: The argument parser
+        """
+        if self._argparsers is None:
+            self._argparsers = {}
+            self._set_argparser_options()
+
+        return self._argparsers[designation]
+
     def _set_argparser_options(self):
         """
         Creates an ArgumentParser with the parser's allowed arguments.
         """
-        self._inparser = argparse.ArgumentParser()
-        self._outparser = argparse.ArgumentParser()
+        self._argparsers['inparser'] = argparse.ArgumentParser()
+        self._argparsers['outparser'] = argparse.ArgumentParser()
 
-        self._inparser.add_argument('file', nargs='?',
-            type=argparse.FileType(self.READ_MODE),
-            default=sys.stdin,
-            help='Input file.')
+        self._inparser.add_argument('files', nargs='*',
+            metavar='file',
+            help='Input files or glob patterns, read as one table. ' \
+                'gzip, bz2 and xz files are decompressed. Default stdin.')
 
         self._outparser.add_argument('-o', '--outfile', nargs='?',
-            type=argparse.FileType(self.WRITE_MODE),
-            default=sys.stdout,
+            type=compression.FileType(self.WRITE_MODE),
+            default='-',
             dest='file',
-            help='Output file.')
+            help='Output file. Compressed with gzip, bz2 or xz when ' \
+                'its name ends in .gz, .bz2 or .xz.')
 
     def parse_args(self, options):
         """
@@ -63,6 +116,27 @@ class Parser(object):
         except AttributeError:
             raise NoParserDesignationError
 
+        if self.designation == 'inparser':
+            self._open_files()
+
+    def _open_files(self):
+        """
+        Expand glob patterns in the input files and open the first as
+        `file`, decompressing it if need be. The paths of all of them are
+        left in `files`.
+        """
+        try:
+            self.files = multifile.expand(self.files)
+            self.file = compression.FileType(self.READ_MODE)(
+                self.files[0] if self.files else '-')
+            for path in self.files[1:]:
+                if not os.path.isfile(path):
+                    raise argparse.ArgumentTypeError(
+                        "can't open '{}': not a file".format(path))
+        except (argparse.ArgumentTypeError,
+          multifile.NoMatchingFilesError) as e:
+            self._inparser.error(str(e))
+
     def read(self, *args, **kwargs):
         raise NotImplementedError
 
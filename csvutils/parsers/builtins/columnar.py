@@ -0,0 +1,428 @@
+#
+# columnar.py
+#
+
+from __future__ import absolute_import
+from ..base import Parser
+import array
+import itertools
+import json
+import math
+import mmap
+import os
+import re
+import stat
+import struct
+import sys
+
+
+class ColumnarParser(Parser):
+    """
+    Binary columnar format. Rows are stored in row groups; each column of
+    a group is a block of 64 bit integers, fixed point decimals (integers
+    and a scale) or doubles when every value in the block round trips
+    exactly through that type, and dictionary encoded or plain UTF-8
+    strings otherwise. A JSON footer holds the header, the inferred schema
+    and the offset of every block, so a reader only touches the blocks of
+    the columns it needs.
+
+    Layout: MAGIC, 8 byte aligned blocks, footer, footer size (<Q), MAGIC.
+    """
+    READ_MODE = 'rb'
+    WRITE_MODE = 'wb'
+
+    MAGIC = b'CSVCOL01'
+    VERSION = 1
+    GROUP_ROWS = 1 << 16
+    ALIGN = 8
+
+    FOOTER = struct.Struct('<Q')
+
+    # Fixed point values and doubles must stay exact.
+    SCALED = re.compile(r'-?(0|[1-9]\d*)\.(\d+)$')
+    INT_LIMIT = 1 << 63
+    EXACT_LIMIT = 1 << 53
+    MAX_SCALE = 18
+
+    def __init__(self, *args, **kwargs):
+        """
+        :option group_rows [int]: Rows per row group when writing
+        """
+        super(ColumnarParser, self).__init__(*args, **kwargs)
+
+        self.group_rows = kwargs.get('group_rows', self.GROUP_ROWS)
+
+    def _set_argparser_options(self):
+        """
+        Creates an ArgumentParser with the parser's allowed arguments.
+        """
+        super(ColumnarParser, self)._set_argparser_options()
+
+        self._outparser.add_argument('--outfile-group-rows',
+            type=int,
+            default=self.GROUP_ROWS,
+            dest='group_rows',
+            help='Rows per row group. Larger groups read faster and take ' \
+                'more memory. Default {}.'.format(self.GROUP_ROWS))
+
+    def _load(self, fileobj):
+        """
+        Map or read a columnar file and parse its footer.
+        :param fileobj [File]: File object open in binary mode
+        :return [tuple]: Buffer, footer dict
+        """
+        buf = None
+
+        try:
+            info = os.fstat(fileobj.fileno())
+            if stat.S_ISREG(info.st_mode) and info.st_size:
+                buf = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, IOError, OSError, ValueError):
+            pass
+
+        if buf is None:
+            buf = fileobj.read()
+
+        tail = len(self.MAGIC) + self.FOOTER.size
+
+        if len(buf) < len(self.MAGIC) + tail or \
+          buf[:len(self.MAGIC)] != self.MAGIC or \
+          buf[-len(self.MAGIC):] != self.MAGIC:
+            raise InvalidColumnarFileError()
+
+        size, = self.FOOTER.unpack_from(buf, len(buf) - tail)
+        footer = json.loads(bytes(buf[len(buf) - tail - size:
+            len(buf) - tail]).decode('utf-8'))
+
+        if footer.get('version') != self.VERSION:
+            raise InvalidColumnarFileError()
+
+        return buf, footer
+
+    def _blocks(self, fileobj, columns=None, text=False):
+        """
+        Read the blocks of some columns, group by group.
+        :param fileobj [File]: File object open in binary mode
+        :option columns [list]: Only read these columns. Default all
+        :option text [bool]: Decode every block to strings
+        :return [tuple]: Header, generator of (rows, blocks) tuples where
+            each block is a (kind, values, scale) tuple
+        """
+        buf, footer = self._load(fileobj)
+        head = footer['header']
+
+        if columns:
+            wanted = set(columns)
+            missing = [x for x in columns if x not in head]
+            if missing:
+                raise ValueError('{!r} is not in list'.format(missing[0]))
+            index = [i for i, x in enumerate(head) if x in wanted]
+        else:
+            index = list(range(len(head)))
+
+        self.schema = footer.get('schema')
+        view = memoryview(buf)
+
+        # The map is closed once the last view of it is gone.
+        groups = ((x['rows'], [_decode(view, x['columns'][i], text)
+            for i in index]) for x in footer['groups'])
+
+        return [head[i] for i in index], groups
+
+    def read_blocks(self, fileobj, columns=None):
+        """
+        Read a columnar file block by block, for aggregating a column at a
+        time (see aggregates.accumulate_blocks). Numeric blocks are typed
+        memoryviews of the file, so the rows of each block must be used
+        before the next one is read.
+        :param fileobj [File]: File object open in binary mode
+        :option columns [list]: Only read these columns. Default all
+        :return [tuple]: Header, generator of (rows, blocks) tuples
+        """
+        head, groups = self._blocks(fileobj, columns)
+        self.header = head
+
+        return head, groups
+
+    def read(self, fileobj, columns=None):
+        """
+        Open a columnar file and read it. Only the blocks of the requested
+        columns are decoded. Cells are the strings they were written as.
+        :param fileobj [File]: File object open in binary mode
+        :option columns [list]: Only read these columns. The header and
+            rows keep the file's column order. Default all
+        :return [tuple]: header, rows tuple
+        """
+        head, groups = self._blocks(fileobj, columns, text=True)
+
+        rows = (list(x) for _, blocks in groups
+            for x in zip(*[y[1] for y in blocks]))
+
+        self.header = head
+        self.rows = rows
+
+        return head, rows
+
+    def write(self, fileobj):
+        """
+        Write the rows to an open binary file handle one row group at a
+        time. The schema is inferred from the first rows and stored in the
+        footer.
+        :param fileobj [File]: File object to write to
+        """
+        header = list(self.header or [])
+        width = len(header)
+        types, rows = self.infer_schema(self.rows)
+        rows = iter(rows)
+
+        out = _Output(fileobj, self.ALIGN)
+        out.write(self.MAGIC)
+        groups = []
+
+        while True:
+            batch = list(itertools.islice(rows, self.group_rows))
+            if not batch:
+                break
+
+            cells = [[] for _ in range(width)]
+            for row in batch:
+                row = list(row[:width]) + [''] * (width - len(row))
+                for col, cell in zip(cells, row):
+                    col.append(_text(cell))
+
+            groups.append({
+                'rows': len(batch),
+                'columns': [self._encode(out, x) for x in cells]})
+
+        footer = json.dumps({
+            'version': self.VERSION,
+            'header': header,
+            'schema': dict((x, types.get(x)) for x in header),
+            'groups': groups}).encode('utf-8')
+
+        out.write(footer, align=False)
+        out.write(self.FOOTER.pack(len(footer)), align=False)
+        out.write(self.MAGIC, align=False)
+
+    def _encode(self, out, cells):
+        """
+        Write one column of a row group in the smallest exact encoding.
+        :param out [_Output]: Output
+        :param cells [list]: Cells as strings
+        :return [dict]: Block description for the footer
+        """
+        if cells and '' not in cells:
+            for kind in ('int', 'scaled', 'float'):
+                encoded = getattr(self, '_as_' + kind)(cells)
+                if encoded is not None:
+                    scale, values = encoded
+                    block = {'kind': kind, 'buffers': [out.array(values)]}
+                    if kind == 'scaled':
+                        block['scale'] = scale
+                    return block
+
+        words = sorted(set(cells))
+
+        if len(words) <= len(cells) // 2:
+            lookup = dict((x, i) for i, x in enumerate(words))
+            typecode = 'B' if len(words) <= 0xff else \
+                'H' if len(words) <= 0xffff else 'I'
+            codes = array.array(typecode, [lookup[x] for x in cells])
+
+            block = _strings(out, words)
+            block.update(kind='dict', typecode=typecode)
+            block['buffers'].insert(0, out.array(codes))
+
+            return block
+
+        block = _strings(out, cells)
+        block['kind'] = 'text'
+
+        return block
+
+    def _as_int(self, cells):
+        """
+        :return [tuple]: None, array of the cells as integers; or None
+        """
+        try:
+            values = [int(x) for x in cells]
+        except ValueError:
+            return None
+
+        for cell, value in zip(cells, values):
+            if not -self.INT_LIMIT <= value < self.INT_LIMIT or \
+              str(value) != cell:
+                return None
+
+        return None, array.array('q', values)
+
+    def _as_scaled(self, cells):
+        """
+        :return [tuple]: Scale, array of the cells times 10**scale; or None
+        """
+        match = self.SCALED.match(cells[0])
+        if match is None:
+            return None
+
+        scale = len(match.group(2))
+        if scale > self.MAX_SCALE:
+            return None
+
+        values = []
+        for cell in cells:
+            match = self.SCALED.match(cell)
+            if match is None or len(match.group(2)) != scale:
+                return None
+            value = int(cell.replace('.', '', 1))
+            if not -self.EXACT_LIMIT < value < self.EXACT_LIMIT or \
+              _unscale(value, scale) != cell:
+                return None
+            values.append(value)
+
+        return scale, array.array('q', values)
+
+    def _as_float(self, cells):
+        """
+        :return [tuple]: None, array of the cells as doubles; or None
+        """
+        try:
+            values = [float(x) for x in cells]
+        except ValueError:
+            return None
+
+        for cell, value in zip(cells, values):
+            if math.isinf(value) or math.isnan(value) or repr(value) != cell:
+                return None
+
+        return None, array.array('d', values)
+
+
+class _Output(object):
+    """
+    Count the bytes written to a file, padding blocks to an alignment.
+    """
+
+    def __init__(self, fileobj, align):
+        self.fileobj = fileobj
+        self.align = align
+        self.offset = 0
+
+    def write(self, data, align=True):
+        """
+        :return [list]: Offset and size of the data
+        """
+        pad = -self.offset % self.align if align else 0
+        if pad:
+            self.fileobj.write(b'\0' * pad)
+            self.offset += pad
+
+        start = self.offset
+        self.fileobj.write(data)
+        self.offset += len(data)
+
+        return [start, len(data)]
+
+    def array(self, values):
+        """
+        Write an array in little endian byte order.
+        """
+        if sys.byteorder != 'little':
+            values = array.array(values.typecode, values)
+            values.byteswap()
+
+        return self.write(values.tobytes())
+
+
+def _strings(out, words):
+    """
+    Write strings as end offsets followed by their UTF-8 bytes.
+    :return [dict]: Block description holding the two buffers and the
+        typecode of the offsets
+    """
+    data = [x.encode('utf-8') for x in words]
+    ends = list(itertools.accumulate(len(x) for x in data))
+    typecode = 'I' if not ends or ends[-1] <= 0xffffffff else 'Q'
+
+    return {'ends': typecode, 'buffers': [
+        out.array(array.array(typecode, ends)), out.write(b''.join(data))]}
+
+def _decode(view, block, text=False):
+    """
+    Decode one block.
+    :param view [memoryview]: The whole file
+    :param block [dict]: Block description from the footer
+    :option text [bool]: Decode numbers to the strings they were written as
+    :return [tuple]: Kind, values, scale
+    """
+    kind = block['kind']
+    buffers = [view[x:x + n] for x, n in block['buffers']]
+    scale = block.get('scale', 0)
+
+    if kind in ('int', 'scaled', 'float'):
+        values = _typed(buffers[0], 'd' if kind == 'float' else 'q')
+        if text is True:
+            values = [str(x) for x in values] if kind == 'int' else \
+                [_unscale(x, scale) for x in values] if kind == 'scaled' \
+                else [repr(x) for x in values]
+    elif kind == 'dict':
+        words = _words(buffers[1], buffers[2], block['ends'])
+        values = [words[x] for x in _typed(buffers[0], block['typecode'])]
+    else:
+        values = _words(buffers[0], buffers[1], block['ends'])
+
+    if kind in ('dict', 'text') or text is True:
+        kind = 'text'
+
+    return kind, values, scale
+
+def _typed(buf, typecode):
+    """
+    View a buffer as numbers without copying it where the byte order
+    allows.
+    """
+    if sys.byteorder == 'little':
+        return buf.cast(typecode)
+
+    values = array.array(typecode, buf.tobytes())
+    values.byteswap()
+
+    return values
+
+def _words(ends, data, typecode):
+    """
+    Decode strings stored by _strings.
+    """
+    ends = _typed(ends, typecode)
+    data = bytes(data)
+    start = 0
+    words = []
+
+    for end in ends:
+        words.append(data[start:end].decode('utf-8'))
+        start = end
+
+    return words
+
+def _unscale(value, scale):
+    """
+    Format a fixed point value, e.g. 238 and 3 as 0.238.
+    """
+    digits = str(abs(value)).rjust(scale + 1, '0')
+
+    return '{}{}.{}'.format('-' if value < 0 else '', digits[:-scale],
+        digits[-scale:])
+
+def _text(cell):
+    """
+    Cells are stored as the strings other parsers write.
+    """
+    if cell is None:
+        return ''
+
+    return cell if isinstance(cell, str) else str(cell)
+
+
+class InvalidColumnarFileError(Exception):
+
+    def __str__(self):
+        return 'File is not a csvutils columnar file or is damaged.'
@@ -4,10 +4,17 @@
 
 from __future__ import absolute_import
 from ..base import Parser
+from ... import helpers
+import collections
 import csv
+import itertools
+import mmap
+import os
+import stat
 
 
 class CSVParser(Parser):
+    QUOTE = b'"'
 
     def __init__(self, *args, **kwargs):
         """
@@ -15,6 +22,11 @@ class CSVParser(Parser):
         :option hasheader [bool]: Use first row in csv file as header row
         :option lineterminator [str]: Row delimiter
         :option quoting [int]: Quoting level
+        :option use_mmap [bool]: Memory-map regular files when reading
+        :option start_row [int]: First data row to read, zero based.
+            Negative values count from the end of the file
+        :option end_row [int]: Last data row to read, inclusive
+        :option use_index [bool]: Seek with a sidecar index when present
         """
         super(CSVParser, self).__init__(*args, **kwargs)
 
@@ -22,6 +34,162 @@ class CSVParser(Parser):
         self.hasheader = kwargs.get('hasheader', True)
         self.lineterminator = kwargs.get('lineterminator', '\n')
         self.quoting = kwargs.get('quoting', csv.QUOTE_MINIMAL)
+        self.use_mmap = kwargs.get('use_mmap', True)
+        self.start_row = kwargs.get('start_row')
+        self.end_row = kwargs.get('end_row')
+        self.use_index = kwargs.get('use_index', True)
+
+    def _mappable(self, fileobj):
+        """
+        Check whether a file can be read through a memory map: a regular,
+        non-empty file that has not been read from yet, in an encoding
+        where the delimiter and newline are single ASCII bytes.
+        :param fileobj [File]: Open file object
+        :return [str]: The file encoding, or None if it cannot be mapped
+        """
+        if self.use_mmap is not True:
+            return None
+
+        try:
+            info = os.fstat(fileobj.fileno())
+            if not stat.S_ISREG(info.st_mode) or info.st_size == 0 \
+              or fileobj.tell() != 0:
+                return None
+        except (AttributeError, IOError, OSError, ValueError):
+            return None
+
+        encoding = getattr(fileobj, 'encoding', None) or 'utf-8'
+
+        try:
+            if self.delimiter.encode(encoding) != self.delimiter.encode('ascii') \
+              or '\n'.encode(encoding) != b'\n':
+                return None
+        except (LookupError, UnicodeError):
+            return None
+
+        return encoding
+
+    def _decode(self, record, encoding, index=None):
+        """
+        Decode one raw record into a row. Records without quotes are split
+        as bytes and only the cells at index are decoded; anything quoted
+        is handed to the csv module.
+        :param record [bytes]: Raw record, including its line terminator
+        :param encoding [str]: File encoding
+        :option index [list]: Cells to keep, default all
+        :return [list]: Row
+        """
+        if self.QUOTE in record:
+            text = record.decode(encoding)
+            row = next(csv.reader([text], delimiter=self.delimiter), [])
+            if index is not None:
+                row = [row[i] for i in index if i < len(row)]
+        else:
+            record = record.rstrip(b'\r\n')
+            if not record:
+                row = []
+            elif index is None:
+                row = record.decode(encoding).split(self.delimiter)
+            else:
+                cells = record.split(self.delimiter.encode(encoding))
+                if index and len(cells) <= index[-1]:
+                    # A short row keeps the cells it has.
+                    index = [i for i in index if i < len(cells)]
+                row = [cells[i].decode(encoding) for i in index]
+
+        return row
+
+    def _mmap_records(self, fileobj, offset=0):
+        """
+        Yield raw records straight from a memory map of the file. A record
+        continues onto the next line while a quoted field is open, i.e.
+        while a quoted field contains a newline; a quote anywhere but at
+        the start of a field is an ordinary character.
+        :param fileobj [File]: Open regular file object
+        :option offset [int]: Byte offset of the first record to read
+        :return [generator]: Records as bytes
+        """
+        quote = self.QUOTE
+        delimiter = self.delimiter.encode('ascii')
+        buf = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            buf.seek(offset)
+            readline = buf.readline
+            line = readline()
+
+            while line:
+                if quote in line:
+                    ends, state = helpers.record_ends(line, delimiter)
+                    while not ends:
+                        more = readline()
+                        if not more:
+                            break
+                        ends, state = helpers.record_ends(more, delimiter,
+                            state)
+                        line += more
+
+                yield line
+                line = readline()
+        finally:
+            buf.close()
+
+    def _locate(self, fileobj):
+        """
+        Use the sidecar index of a file to find the first row of the
+        requested range without scanning the rows before it.
+        :param fileobj [File]: Open regular file object
+        :return [tuple]: Byte offset to read from, records to skip there,
+            resolved start_row; or None without a usable index
+        """
+        if self.use_index is not True or \
+          (not self.start_row and self.end_row is None):
+            return None
+
+        from ... import sidecar
+
+        name = getattr(fileobj, 'name', None)
+        # Reading never writes; csvindex updates the index on disk.
+        index = sidecar.load(name, update=False, delimiter=self.delimiter) \
+            if isinstance(name, str) else None
+        if index is None:
+            return None
+
+        header = 1 if self.hasheader is True else 0
+        start = self.start_row or 0
+        if start < 0:
+            start = max(index.count - header + start, 0)
+
+        offset, skip = index.locate(start + header)
+
+        return offset, skip, start
+
+    def _slice(self, rows, start=None):
+        """
+        Limit rows to start_row through end_row.
+        :param rows [iter]: Rows
+        :option start [int]: Index of the first row in rows, when they no
+            longer start at the top of the file
+        :return [iter]: Rows in range
+        """
+        first = start if start is not None else self.start_row or 0
+        skip = 0 if start is not None else first
+
+        if first < 0:
+            # Without an index the whole file is read to find its end.
+            tail = collections.deque(enumerate(rows), maxlen=-first)
+            return (row for i, row in tail
+                if self.end_row is None or i <= self.end_row)
+
+        stop = self.end_row + 1 - first if self.end_row is not None else None
+        if stop is not None and stop < 0:
+            stop = 0
+
+        if skip or stop is not None:
+            rows = itertools.islice(rows, skip,
+                skip + stop if stop is not None else None)
+
+        return rows
 
     def _set_argparser_options(self):
         """
@@ -45,7 +213,28 @@ class CSVParser(Parser):
             default='\n',
             dest='lineterminator',
             help='Input file line terminator. Default newline character.')
+        self._inparser.add_argument('--infile-no-mmap',
+            action='store_false',
+            dest='use_mmap',
+            help='A flag to indicate the input file should be read as a ' \
+                'stream rather than memory-mapped. Only regular files are ' \
+                'ever mapped.')
+        self._inparser.add_argument('--infile-start-row',
+            type=int,
+            dest='start_row',
+            help='First data row to read, zero based. Negative values ' \
+                'count back from the end of the file.')
+        self._inparser.add_argument('--infile-end-row',
+            type=int,
+            dest='end_row',
+            help='Last data row to read, inclusive.')
+        self._inparser.add_argument('--infile-no-index',
+            action='store_false',
+            dest='use_index',
+            help='A flag to indicate a sidecar index written by csvindex ' \
+                'should not be used to seek to --infile-start-row.')
         self._inparser.add_argument('--infile-quoting',
+            type=int,
             nargs='?',
             default=csv.QUOTE_MINIMAL,
             dest='quoting',
@@ -74,6 +263,7 @@ class CSVParser(Parser):
             dest='lineterminator',
             help='Output file line terminator. Default newline character.')
         self._outparser.add_argument('--outfile-quoting',
+            type=int,
             nargs='?',
             default=csv.QUOTE_MINIMAL,
             dest='quoting',
@@ -85,18 +275,60 @@ class CSVParser(Parser):
                 'Other options are: 1 - QUOTE_ALL 2 - QUOTE_NONNUMERIC\n' \
                 '3 - QUOTE_NONE')
 
-    def read(self, fileobj):
+    def read(self, fileobj, columns=None):
         """
-        Open a csv file and read it.
+        Open a csv file and read it. Rows are read lazily, so the file
+        must stay open until they have been consumed.
         :param fileobj [File]: Open file object
+        :option columns [list]: Only read these columns. The header and
+            rows keep the file's column order. Default all
         :return [tuple]: header, rows tuple
         """
-        reader = csv.reader(fileobj, delimiter=self.delimiter)
-        head = next(reader) if self.hasheader is True else None
-        rows = list(reader)
-    
+        encoding = self._mappable(fileobj)
+
+        if encoding is not None:
+            records = self._mmap_records(fileobj)
+            reader = (self._decode(x, encoding) for x in records)
+        else:
+            records = None
+            reader = csv.reader(fileobj, delimiter=self.delimiter)
+
+        head = next(reader, []) if self.hasheader is True else None
+        first = []
+
         if head is None:
-            head = self._generic_header(len(rows[0]))
+            # Peek at the first row to size the generic header; it is put
+            # back in front of the rows below.
+            first = next(reader, [])
+            head = self._generic_header(len(first))
+
+        located = self._locate(fileobj) if records is not None else None
+
+        if located is not None:
+            # Carry on from the indexed record instead of the top.
+            offset, skip, start = located
+            records = itertools.islice(self._mmap_records(fileobj, offset),
+                skip, None)
+            reader = (self._decode(x, encoding) for x in records)
+            first = []
+
+        if columns:
+            index = sorted(set(helpers.indexes(head, columns)))
+            project = helpers.projection(index)
+            head = list(project(head))
+            first = list(project(first)) if first else first
+
+            if records is not None:
+                rows = (self._decode(x, encoding, index) for x in records)
+            else:
+                rows = map(project, reader)
+        else:
+            rows = reader
+
+        rows = itertools.chain([first], rows) if first else rows
+
+        if self.start_row is not None or self.end_row is not None:
+            rows = self._slice(rows, located[2] if located else None)
 
         self.header = head
         self.rows = rows
@@ -105,9 +337,27 @@ class CSVParser(Parser):
 
     def write(self, fileobj):
         """
-        Dump a csv to an open file handle
+        Dump a csv to an open file handle. With QUOTE_NONNUMERIC, columns
+        the schema infers as numbers are converted so they are written
+        unquoted.
         :param fileobj [File]: File object to write to
         """
+        rows = self.rows
+
+        if self.quoting == csv.QUOTE_NONNUMERIC and self.header is not None:
+            from ... import schema
+
+            types, rows = self.infer_schema(rows)
+            kinds = [types.get(x) for x in self.header]
+            convs = [schema.converter(x) if x in schema.NUMERIC else None
+                for x in kinds]
+
+            if any(convs):
+                width = len(convs)
+                rows = ([f(x) if f is not None else x
+                    for f, x in zip(convs, row)] + list(row[width:])
+                    for row in rows)
+
         try:
             writer = csv.writer(fileobj,
                 delimiter=self.delimiter,
@@ -117,7 +367,7 @@ class CSVParser(Parser):
             if self.header is not None and self.hasheader is not False:
                 writer.writerow(self.header)
 
-            writer.writerows(self.rows)
+            writer.writerows(rows)
 
         except IOError:
             fileobj.close()
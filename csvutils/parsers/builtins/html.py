@@ -4,19 +4,26 @@
 
 from __future__ import absolute_import
 from ..base import Parser
+import itertools
+import os
 
 
 class HTMLParser(Parser):
-    TEMPLATE = '<table>\n{}{}\n</table>\n'
+    TABLE_OPEN = '<table>\n'
+    TABLE_CLOSE = '\n</table>\n'
     TAB_WIDTH = 4
+    WRITE_BUFFER_ROWS = 1000
 
     def __init__(self, *args, **kwargs):
         """
         :option pretty [bool]: Make HTML human-readable
+        :option page_rows [int]: Split the output into tables of this many
+            rows each
         """
         super(HTMLParser, self).__init__(*args, **kwargs)
 
         self.pretty = kwargs.get('pretty', getattr(self, 'pretty', False))
+        self.page_rows = kwargs.get('page_rows', getattr(self, 'page_rows', None))
 
     def _htmlrow(self, row, header=False, tabs=False):
         """
@@ -48,13 +55,76 @@ class HTMLParser(Parser):
             action='store_true',
             dest='pretty',
             help='A flag to indicate the output should be human-readable.')
+        self._outparser.add_argument('--outfile-page-rows',
+            type=int,
+            dest='page_rows',
+            help='Split the output into tables of this many rows, each ' \
+                'with the header. When writing to a file, page N is ' \
+                'written next to it as NAME-N.EXT; otherwise the tables ' \
+                'follow each other in the output.')
 
-    def write(self, fileobj):
+    def _page_file(self, fileobj, page):
+        """
+        Open the file for a page of output. The first page, and every page
+        when the output has no file name, goes to fileobj itself.
+        :param fileobj [File]: File object being written to
+        :param page [int]: One based page number
+        :return [tuple]: File object, and whether it must be closed
         """
-        Dump a html table to an open file handle
+        name = getattr(fileobj, 'name', None)
+
+        if page == 1 or not isinstance(name, str) or not os.path.isfile(name):
+            return fileobj, False
+
+        base, ext = os.path.splitext(name)
+        return open('{}-{}{}'.format(base, page, ext), self.WRITE_MODE), True
+
+    def _write_table(self, fileobj, rows):
+        """
+        Write one table, streaming rows out in buffered chunks.
         :param fileobj [File]: File object to write to
+        :param rows [iter]: Table rows
         """
         h = self._htmlrow(self.header, header=True, tabs=self.pretty) + '\n' if self.header else ''
-        r = (self._htmlrow(x, tabs=self.pretty) for x in self.rows)
+        fileobj.write(self.TABLE_OPEN + h)
+
+        sep = ''
+        buf = []
+        for row in rows:
+            buf.append(sep + self._htmlrow(row, tabs=self.pretty))
+            sep = '\n'
+
+            if len(buf) >= self.WRITE_BUFFER_ROWS:
+                fileobj.write(''.join(buf))
+                buf = []
+
+        buf.append(self.TABLE_CLOSE)
+        fileobj.write(''.join(buf))
+
+    def write(self, fileobj):
+        """
+        Dump a html table to an open file handle, one chunk of rows at a
+        time. With page_rows set, the rows are split over several tables.
+        :param fileobj [File]: File object to write to
+        """
+        rows = iter(self.rows)
+
+        if not self.page_rows:
+            self._write_table(fileobj, rows)
+            return
+
+        page = 1
+        chunk = list(itertools.islice(rows, self.page_rows))
+
+        # Always write at least one, possibly empty, table.
+        while chunk or page == 1:
+            out, close = self._page_file(fileobj, page)
+
+            try:
+                self._write_table(out, chunk)
+            finally:
+                if close is True:
+                    out.close()
 
-        fileobj.write(self.TEMPLATE.format(h, '\n'.join(r)))
+            page += 1
+            chunk = list(itertools.islice(rows, self.page_rows))
@@ -4,32 +4,49 @@
 
 from __future__ import absolute_import
 from ..base import Parser
+from ... import helpers, schema
+import decimal
+import itertools
 import json
 
 
 class JSONParser(Parser):
     TAB_WIDTH = 4
+    READ_SIZE = 1 << 16
 
     def __init__(self, *args, **kwargs):
         """
         :option pretty [bool]: Make JSON human-readable
+        :option indent [int]: Indent width when pretty
+        :option ndjson [bool]: One JSON object per line instead of an array
+        :option hasheader [bool]: Use the first array row as header row
+        :option infer_types [bool]: Write numeric columns as JSON numbers
         """
         super(JSONParser, self).__init__(*args, **kwargs)
 
         self.pretty = kwargs.get('pretty', False)
         self.indent = kwargs.get('indent', self.TAB_WIDTH)
+        self.ndjson = kwargs.get('ndjson', False)
+        self.hasheader = kwargs.get('hasheader', True)
+        self.infer_types = kwargs.get('infer_types', False)
 
-    def _set_argparse_options(self):
+    def _set_argparser_options(self):
         """
         Creates an ArgumentParser with the parser's allowed arguments.
         """
         super(JSONParser, self)._set_argparser_options()
 
+        self._inparser.add_argument('--infile-no-header',
+            action='store_false',
+            dest='hasheader',
+            help='A flag to indicate the first row of an array of arrays ' \
+                'is not the header row. If set, a generic header will be ' \
+                'assigned. Objects always use their keys as the header.')
+
         self._outparser.add_argument('-P', '--outfile-pretty',
             action='store_true',
             dest='pretty',
             help='A flag to indicate the output should be human-readable.')
-        # XXX Does not work
         self._outparser.add_argument('-i', '--outfile-indent',
             type=int,
             nargs='?',
@@ -37,13 +54,173 @@ class JSONParser(Parser):
             dest='indent',
             help='The width of an indent. Only valid when the ' \
                 'outfile-pretty flag is also used. Default 4 spaces.')
+        self._outparser.add_argument('--outfile-ndjson',
+            action='store_true',
+            dest='ndjson',
+            help='A flag to indicate the output should be newline ' \
+                'delimited JSON, one object per line.')
+        self._outparser.add_argument('--outfile-infer-types',
+            action='store_true',
+            dest='infer_types',
+            help='A flag to indicate columns whose sampled values are all ' \
+                'numbers should be written as JSON numbers instead of ' \
+                'strings.')
+
+    def _iter_array(self, fileobj, buf):
+        """
+        Incrementally decode the elements of a top-level JSON array,
+        reading the file in fixed-size pieces.
+        :param fileobj [File]: Open file object
+        :param buf [str]: Text already read, starting after the `[`
+        :return [generator]: Decoded elements
+        """
+        decoder = json.JSONDecoder()
+        pos = 0
+        eof = False
+
+        while True:
+            # Skip whitespace and the separator before the next element.
+            while True:
+                while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                    pos += 1
+                if pos < len(buf) or eof:
+                    break
+                buf, pos = fileobj.read(self.READ_SIZE), 0
+                eof = not buf
+
+            if pos >= len(buf) or buf[pos] == ']':
+                return
+
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                # The element is cut off at the end of the buffer.
+                more = fileobj.read(self.READ_SIZE) if not eof else ''
+                if not more:
+                    raise
+                buf, pos = buf[pos:] + more, 0
+                continue
+
+            yield obj
+            pos = end
+
+    def _iter_lines(self, fileobj, buf):
+        """
+        Decode newline delimited JSON, one element per line.
+        :param fileobj [File]: Open file object
+        :param buf [str]: Text already read from the start of the file
+        :return [generator]: Decoded elements
+        """
+        lines = itertools.chain([buf + fileobj.readline()], fileobj)
+
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+
+    def read(self, fileobj, columns=None):
+        """
+        Open a json file and read it. Both a top-level array and newline
+        delimited JSON are read incrementally, so the file must stay open
+        until the rows have been consumed. Elements may be objects, whose
+        keys in the first object form the header, or arrays.
+        :param fileobj [File]: Open file object
+        :option columns [list]: Only read these columns. Default all
+        :return [tuple]: header, rows tuple
+        """
+        buf = fileobj.read(1)
+        while buf.isspace():
+            buf = fileobj.read(1)
+
+        if buf == '[':
+            elements = self._iter_array(fileobj, '')
+        else:
+            elements = self._iter_lines(fileobj, buf)
+
+        first = next(elements, None)
+
+        if isinstance(first, dict):
+            head = list(first)
+            elements = itertools.chain([first], elements)
+            if columns:
+                keep = set(columns)
+                head = [x for x in head if x in keep]
+            rows = ([x.get(k) for k in head] for x in elements)
+
+        else:
+            if first is None:
+                head = []
+            elif self.hasheader is True:
+                head = first
+            else:
+                head = self._generic_header(len(first))
+                elements = itertools.chain([first], elements)
+
+            rows = (list(x) for x in elements)
+            if columns:
+                index = sorted(set(helpers.indexes(head, columns)))
+                project = helpers.projection(index)
+                head = [head[x] for x in index]
+                rows = (list(project(x)) for x in rows)
+
+        self.header = head
+        self.rows = rows
+
+        return head, rows
 
     def write(self, fileobj):
         """
-        Dump a json object to an open file handle
+        Dump a json array, or newline delimited json, to an open file
+        handle one row at a time.
         :param fileobj [File]: File object to write to
         """
         indent = self.indent if self.pretty else None
-        obj = [{k: v for k, v in zip(self.header, row)} for row in self.rows]
+        rows = self.rows
+
+        if self.infer_types is True:
+            types, rows = self.infer_schema(rows)
+            convs = [schema.converter(types.get(x))
+                if types.get(x) in schema.NUMERIC else None
+                for x in self.header]
+            rows = ([f(x) if f is not None else x
+                for f, x in zip(convs, row)] for row in rows)
+
+        objs = ({k: v for k, v in zip(self.header, row)} for row in rows)
+        dumps = lambda obj, **kw: json.dumps(obj, sort_keys=self.pretty,
+            default=_number, **kw)
+
+        if self.ndjson is True:
+            for obj in objs:
+                fileobj.write(dumps(obj))
+                fileobj.write('\n')
+            return
+
+        if indent is None:
+            sep, pad, close = ', ', '', ']'
+        else:
+            sep, pad, close = ',\n', ' ' * indent, '\n]'
+
+        fileobj.write('[')
+        empty = True
+
+        for obj in objs:
+            text = dumps(obj, indent=indent)
+            if pad:
+                text = '\n'.join(pad + x for x in text.split('\n'))
+
+            fileobj.write(('\n' if pad else '') if empty else sep)
+            fileobj.write(text)
+            empty = False
+
+        fileobj.write(']' if empty else close)
+
+
+def _number(value):
+    """
+    json.dumps fallback for values it can not serialise natively.
+    :param value [mixed]: Value to serialise
+    :return [mixed]: JSON serialisable value
+    """
+    if isinstance(value, decimal.Decimal):
+        return float(value)
 
-        json.dump(obj, fileobj, indent=indent, sort_keys=self.pretty)
+    raise TypeError('{!r} is not JSON serializable'.format(value))
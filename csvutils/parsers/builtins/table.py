@@ -61,12 +61,16 @@ class TableParser(Parser):
         Dump table to an open file handle
         :param fileobj [File]: File object to write to
         """
+        # Readers such as xlsx yield numbers and None for empty cells.
+        text = lambda row: self.delimiter.join(
+            '' if x is None else str(x) for x in row)
+
         try:
             if self.hasheader is True and self.header is not None:
-                fileobj.write(self.delimiter.join(self.header) + self.lineterminator)
+                fileobj.write(text(self.header) + self.lineterminator)
 
             for row in self.rows:
-                fileobj.write(self.delimiter.join(row) + self.lineterminator)
+                fileobj.write(text(row) + self.lineterminator)
 
         except IOError:
             fileobj.close()
@@ -4,10 +4,18 @@
 
 from __future__ import absolute_import
 from ..base import Parser
+from ... import helpers, schema
 import datetime
+import decimal
 import functools
+import itertools
+import math
+import os
+import re
+import stat
 import zipfile
 import xml.etree.ElementTree as ElementTree
+from xml.sax.saxutils import escape, quoteattr
 
 
 def nstag(ns, tag):
@@ -25,7 +33,40 @@ class XLSXParser(Parser):
     WORKBOOK = 'xl/workbook.xml'
     WORKSHEET = 'xl/worksheets/sheet{}.xml'
 
+    CONTENT_TYPES = '[Content_Types].xml'
+    RELS = '_rels/.rels'
+    WORKBOOK_RELS = 'xl/_rels/workbook.xml.rels'
+
+    NS_PKG_RELS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+    NS_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+    NS_TYPES = 'http://schemas.openxmlformats.org/package/2006/content-types'
+    CT_MAIN = 'application/vnd.openxmlformats-officedocument.spreadsheetml.'
+
+    XML_DECL = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    # Excel keeps 15 significant digits; longer numbers, such as card or
+    # account numbers, are written as strings so no digit is lost.
+    MAX_DIGITS = 15
+    # Characters XML 1.0 does not allow, even escaped.
+    INVALID_XML = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff'
+        u'\ufffe\uffff]')
+    WRITE_BUFFER_ROWS = 1000
+
     EPOCH = datetime.date(1900, 1, 1)
+    DATE_FORMATS = frozenset([14])
+    DIGITS = '0123456789'
+
+    TAG_C = nstag(NS_MAIN, 'c')
+    TAG_CELLXFS = nstag(NS_MAIN, 'cellXfs')
+    TAG_DIMENSION = nstag(NS_MAIN, 'dimension')
+    TAG_IS = nstag(NS_MAIN, 'is')
+    TAG_R = nstag(NS_MAIN, 'r')
+    TAG_ROW = nstag(NS_MAIN, 'row')
+    TAG_SHEET = nstag(NS_MAIN, 'sheet')
+    TAG_SHEETDATA = nstag(NS_MAIN, 'sheetData')
+    TAG_SI = nstag(NS_MAIN, 'si')
+    TAG_T = nstag(NS_MAIN, 't')
+    TAG_V = nstag(NS_MAIN, 'v')
+    TAG_XF = nstag(NS_MAIN, 'xf')
 
     def __init__(self, *args, **kwargs):
         """
@@ -42,6 +83,25 @@ class XLSXParser(Parser):
         self.start_row = kwargs.get('start_row')
         self.end_row = kwargs.get('end_row')
 
+        self._columns = {}
+        # The sheet's own, informational <dimension>; never a bound.
+        self._sheet_dimension = None
+
+    def _num_to_col(self, number):
+        """
+        Convert a zero based column number to an Excel column.
+        :param number [int]: Column number
+        :return [str]: Excel column string
+        """
+        column = ''
+        number += 1
+
+        while number:
+            number, rem = divmod(number - 1, 26)
+            column = chr(ord('A') + rem) + column
+
+        return column
+
     def _col_to_num(self, column):
         """
         Convert an Excel column to a number.
@@ -59,21 +119,19 @@ class XLSXParser(Parser):
         :param cell [Element]: Element Tree Element XLSX Cell
         :return [mixed]: String, Decimal, integer, None, etc...
         """
-        value = cell.find(nstag(self.NS_MAIN, 'v'))
+        value = cell.find(self.TAG_V)
         content = value.text if value is not None else None
+        celltype = cell.get('t')
 
-        if content is None:
+        if celltype == 'inlineStr':
+            display = self._text(cell.find(self.TAG_IS))
+        elif content is None:
             display = content
-        elif cell.attrib.get('t'):
-            display = self._ss_lookup(int(content))
-        elif cell.attrib.get('s'):
-            num_fmt = int(self._xf_lookup(int(cell.attrib.get('s'))))
-            # MVP: Dates (14)
-            if num_fmt == 14:
-                dv = datetime.timedelta(days=int(content))
-                display = (self.EPOCH + dv).strftime('%m/%d/%Y')
-            else:
-                display = content
+        elif celltype == 's':
+            display = self._sharedstrings[int(content)]
+        elif self._xfformats.get(cell.get('s')) == 'date':
+            dv = datetime.timedelta(days=int(content))
+            display = (self.EPOCH + dv).strftime('%m/%d/%Y')
         else:
             display = content
 
@@ -81,12 +139,12 @@ class XLSXParser(Parser):
 
     def _get_sheet(self, archive):
         """
-        Find and open the desired worksheet. Prefer sheet_id over sheet_name.
-        :param archive [ElementTree]: Open workbook archive
-        :return [ElementTree]: Sheet element tree
+        Find the desired worksheet. Prefer sheet_id over sheet_name.
+        :param archive [ZipFile]: Open workbook archive
+        :return [str]: Archive member name of the sheet
         """
         workbook = ElementTree.fromstring(archive.read(self.WORKBOOK))
-        sheets = list(workbook.iter(nstag(self.NS_MAIN, 'sheet')))
+        sheets = list(workbook.iter(self.TAG_SHEET))
 
         if self.sheet_id is not None and self.sheet_name is None:
             if 0 < self.sheet_id <= len(sheets):
@@ -102,18 +160,15 @@ class XLSXParser(Parser):
                 raise InvalidSheetError(self.sheet_name, 'name',
                     options=(x.attrib.get('name') for x in sheets))
 
-        return ElementTree.fromstring(archive.read(self.WORKSHEET.format(sheet)))
+        return self.WORKSHEET.format(sheet)
 
-    def _in_range(self, row):
+    def _in_range(self, index):
         """
         Check to make sure a given row is inside the specified range
         of rows. Return boolean result.
-        :param row [Element]: Element Tree Element to check.  Must have
-            an `r` attribute - the element must be a row.
+        :param index [int]: Zero based row number
         :return [bool]: True if the row is within the range.
         """
-        index = int(row.attrib['r']) - 1
-
         if self.start_row is None and self.end_row is None:
             result = True
 
@@ -134,35 +189,104 @@ class XLSXParser(Parser):
 
         return result
 
-    def _parse_row(self, tree):
+    def _col_range(self, dimension):
+        """
+        Return the columns covered by an Excel range.
+        :param dimension [str]: Excel range notation (A1:B2), or None
+        :return [tuple]: First and last zero based column numbers. The
+            last column is None when there is no upper bound.
+        """
+        if not dimension:
+            return 0, None
+
+        st, _, en = dimension.partition(':')
+        st = self._col_to_num(st.rstrip(self.DIGITS)) - 1
+        en = self._col_to_num(en.rstrip(self.DIGITS)) - 1 if en else st
+
+        return st, en
+
+    def _iter_rows(self, stream):
         """
-        Parse an XML row and return a list of values.
+        Incrementally parse a worksheet, yielding each row in range as soon
+        as its closing tag has been read. Rows are cleared once the caller
+        is done with them, so only one row is held in memory at a time.
+        Rows are stored in order, so parsing stops once end_row has passed.
+        :param stream [File]: Open worksheet XML stream
+        :return [generator]: Row elements
+        """
+        parent = None
+        index = -1
+
+        try:
+            for event, elem in ElementTree.iterparse(stream, events=('start', 'end')):
+                if event == 'start':
+                    if elem.tag == self.TAG_SHEETDATA:
+                        parent = elem
+                    elif elem.tag == self.TAG_DIMENSION:
+                        self._sheet_dimension = elem.get('ref')
+
+                elif elem.tag == self.TAG_ROW:
+                    # The row number is optional; rows then follow on.
+                    ref = elem.get('r')
+                    index = int(ref) - 1 if ref is not None else index + 1
+
+                    if self.end_row is not None and index > self.end_row:
+                        break
+                    if self._in_range(index):
+                        yield elem
+
+                    # Drop processed rows from the tree.
+                    if parent is not None:
+                        parent.clear()
+                    else:
+                        elem.clear()
+        finally:
+            stream.close()
+
+    def _parse_row(self, tree, index=None):
+        """
+        Parse an XML row and return a list of values. Only cells inside the
+        column range are read; the first column of the range is column 0.
         :param tree [Element]: ElementTree Element
-        :param strings [Element]: Shared string lookup
+        :option index [list]: Only decode and return these columns
         :return [list]: Table row
         """
-        st, en = self.dimension.split(':')
-        st = self._col_to_num(''.join(filter(str.isalpha, st)))
-        en = self._col_to_num(''.join(filter(str.isalpha, en)))
-        table_range = range(st, en)
-
-        col = nstag(self.NS_MAIN, 'c')
-        val = nstag(self.NS_MAIN, 'v')
+        first, last = self._bounds
+        columns = self._columns
+        keep = set(index) if index is not None else None
 
         row = []
-        i = 0
-        for cell in tree.iter(col):
-            # Insert blank columns if necessary.
-            xl_col = ''.join(filter(str.isalpha, cell.attrib.get('r')))
-            nm_col = self._col_to_num(xl_col) - 1
+        i = first
+        for cell in tree.iter(self.TAG_C):
+            ref = cell.get('r')
 
+            if ref is None:
+                nm_col = i
+            else:
+                xl_col = ref.rstrip(self.DIGITS)
+                nm_col = columns.get(xl_col)
+                if nm_col is None:
+                    nm_col = columns[xl_col] = self._col_to_num(xl_col) - 1
+
+            if nm_col < first:
+                continue
+            if last is not None and nm_col > last:
+                break
+
+            # Insert blank columns if necessary.
             while i < nm_col:
                 row.append(None)
                 i += 1
 
-            row.append(self._get_display_type(cell))
+            if keep is None or nm_col - first in keep:
+                row.append(self._get_display_type(cell))
+            else:
+                row.append(None)
             i += 1
 
+        if index is not None:
+            row = [row[x] if x < len(row) else None for x in index]
+
         return row
 
     def _set_argparser_options(self):
@@ -190,63 +314,295 @@ class XLSXParser(Parser):
             type=int,
             dest='end_row')
 
-    def _set_sharedstrings(self, tree):
+        self._outparser.add_argument('--outfile-sheet-name',
+            nargs='?',
+            default='Sheet1',
+            dest='sheet_name',
+            help='Name of the worksheet to write. Default Sheet1.')
+        self._outparser.add_argument('--outfile-no-header',
+            action='store_false',
+            dest='hasheader',
+            help='A flag to indicate the header should not be written ' \
+                'as the first row of the sheet.')
+
+    def _set_sharedstrings(self, stream):
         """
-        Set the shared strings lookup.
-        :param tree [Element]: ElementTree element
+        Set the shared strings lookup: a flat list of decoded strings, so a
+        string cell is a single list index. Parsed incrementally; each
+        string element is cleared once its text has been read.
+        :param stream [File]: Open shared strings XML stream, or None if
+            the workbook has no shared strings
         """
-        self._sharedstrings = list(tree.iter(nstag(self.NS_MAIN, 'si')))
+        strings = []
+
+        if stream is not None:
+            for _, elem in ElementTree.iterparse(stream):
+                if elem.tag == self.TAG_SI:
+                    strings.append(self._text(elem))
+                    elem.clear()
+
+        self._sharedstrings = strings
 
     def _set_xfstyles(self, tree):
         """
-        Set the xfstyle lookup.
-        :param tree [Element]: ElemetTree element
+        Set the xfstyle lookup: the format category of each cell style,
+        keyed by the raw `s` attribute so styled cells need no int().
+        :param tree [Element]: ElementTree element
         """
-        xftree = tree.find(nstag(self.NS_MAIN, 'cellXfs'))
-        self._xfstyles = list(xftree.iter(nstag(self.NS_MAIN, 'xf')))
+        xftree = tree.find(self.TAG_CELLXFS)
+        xfs = xftree.iter(self.TAG_XF) if xftree is not None else []
+        formats = {}
 
-    def _ss_lookup(self, index):
-        """
-        Return the shared string value at a given index.
-        :param index [int]: List index
-        :return [str]: Value at index
-        """
-        return self._sharedstrings[index].find(nstag(self.NS_MAIN, 't')).text
+        for i, xf in enumerate(xfs):
+            # MVP: Dates (14)
+            if int(xf.get('numFmtId', 0)) in self.DATE_FORMATS:
+                formats[str(i)] = 'date'
 
-    def _xf_lookup(self, index):
+        self._xfformats = formats
+
+    def _text(self, elem):
         """
-        Return the style value at a given index.
-        :param index [int]: List index
-        :return [int]: Value at index
+        Return the text of a string item, joining rich text runs. Phonetic
+        hints are not part of the value and are skipped.
+        :param elem [Element]: `si` or `is` ElementTree element
+        :return [str]: String value
         """
-        return self._xfstyles[index].attrib['numFmtId']
+        if elem is None:
+            return None
+
+        text = elem.find(self.TAG_T)
+        if text is not None:
+            return text.text or ''
 
-    def read(self, fileobj):
+        return ''.join(t.text or '' for r in elem.findall(self.TAG_R)
+            for t in r.findall(self.TAG_T))
+
+    def read(self, fileobj, columns=None):
         """
-        Open an xlsx archive and read it.
+        Open an xlsx archive and read it. The sheet is parsed lazily, so
+        the file must stay open until the rows have been consumed.
         :param fileobj [File]: Open file object.
+        :option columns [list]: Only read these columns. The header and
+            rows keep the sheet's column order. Default all
         :return [tuple]: header, rows tuple.
         """
         archive = zipfile.ZipFile(fileobj, 'r')
 
-        self._set_sharedstrings(ElementTree.fromstring(archive.read(self.STRINGS)))
-        self._set_xfstyles(ElementTree.fromstring(archive.read(self.XFSTYLE)))
+        names = set(archive.namelist())
+
+        self._set_sharedstrings(archive.open(self.STRINGS)
+            if self.STRINGS in names else None)
+        self._set_xfstyles(ElementTree.fromstring(archive.read(self.XFSTYLE))
+            if self.XFSTYLE in names else ElementTree.Element('styleSheet'))
 
-        sheet = self._get_sheet(archive)
-        table = sheet.iter(nstag(self.NS_MAIN, 'row'))
+        # Only a range given by the caller limits the columns; the sheet's
+        # own dimension element is informational and may be stale.
+        self._bounds = self._col_range(self.dimension)
+        self._sheet_dimension = None
 
-        if self.dimension is None:
-            self.dimension = sheet.find(nstag(self.NS_MAIN, 'dimension')).attrib.get('ref')
+        table = self._iter_rows(archive.open(self._get_sheet(archive)))
+        first = next(table, None)
+        header = self._parse_row(first) if first is not None else []
+        index = None
 
-        rows = [self._parse_row(x) for x in table if self._in_range(x)]
-        header = rows.pop(0)
+        if columns:
+            index = sorted(set(helpers.indexes(header, columns)))
+            header = [header[x] for x in index]
+
+        rows = (self._parse_row(x, index) for x in table)
+
+        self.header = header
+        self.rows = rows
 
         return header, rows
 
-    # XXX Not yet supported
-    #def write(self, fileobj):
-    #    """
-    #    """
+    def _number(self, value):
+        """
+        Decide whether a value is written as a numeric cell. Strings must
+        be numbers by the schema rules, so values with leading zeros such
+        as zip codes stay strings, and no value may lose digits or be
+        infinite or NaN.
+        :param value [mixed]: Cell value
+        :return [str]: The number as text, or None to write a string
+        """
+        if isinstance(value, float):
+            return repr(value) if math.isfinite(value) else None
+        if isinstance(value, decimal.Decimal):
+            if not value.is_finite():
+                return None
+            text = str(value)
+        elif isinstance(value, int):
+            text = str(value)
+        elif isinstance(value, str) and schema.detect(value) in schema.NUMERIC:
+            text = value
+        else:
+            return None
+
+        digits = re.split('[eE]', text)[0].lstrip('+-').replace('.', '')
+        if len(digits.lstrip('0')) > self.MAX_DIGITS:
+            return None
+
+        return text
+
+    def _xmlcell(self, ref, value):
+        """
+        Format one cell. Numbers are written as numeric values and
+        everything else as an inline string, so no shared string table has
+        to be held in memory.
+        :param ref [str]: Cell reference
+        :param value [mixed]: Cell value
+        :return [str]: Cell XML, empty for a blank cell
+        """
+        if value is None or value == '':
+            return ''
+
+        if isinstance(value, bool):
+            return '<c r="{}" t="b"><v>{:d}</v></c>'.format(ref, value)
+
+        number = self._number(value)
+        if number is not None:
+            return '<c r="{}"><v>{}</v></c>'.format(ref, number)
+
+        text = self.INVALID_XML.sub('', str(value))
+
+        return '<c r="{}" t="inlineStr"><is><t xml:space="preserve">{}</t>' \
+            '</is></c>'.format(ref, escape(text))
+
+    def _xmlrow(self, number, row, columns):
+        """
+        Format one row.
+        :param number [int]: One based row number
+        :param row [iter]: Row values
+        :param columns [list]: Cache of column letters, extended as needed
+        :return [str]: Row XML
+        """
+        cells = []
+
+        for i, value in enumerate(row):
+            if i == len(columns):
+                columns.append(self._num_to_col(i))
+            cells.append(self._xmlcell('{}{}'.format(columns[i], number), value))
+
+        return '<row r="{}">{}</row>'.format(number, ''.join(cells))
+
+    def _write_package(self, archive):
+        """
+        Write the minimal workbook parts surrounding a single worksheet.
+        :param archive [ZipFile]: Workbook archive open for writing
+        """
+        name = getattr(self, 'sheet_name', None) or 'Sheet1'
+
+        archive.writestr(self.CONTENT_TYPES, self.XML_DECL +
+            '<Types xmlns="{}">'
+            '<Default Extension="rels" ContentType="application/'
+            'vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/{}" ContentType="{}sheet.main+xml"/>'
+            '<Override PartName="/{}" ContentType="{}worksheet+xml"/>'
+            '<Override PartName="/{}" ContentType="{}styles+xml"/>'
+            '</Types>'.format(self.NS_TYPES,
+                self.WORKBOOK, self.CT_MAIN,
+                self.WORKSHEET.format(1), self.CT_MAIN,
+                self.XFSTYLE, self.CT_MAIN))
+        archive.writestr(self.RELS, self.XML_DECL +
+            '<Relationships xmlns="{}">'
+            '<Relationship Id="rId1" Type="{}/officeDocument" Target="{}"/>'
+            '</Relationships>'.format(self.NS_PKG_RELS, self.NS_REL,
+                self.WORKBOOK))
+        archive.writestr(self.WORKBOOK_RELS, self.XML_DECL +
+            '<Relationships xmlns="{}">'
+            '<Relationship Id="rId1" Type="{}/worksheet" '
+            'Target="worksheets/sheet1.xml"/>'
+            '<Relationship Id="rId2" Type="{}/styles" Target="styles.xml"/>'
+            '</Relationships>'.format(self.NS_PKG_RELS, self.NS_REL,
+                self.NS_REL))
+        archive.writestr(self.WORKBOOK, self.XML_DECL +
+            '<workbook xmlns="{}" xmlns:r="{}"><sheets>'
+            '<sheet name={} sheetId="1" r:id="rId1"/>'
+            '</sheets></workbook>'.format(self.NS_MAIN, self.NS_REL,
+                quoteattr(self.INVALID_XML.sub('', name))))
+        archive.writestr(self.XFSTYLE, self.XML_DECL +
+            '<styleSheet xmlns="{}">'
+            '<fonts count="1"><font/></fonts>'
+            '<fills count="1"><fill/></fills>'
+            '<borders count="1"><border/></borders>'
+            '<cellStyleXfs count="1"><xf/></cellStyleXfs>'
+            '<cellXfs count="1"><xf numFmtId="0"/></cellXfs>'
+            '</styleSheet>'.format(self.NS_MAIN))
+
+    def write(self, fileobj):
+        """
+        Dump an xlsx workbook to an open file handle. Rows are streamed
+        into the worksheet inside the archive as they arrive, so only a
+        small buffer of rows is held in memory.
+        :param fileobj [File]: File object to write to
+        """
+        # Workbooks are binary; write to the buffer behind text streams.
+        fileobj = getattr(fileobj, 'buffer', fileobj)
+        if not _regular(fileobj):
+            fileobj = _Stream(fileobj)
+
+        with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED) as archive:
+            self._write_package(archive)
+
+            member = archive.open(self.WORKSHEET.format(1), 'w',
+                force_zip64=True)
+
+            with member:
+                member.write((self.XML_DECL +
+                    '<worksheet xmlns="{}"><sheetData>'.format(self.NS_MAIN)
+                    ).encode('utf-8'))
+
+                rows = self.rows if self.rows is not None else []
+                if self.header is not None and getattr(self, 'hasheader', True) is not False:
+                    rows = itertools.chain([self.header], rows)
+
+                columns = []
+                buf = []
+                for number, row in enumerate(rows, 1):
+                    buf.append(self._xmlrow(number, row, columns))
+
+                    if len(buf) >= self.WRITE_BUFFER_ROWS:
+                        member.write(''.join(buf).encode('utf-8'))
+                        buf = []
+
+                buf.append('</sheetData></worksheet>')
+                member.write(''.join(buf).encode('utf-8'))
+
+
+def _regular(fileobj):
+    """
+    Whether a file handle is a regular file. Devices such as /dev/null
+    accept seeks but do not report real positions, which corrupts the
+    offsets zipfile records.
+    :param fileobj [File]: File object
+    :return [bool]: False for devices, pipes and sockets
+    """
+    try:
+        return stat.S_ISREG(os.fstat(fileobj.fileno()).st_mode)
+    except (AttributeError, OSError, ValueError):
+        return True
+
+
+class _Stream(object):
+    """
+    Write only view of a file handle that refuses to seek, so zipfile
+    streams the archive with data descriptors instead.
+    """
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+
+    def write(self, data):
+        return self._fileobj.write(data)
+
+    def flush(self):
+        self._fileobj.flush()
+
+    def tell(self):
+        raise OSError('unseekable stream')
+
+    def seek(self, *args):
+        raise OSError('unseekable stream')
 
 
 class InvalidSheetError(Exception):
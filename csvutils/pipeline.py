@@ -0,0 +1,177 @@
+#
+# Pipelined row processing
+#
+
+from __future__ import absolute_import
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+BATCH_SIZE = 1024
+QUEUE_SIZE = 8
+POLL = 0.1
+
+
+class Pipeline(object):
+    """
+    Run the stages of a row stream in their own threads: one pulls rows
+    from the parser, one applies each transform, and the caller, usually
+    a writer, consumes the result. Stages hand batches of rows to each
+    other through bounded queues, so a fast stage waits for a slow one
+    instead of buffering the table, and one stage's I/O or compression
+    overlaps with the others' work. Row order is kept, and an exception
+    raised in any stage is raised again to the caller.
+
+        rows = Pipeline().run(rows, project)
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, queue_size=QUEUE_SIZE):
+        """
+        :option batch_size [int]: Rows per batch
+        :option queue_size [int]: Batches each queue holds
+        """
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+
+    def run(self, rows, *transforms):
+        """
+        Start the stages.
+        :param rows [iter]: Rows, typically lazily read by a parser
+        :param transforms [function]: Functions applied to each row, in
+            order, each in its own stage
+        :return [generator]: Transformed rows
+        """
+        stop = threading.Event()
+        outbox = self._stage(stop, _batches(rows, self.batch_size))
+
+        for func in transforms:
+            batches = _apply(func, _receive(stop, outbox))
+            outbox = self._stage(stop, batches)
+
+        return _rows(stop, outbox)
+
+    def _stage(self, stop, batches):
+        """
+        Start a thread moving batches into a new queue.
+        :param stop [Event]: Set when the consumer goes away
+        :param batches [iter]: Batches to produce; iterated by the thread
+        :return [Queue]: The stage's output queue
+        """
+        outbox = queue.Queue(self.queue_size)
+
+        def produce():
+            try:
+                for batch in batches:
+                    if not _send(stop, outbox, batch):
+                        return
+            except BaseException as e:
+                _send(stop, outbox, _Failure(e))
+                return
+
+            _send(stop, outbox, _DONE)
+
+        thread = threading.Thread(target=produce)
+        thread.daemon = True
+        thread.start()
+
+        return outbox
+
+
+class _Failure(object):
+    """
+    An exception on its way downstream.
+    """
+
+    def __init__(self, error):
+        self.error = error
+
+
+_DONE = object()
+
+
+def _send(stop, outbox, item):
+    """
+    Queue an item, waiting for room unless the pipeline is stopped.
+    :return [bool]: True if the item was queued
+    """
+    while not stop.is_set():
+        try:
+            outbox.put(item, timeout=POLL)
+            return True
+        except queue.Full:
+            pass
+
+    return False
+
+def _receive(stop, inbox):
+    """
+    Yield the batches of a queue until the stage before it is done,
+    raising its exception if it failed.
+    """
+    while not stop.is_set():
+        try:
+            item = inbox.get(timeout=POLL)
+        except queue.Empty:
+            continue
+
+        if item is _DONE:
+            return
+        if isinstance(item, _Failure):
+            raise item.error
+
+        yield item
+
+def _batches(rows, size):
+    """
+    Group rows into lists. The rows before an exception are still
+    yielded before it is raised, so the output stops where it would have
+    without batching.
+    """
+    batch = []
+
+    try:
+        for row in rows:
+            batch.append(row)
+            if len(batch) == size:
+                yield batch
+                batch = []
+    except Exception:
+        if batch:
+            yield batch
+        raise
+
+    if batch:
+        yield batch
+
+def _apply(func, batches):
+    """
+    Apply a function to every row of every batch, passing on the rows
+    before an exception like _batches.
+    """
+    for batch in batches:
+        out = []
+        try:
+            for row in batch:
+                out.append(func(row))
+        except Exception:
+            if out:
+                yield out
+            raise
+
+        yield out
+
+def _rows(stop, inbox):
+    """
+    Yield the rows of the last stage, stopping every stage when the
+    consumer is done with them or fails.
+    """
+    try:
+        for batch in _receive(stop, inbox):
+            for row in batch:
+                yield row
+    finally:
+        stop.set()
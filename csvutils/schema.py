@@ -0,0 +1,200 @@
+#
+# Column type inference
+#
+
+from __future__ import absolute_import
+import datetime
+import decimal
+import itertools
+import re
+
+
+TYPES = ('int', 'decimal', 'float', 'date', 'text')
+NUMERIC = frozenset(['int', 'decimal', 'float'])
+SAMPLE = 1000
+
+# Numeric mode (see helpers.NUMERIC_MODES) that converts each type exactly.
+# Whole numbers widen to decimal past the sample they were inferred from.
+NUMERIC_MODES = {
+    'int': 'int+decimal',
+    'decimal': 'decimal',
+    'float': 'float'}
+
+# Leading zeros mark identifiers such as zip codes, which stay text.
+INT = re.compile(r'[-+]?(0|[1-9]\d*)$')
+DECIMAL = re.compile(r'[-+]?(0|[1-9]\d*)?\.\d+$|[-+]?(0|[1-9]\d*)\.$')
+FLOAT = re.compile(r'[-+]?(\d+\.?\d*|\.\d+)[eE][-+]?\d+$')
+DATES = (
+    (re.compile(r'\d{4}-\d{2}-\d{2}$'), '%Y-%m-%d'),
+    (re.compile(r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}$'), '%Y-%m-%dT%H:%M:%S'),
+    (re.compile(r'\d{2}/\d{2}/\d{4}$'), '%m/%d/%Y'))
+
+# Widening order when a column holds more than one numeric type.
+_RANK = {'int': 0, 'decimal': 1, 'float': 2}
+
+
+def detect(value):
+    """
+    Detect the type of a single value.
+    :param value [mixed]: Cell value
+    :return [str]: One of TYPES, or None for an empty cell
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool):
+        return 'text'
+    if isinstance(value, int):
+        return 'int'
+    if isinstance(value, float):
+        return 'float'
+    if isinstance(value, decimal.Decimal):
+        return 'decimal'
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return 'date'
+
+    value = str(value)
+
+    if INT.match(value):
+        return 'int'
+    if DECIMAL.match(value):
+        return 'decimal'
+    if FLOAT.match(value):
+        return 'float'
+    for pattern, _ in DATES:
+        if pattern.match(value):
+            return 'date'
+
+    return 'text'
+
+def merge(current, new):
+    """
+    Combine the type seen so far in a column with the type of another value.
+    :param current [str]: Column type so far, or None
+    :param new [str]: Type of the next value, or None
+    :return [str]: Combined type
+    """
+    if current is None or current == new:
+        return new if current is None else current
+    if new is None:
+        return current
+    if current in NUMERIC and new in NUMERIC:
+        return current if _RANK[current] > _RANK[new] else new
+
+    return 'text'
+
+
+class Inference(object):
+    """
+    Accumulate column types one row at a time. Once a column is text it
+    can not change, so its values are no longer inspected. `types` holds
+    the type of each column so far, None while a column has no values.
+    """
+
+    def __init__(self, header):
+        """
+        :param header [list]: Header columns
+        """
+        self.header = list(header)
+        self.types = [None] * len(self.header)
+
+    def add(self, row):
+        """
+        Inspect one row.
+        :param row [list]: Table row
+        """
+        types = self.types
+
+        for i, value in zip(range(len(types)), row):
+            if types[i] != 'text':
+                types[i] = merge(types[i], detect(value))
+
+    @property
+    def schema(self):
+        """
+        The inferred schema. Columns without any values are text.
+        :return [dict]: Column name to type
+        """
+        return dict(zip(self.header, (x or 'text' for x in self.types)))
+
+
+def infer(header, rows):
+    """
+    Infer a schema from rows.
+    :param header [list]: Header columns
+    :param rows [iter]: Rows to inspect
+    :return [dict]: Column name to type
+    """
+    inference = Inference(header)
+
+    for row in rows:
+        inference.add(row)
+
+    return inference.schema
+
+def peek(header, rows, sample=SAMPLE):
+    """
+    Infer a schema from the first rows of a stream without losing them.
+    :param header [list]: Header columns
+    :param rows [iter]: Table rows
+    :option sample [int]: Number of rows to inspect
+    :return [tuple]: Schema, rows with the sample put back in front
+    """
+    rows = iter(rows)
+    head = list(itertools.islice(rows, sample))
+
+    return infer(header, head), itertools.chain(head, rows)
+
+def converter(kind):
+    """
+    Return a function converting a cell to a column type. Empty cells
+    become None and cells that do not fit the type are returned unchanged.
+    :param kind [str]: One of TYPES
+    :return [function]: Converter
+    """
+    if kind == 'int':
+        cast = int
+    elif kind in ('decimal', 'float'):
+        # Decimal keeps the value exact for writers as well as arithmetic.
+        cast = decimal.Decimal
+    elif kind == 'date':
+        cast = _todate
+    else:
+        return lambda value: value
+
+    errors = (ValueError, TypeError, decimal.InvalidOperation)
+
+    def convert(value):
+        if value is None or value == '':
+            return None
+
+        try:
+            return cast(value)
+        except errors:
+            return value
+
+    return convert
+
+def converters(schema, header):
+    """
+    Return a converter for each column of a header.
+    :param schema [dict]: Column name to type
+    :param header [list]: Header columns
+    :return [list]: Converter for each column
+    """
+    return [converter(schema.get(x, 'text')) for x in header]
+
+def _todate(value):
+    """
+    Parse a date in one of the DATES formats.
+    :param value [str]: Date string
+    :return [date]: Parsed date or datetime
+    """
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value
+
+    for pattern, fmt in DATES:
+        if pattern.match(value):
+            parsed = datetime.datetime.strptime(value.replace(' ', 'T'), fmt)
+            return parsed.date() if len(value) == 10 else parsed
+
+    raise ValueError(value)
@@ -0,0 +1,296 @@
+#
+# Sidecar row offset index for csv files
+#
+
+from __future__ import absolute_import, division
+from . import helpers
+import array
+import os
+import struct
+import sys
+import zlib
+
+
+SUFFIX = '.idx'
+EVERY = 1000
+BLOCK_SIZE = 1 << 20
+NEWLINE = b'\n'
+
+# Magic, interval, file size, file mtime in ns, end of the last complete
+# record, complete records, crc32 of the bytes just before that end,
+# delimiter.
+MAGIC = b'CSVIDX02'
+HEADER = struct.Struct('<8sIQqQQIc')
+CRC_WINDOW = 4096
+
+
+def path_for(path):
+    """
+    Return the sidecar path of a csv file.
+    :param path [str]: csv file path
+    :return [str]: Index file path
+    """
+    return path + SUFFIX
+
+
+class Index(object):
+    """
+    Byte offsets of every `every`th record of a csv file. Records are
+    split on newlines outside quoted fields, like the csv parser's memory
+    mapped reader, so a row containing quoted newlines counts once. Where
+    a quoted field starts depends on the delimiter, which is stored too.
+    """
+
+    def __init__(self, every=EVERY, delimiter=','):
+        """
+        :option every [int]: Records between indexed offsets
+        :option delimiter [str]: Column delimiter, a single ASCII character
+        """
+        self.every = every
+        self.delimiter = delimiter
+        self.size = 0
+        self.mtime = 0
+        self.end = 0
+        self.records = 0
+        self.crc = 0
+        self.offsets = array.array('Q', [0])
+
+    @property
+    def count(self):
+        """
+        Number of records in the indexed file, including a last record
+        without a trailing newline.
+        :return [int]: Record count
+        """
+        return self.records + (1 if self.end < self.size else 0)
+
+    def locate(self, record):
+        """
+        Find where to start reading to reach a record.
+        :param record [int]: Zero based record number; the header is record 0
+        :return [tuple]: Byte offset of an indexed record at or before it,
+            number of records to skip from there
+        """
+        slot = min(record // self.every, len(self.offsets) - 1)
+
+        return self.offsets[slot], record - slot * self.every
+
+    def extend(self, path):
+        """
+        Scan the part of a file past the last indexed record, e.g. after
+        rows were appended to it.
+        :param path [str]: csv file path
+        :return [Index]: self
+        """
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            mtime = os.fstat(f.fileno()).st_mtime_ns
+            self._scan(f)
+            self.crc = _crc(f, self.end)
+
+        self.size = size
+        self.mtime = mtime
+
+        return self
+
+    def _scan(self, f):
+        """
+        Count records from self.end to the end of the file, which must be
+        at a record boundary, appending the offset of every `every`th.
+        :param f [File]: File open in binary mode
+        """
+        every = self.every
+        offsets = self.offsets
+        records = self.records
+        end = self.end
+        base = end
+        delimiter = self.delimiter.encode('ascii')
+        state = helpers.FIELD
+
+        f.seek(base)
+
+        while True:
+            block = f.read(BLOCK_SIZE)
+            if not block:
+                break
+
+            if state < helpers.QUOTED and helpers.QUOTE not in block:
+                # Every newline ends a record; only find the indexed ones.
+                n = block.count(NEWLINE)
+                if n and (records + n) // every > records // every:
+                    pos = block.find(NEWLINE)
+                    while pos != -1:
+                        records += 1
+                        if records % every == 0:
+                            offsets.append(base + pos + 1)
+                        pos = block.find(NEWLINE, pos + 1)
+                else:
+                    records += n
+
+                if n:
+                    end = base + block.rfind(NEWLINE) + 1
+
+                last = block[-1:]
+                state = helpers.FIELD if last == NEWLINE or \
+                    last == delimiter else helpers.UNQUOTED
+            else:
+                ends, state = helpers.record_ends(block, delimiter, state)
+                for x in ends:
+                    records += 1
+                    end = base + x
+                    if records % every == 0:
+                        offsets.append(end)
+
+            base += len(block)
+
+        self.records = records
+        self.end = end
+
+    def appended(self, path):
+        """
+        Check whether a file still starts with the indexed bytes, i.e. it
+        has only been appended to. Only the bytes just before the last
+        indexed record boundary are compared.
+        :param path [str]: csv file path
+        :return [bool]: True if the index can be extended
+        """
+        if os.path.getsize(path) < self.size:
+            return False
+
+        with open(path, 'rb') as f:
+            return _crc(f, self.end) == self.crc
+
+    def save(self, path):
+        """
+        Write the index next to its csv file, replacing any old index.
+        :param path [str]: csv file path
+        """
+        offsets = array.array('Q', self.offsets)
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+
+        target = path_for(path)
+        partial = target + '.partial'
+
+        with open(partial, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, self.every, self.size, self.mtime,
+                self.end, self.records, self.crc,
+                self.delimiter.encode('ascii')))
+            f.write(offsets.tobytes())
+
+        os.rename(partial, target)
+
+    @classmethod
+    def read(cls, path):
+        """
+        Read the index of a csv file without checking that it is current.
+        :param path [str]: csv file path
+        :return [Index]: The index
+        """
+        with open(path_for(path), 'rb') as f:
+            data = f.read()
+
+        if len(data) < HEADER.size:
+            raise InvalidIndexError(path)
+
+        magic, every, size, mtime, end, records, crc, delimiter = \
+            HEADER.unpack_from(data)
+        if magic != MAGIC or every < 1 or (len(data) - HEADER.size) % 8:
+            raise InvalidIndexError(path)
+
+        index = cls(every, delimiter.decode('ascii', 'replace'))
+        index.size, index.mtime, index.end = size, mtime, end
+        index.records, index.crc = records, crc
+        index.offsets = array.array('Q')
+        index.offsets.frombytes(data[HEADER.size:])
+        if sys.byteorder != 'little':
+            index.offsets.byteswap()
+
+        return index
+
+
+def build(path, every=EVERY, delimiter=','):
+    """
+    Index a csv file from scratch.
+    :param path [str]: csv file path
+    :option every [int]: Records between indexed offsets
+    :option delimiter [str]: Column delimiter
+    :return [Index]: The index
+    """
+    return Index(every, delimiter).extend(path)
+
+def load(path, update=True, delimiter=','):
+    """
+    Load the index of a csv file if it matches the file. An index whose
+    file has only been appended to is extended, and saved again when
+    update is set; an index of a file that changed in any other way, or
+    that was built for another delimiter, is ignored.
+    :param path [str]: csv file path
+    :option update [bool]: Save an extended index
+    :option delimiter [str]: Column delimiter the file is read with
+    :return [Index]: The index, or None if there is no usable index
+    """
+    try:
+        index = Index.read(path)
+        info = os.stat(path)
+    except (IOError, OSError, InvalidIndexError):
+        return None
+
+    if index.delimiter != delimiter:
+        return None
+
+    if info.st_size == index.size and info.st_mtime_ns == index.mtime:
+        return index
+
+    if info.st_size > index.size and index.appended(path):
+        index.extend(path)
+        if update is True:
+            try:
+                index.save(path)
+            except (IOError, OSError):
+                pass
+        return index
+
+    return None
+
+def update(path, every=EVERY, force=False, delimiter=','):
+    """
+    Bring the index of a csv file up to date, extending it when possible
+    and rebuilding it otherwise.
+    :param path [str]: csv file path
+    :option every [int]: Records between indexed offsets for a new index
+    :option force [bool]: Always rebuild
+    :option delimiter [str]: Column delimiter
+    :return [Index]: The index
+    """
+    index = load(path, update=False, delimiter=delimiter) \
+        if force is not True else None
+
+    if index is None or index.every != every:
+        index = build(path, every, delimiter)
+
+    index.save(path)
+
+    return index
+
+def _crc(f, end):
+    """
+    Checksum the bytes just before an offset.
+    :param f [File]: File open in binary mode
+    :param end [int]: Offset
+    :return [int]: crc32
+    """
+    start = max(end - CRC_WINDOW, 0)
+    f.seek(start)
+
+    return zlib.crc32(f.read(end - start)) & 0xffffffff
+
+
+class InvalidIndexError(Exception):
+    MESSAGE = "Index of '{}' is not a csvutils index or is damaged."
+
+    def __init__(self, path):
+        self.path = path
+
+    def __str__(self):
+        return self.MESSAGE.format(self.path)
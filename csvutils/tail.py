@@ -0,0 +1,225 @@
+#
+# Follow growing csv files
+#
+
+from __future__ import absolute_import
+from . import aggregates, helpers, schema
+import csv
+import io
+import itertools
+import os
+import time
+
+
+INTERVAL = 1.0
+BLOCK_SIZE = 1 << 20
+
+
+class Tail(object):
+    """
+    Read the complete records appended to a file since the last read. A
+    trailing partial record, including one whose quoted field is still
+    open, is held back until its newline arrives; the bytes already
+    scanned are not scanned again. A file that shrinks or is replaced is
+    read again from the top.
+    """
+
+    def __init__(self, path, delimiter=b','):
+        """
+        :param path [str]: File path
+        :option delimiter [bytes]: Encoded column delimiter
+        """
+        self.path = path
+        self.delimiter = delimiter
+        self.file = None
+        self.reset()
+
+    def reset(self):
+        """
+        Forget everything read so far and reopen the file.
+        """
+        if self.file is not None:
+            self.file.close()
+
+        self.file = open(self.path, 'rb')
+        self.offset = 0
+        self.pending = b''
+        self.scanned = 0
+        self.state = helpers.FIELD
+        self.drained = True
+
+    def _replaced(self):
+        """
+        Check whether the file was truncated or replaced since it was opened.
+        :return [bool]: True if reading should start over
+        """
+        try:
+            info = os.stat(self.path)
+        except OSError:
+            return False
+
+        current = os.fstat(self.file.fileno())
+
+        return info.st_ino != current.st_ino or current.st_size < self.offset
+
+    def read(self):
+        """
+        Read up to BLOCK_SIZE new bytes and return the complete records
+        among them.
+        :return [tuple]: Records as bytes, True if the file was reset first
+        """
+        reset = self._replaced()
+        if reset:
+            self.reset()
+
+        block = self.file.read(BLOCK_SIZE)
+        self.drained = len(block) < BLOCK_SIZE
+        if not block:
+            return b'', reset
+
+        self.offset += len(block)
+        self.pending += block
+
+        pending = self.pending
+        ends, self.state = helpers.record_ends(pending, self.delimiter,
+            self.state, self.scanned)
+        end = ends[-1] if ends else 0
+
+        self.pending = pending[end:]
+        self.scanned = len(self.pending)
+
+        return pending[:end], reset
+
+    def close(self):
+        self.file.close()
+
+
+def follow(fileobj, pairs, parser, numeric_mode='decimal', interval=INTERVAL,
+  every=None, sleep=time.sleep):
+    """
+    Keep aggregating a csv file as rows are appended to it, like tail -f.
+    Only new complete records are parsed; their states are merged into
+    the running ones. Results are yielded after each poll that found new
+    rows, once the file has been read to its end, or after every `every`
+    rows when set.
+    :param fileobj [File]: Open csv file on disk
+    :param pairs [list]: (column, aggregate) tuples
+    :param parser [CSVParser]: File parser, for its delimiter and header
+    :option numeric_mode [str]: One of helpers.NUMERIC_MODES, or auto to
+        infer the modes from the first rows
+    :option interval [float]: Seconds to wait between polls
+    :option every [int]: Yield after this many rows rather than per poll
+    :option sleep [function]: Called with interval between polls
+    :return [generator]: Lists of (column, aggregate), result tuples
+    """
+    encoding = getattr(fileobj, 'encoding', None) or 'utf-8'
+    source = Tail(fileobj.name, parser.delimiter.encode(encoding))
+    plan = None
+    created = False
+
+    if parser.stats is not None:
+        parser.stats.track(fileobj)
+
+    try:
+        while True:
+            data, reset = source.read()
+            if reset:
+                plan = None
+
+            rows = csv.reader(io.StringIO(data.decode(encoding)),
+                delimiter=parser.delimiter)
+
+            if plan is None:
+                first = next(rows, None)
+                if first is not None:
+                    if parser.hasheader is True:
+                        header = first
+                    else:
+                        header = parser._generic_header(len(first))
+                        rows = itertools.chain([first], rows)
+                    plan = _Plan(header, pairs, numeric_mode, parser.stats)
+                    created = True
+
+            if plan is not None:
+                for _ in plan.add(rows, every):
+                    yield plan.results()
+
+            # After a full block more may be waiting; read it right away,
+            # and only report once caught up with the end of the file.
+            if source.drained:
+                if plan is not None:
+                    # Without `every`, once per poll that found rows.
+                    if every is None and (plan.fresh or created):
+                        yield plan.results()
+                    plan.fresh = 0
+                created = False
+
+                sleep(interval)
+    finally:
+        source.close()
+
+
+class _Plan(object):
+    """
+    Running aggregate state of the tracked columns of a followed file.
+    """
+
+    def __init__(self, header, pairs, numeric_mode, stats=None):
+        self.header = header
+        self.pairs, self.columns, self.variance = \
+            aggregates.plan(header, pairs)
+        self.index = list(helpers.indexes(header, self.columns))
+        self.numeric_mode = numeric_mode
+        self.states = [aggregates.ColumnState(variance=x, convert=None)
+            for x in self.variance]
+        self.stats = stats
+        self.fresh = 0
+        self.since = 0
+
+    def add(self, rows, every=None):
+        """
+        Fold rows into the running states, yielding after every `every`
+        rows when set.
+        """
+        rows = iter(rows)
+
+        if self.numeric_mode == 'auto':
+            sample = list(itertools.islice(rows, schema.SAMPLE))
+            if not sample:
+                return
+            types = schema.infer(self.header, sample)
+            self.numeric_mode = aggregates.modes(self.columns, 'auto', types)
+            rows = itertools.chain(sample, rows)
+
+        while True:
+            size = every - self.since if every else None
+            batch = list(itertools.islice(rows, size))
+            if not batch:
+                return
+
+            partial = aggregates.accumulate(batch, self.index, self.variance,
+                self.numeric_mode)
+            for state, other in zip(self.states, partial):
+                state.merge(other)
+
+            self.fresh += len(batch)
+            self.since += len(batch)
+            if self.stats is not None:
+                self.stats.rows_read += len(batch)
+
+            if every and self.since >= every:
+                self.since = 0
+                yield
+
+    def results(self):
+        return aggregates.results(self.pairs, self.columns, self.states)
+
+
+class UnfollowableFileError(Exception):
+    MESSAGE = "Can not follow '{}'; only csv files on disk can be followed."
+
+    def __init__(self, name):
+        self.name = name
+
+    def __str__(self):
+        return self.MESSAGE.format(self.name)
@@ -13,15 +13,21 @@ setup(
     author='Harry Hubbell',
     url='https://github.com/hhubbell/csvutils',
     packages=['csvutils', 'csvutils.parsers', 'csvutils.parsers.builtins'],
+    extras_require={
+        'numpy': ['numpy']},
     entry_points={
         'console_scripts': [
             'csvavg=csvutils.cli:csvavg',
             'csvconvert=csvutils.cli:csvconvert',
             'csvdrop=csvutils.cli:csvdrop',
+            'csvindex=csvutils.cli:csvindex',
             'csvkeep=csvutils.cli:csvkeep',
+            'csvslice=csvutils.cli:csvslice',
+            'csvstats=csvutils.cli:csvstats',
             'csvsum=csvutils.cli:csvsum',
             'csvtab=csvutils.cli:csvtab'],
         'csvutils.parsers': [
+            'columnar=csvutils.parsers.builtins.columnar:ColumnarParser',
             'csv=csvutils.parsers.builtins.csv:CSVParser',
             'html=csvutils.parsers.builtins.html:HTMLParser',
             'json=csvutils.parsers.builtins.json:JSONParser',